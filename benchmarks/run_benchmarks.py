@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the conversion pipeline on synthetic DICOM series.
+
+Every stage of the pipeline is timed separately for each vendor: DICOM loading, BIDS header creation, header
+compression, grouping, slicing, each compatible converter, NIfTI/json saving and loading, and DICOM export.
+For each stage the best time over the repetitions, the throughput (MB of pixel data per second) and the peak
+resident memory of the process after the stage are reported. Results can be stored as a baseline, and later
+runs compared against it.
+
+The import time of the package and of the dcm2mbids command line tool is measured in fresh interpreters, and
+checked against a time budget.
+
+Examples:
+    python benchmarks/run_benchmarks.py --size small --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --size small --baseline benchmarks/baseline.json --fail-on-regression
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+import pydicom
+
+try:
+    import muscle_bids
+except ImportError:
+    # running from a source checkout
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+    import muscle_bids
+
+from muscle_bids.converters import converter_list
+from muscle_bids.converters.dispatch import find_compatible_converters
+from muscle_bids.dosma_io import DicomReader
+from muscle_bids.utils.headers import (dicom_volume_to_bids, get_default_extraction_plan, group, headers_to_dicts,
+                                       slice_volume_3d, ungroup)
+from muscle_bids.utils.io import load_bids, load_dicom, save_bids, save_dicom
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import SIZES, VENDORS, generate_datasets  # noqa: E402
+
+DEFAULT_TOLERANCE = 0.25
+
+# modules whose import time is measured, and the default budget of each import, in seconds
+IMPORT_MODULES = ['muscle_bids', 'muscle_bids.dcm2mbids']
+DEFAULT_IMPORT_BUDGET = 0.5
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimer:
+    """
+    Runs and times the stages of a benchmark.
+
+    Parameters:
+        repeat (int): number of runs of every stage. The best time is reported
+        trace_memory (bool): also report the peak of the memory allocated during each stage, with tracemalloc
+            (slower)
+    """
+
+    def __init__(self, repeat=3, trace_memory=False):
+        self.repeat = repeat
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, name, function, data_bytes=0):
+        """
+        Runs a stage and records its timing.
+
+        Parameters:
+            name (str): name of the stage
+            function (callable): the stage, called without arguments
+            data_bytes (int): amount of pixel data processed by the stage, for the throughput
+
+        Returns:
+            the result of the last run of the stage
+        """
+        times = []
+        allocated_peak = 0
+        result = None
+        for _ in range(self.repeat):
+            result = None
+            gc.collect()
+            if self.trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+            if self.trace_memory:
+                allocated_peak = max(allocated_peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+
+        self.record(name, times, data_bytes, allocated_peak)
+        return result
+
+    def record(self, name, times, data_bytes=0, allocated_peak=0):
+        """
+        Records the timing of a stage measured by the caller.
+
+        Parameters:
+            name (str): name of the stage
+            times (list): durations of the runs, in seconds
+            data_bytes (int): amount of pixel data processed by the stage, for the throughput
+            allocated_peak (int): peak of the memory allocated during the stage, in bytes
+
+        Returns:
+            dict: the record of the stage
+        """
+        best = min(times)
+        record = {'seconds': best,
+                  'mean_seconds': float(np.mean(times)),
+                  'mb_per_s': data_bytes / 1e6 / best if data_bytes and best > 0 else None,
+                  'peak_rss_mb': _peak_rss_mb()}
+        if self.trace_memory:
+            record['allocated_peak_mb'] = allocated_peak / 1e6
+        self.results[name] = record
+        return record
+
+
+def _groupable(medical_volume, key):
+    # group needs the same number of slices for every value of the key
+    values = medical_volume.bids_header.get(key)
+    if not isinstance(values, list):
+        return False
+    counts = Counter(tuple(value) if isinstance(value, list) else value for value in values)
+    return len(counts) > 1 and len(set(counts.values())) == 1
+
+
+def _import_time(module):
+    """ Time to import a module in a fresh interpreter, in seconds """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(muscle_bids.__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_dir, env.get('PYTHONPATH')]))
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.split()[-1])
+
+
+def benchmark_imports(timer, budget=DEFAULT_IMPORT_BUDGET):
+    """
+    Measures the import time of the package modules in fresh interpreters.
+
+    Parameters:
+        timer (StageTimer): records the import times, as 'import/<module>' stages
+        budget (float): import time budget, in seconds
+
+    Returns:
+        list: the modules whose import takes longer than the budget
+    """
+    over_budget = []
+    for module in IMPORT_MODULES:
+        record = timer.record('import/' + module, [_import_time(module) for _ in range(timer.repeat)])
+        record['budget_seconds'] = budget
+        if record['seconds'] > budget:
+            over_budget.append(module)
+    return over_budget
+
+
+def benchmark_vendor(timer, vendor, dicom_folder, work_dir):
+    """ Runs all the stages of the pipeline on the series of one vendor """
+    prefix = vendor + '/'
+    reader = DicomReader(num_workers=0, group_by='SeriesInstanceUID', ignore_ext=True)
+
+    dicom_volume = timer.run(prefix + 'DicomReader.load', lambda: reader.load(dicom_folder)[0])
+    data_bytes = dicom_volume.volume.nbytes
+    timer.results[prefix + 'DicomReader.load']['mb_per_s'] = data_bytes / 1e6 / timer.results[
+        prefix + 'DicomReader.load']['seconds']
+
+    timer.run(prefix + 'headers_to_dicts', lambda: headers_to_dicts(dicom_volume.headers()), data_bytes)
+    bids_volume = timer.run(prefix + 'dicom_volume_to_bids', lambda: dicom_volume_to_bids(dicom_volume), data_bytes)
+    # reading and extracting only the tags of the BIDS headers, to compare with DicomReader.load + dicom_volume_to_bids
+    extraction_plan = get_default_extraction_plan()
+    timer.run(prefix + 'load_dicom/bids_only', lambda: load_dicom(dicom_folder, extraction_plan=extraction_plan),
+              data_bytes)
+
+    if bids_volume.ndim == 3 and _groupable(bids_volume, 'EchoTime'):
+        grouped = timer.run(prefix + 'group', lambda: group(bids_volume, 'EchoTime'), data_bytes)
+        timer.run(prefix + 'ungroup', lambda: ungroup(grouped), data_bytes)
+
+    n_slices = bids_volume.shape[2]
+    timer.run(prefix + 'slice_volume_3d', lambda: slice_volume_3d(bids_volume, list(range(0, n_slices, 2))),
+              data_bytes // 2)
+
+    outputs = []
+    for converter in find_compatible_converters(bids_volume, converter_list):
+        converted = timer.run(prefix + 'convert/' + converter.__name__,
+                              lambda: converter.convert_dataset(bids_volume), data_bytes)
+        outputs.append((converter, converted))
+
+    for converter, converted in outputs:
+        nii_file = os.path.join(work_dir, vendor, converter.get_directory(),
+                                converter.get_file_name('bench') + '.nii.gz')
+        os.makedirs(os.path.dirname(nii_file), exist_ok=True)
+        output_bytes = converted.volume.nbytes
+        timer.run(prefix + 'save_bids/' + converter.__name__, lambda: save_bids(nii_file, converted), output_bytes)
+        timer.run(prefix + 'load_bids/' + converter.__name__, lambda: load_bids(nii_file), output_bytes)
+
+    if outputs:
+        converter, converted = outputs[0]
+        dicom_out = os.path.join(work_dir, vendor, 'dicom_out')
+
+        def _save_dicom():
+            shutil.rmtree(dicom_out, ignore_errors=True)
+            save_dicom(dicom_out, converted)
+
+        timer.run(prefix + 'save_dicom/' + converter.__name__, _save_dicom, converted.volume.nbytes)
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the stage times with a baseline.
+
+    Parameters:
+        results (dict): stage results of the current run
+        baseline (dict): stage results of the baseline
+        tolerance (float): relative slowdown above which a stage is reported as a regression
+
+    Returns:
+        dict: for every stage of both runs, the ratio of the current time to the baseline time, and whether it is a
+            regression
+    """
+    comparison = {}
+    for name, record in results.items():
+        if name not in baseline:
+            continue
+        ratio = record['seconds'] / baseline[name]['seconds'] if baseline[name]['seconds'] > 0 else float('inf')
+        comparison[name] = {'ratio': ratio, 'regression': ratio > 1 + tolerance}
+    return comparison
+
+
+def print_report(results, comparison=None):
+    comparison = comparison or {}
+    name_width = max(len(name) for name in results)
+    print(f'{"stage":<{name_width}}  {"time (ms)":>10}  {"MB/s":>9}  {"peak RSS (MB)":>13}  {"vs baseline":>11}')
+    for name, record in results.items():
+        throughput = f'{record["mb_per_s"]:9.1f}' if record['mb_per_s'] else f'{"":9}'
+        line = f'{name:<{name_width}}  {record["seconds"] * 1000:10.2f}  {throughput}  {record["peak_rss_mb"]:13.1f}'
+        if name in comparison:
+            line += f'  {comparison[name]["ratio"]:10.2f}x'
+            if comparison[name]['regression']:
+                line += '  REGRESSION'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the conversion pipeline on synthetic DICOM series')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small', help='dataset size preset')
+    parser.add_argument('--rows', type=int, help='override the number of rows of the preset')
+    parser.add_argument('--cols', type=int, help='override the number of columns of the preset')
+    parser.add_argument('--slices', type=int, help='override the number of slices of the preset')
+    parser.add_argument('--echoes', type=int, help='override the number of echoes of the preset')
+    parser.add_argument('--vendors', nargs='+', choices=VENDORS, default=list(VENDORS), help='vendors to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of every stage')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report the memory allocated during each stage (slower)')
+    parser.add_argument('--work-dir', help='folder for the generated data (kept). Defaults to a temporary folder')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='compare with the results stored in this json file')
+    parser.add_argument('--save-baseline', help='store the results as a baseline in this json file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='exit with an error if a stage regressed with respect to the baseline, or if an import '
+                             'exceeds its budget')
+    parser.add_argument('--import-budget', type=float, default=DEFAULT_IMPORT_BUDGET,
+                        help='time budget of the package imports, in seconds')
+    args = parser.parse_args()
+
+    size = dict(SIZES[args.size])
+    for key, value in [('rows', args.rows), ('cols', args.cols), ('n_slices', args.slices),
+                       ('n_echoes', args.echoes)]:
+        if value is not None:
+            size[key] = value
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='mbids_bench_')
+    try:
+        start = time.perf_counter()
+        dicom_folders = generate_datasets(os.path.join(work_dir, 'dicom'), args.vendors, **size)
+        print(f'Generated {", ".join(args.vendors)} series of size {size} in {time.perf_counter() - start:.1f} s')
+
+        timer = StageTimer(args.repeat, args.trace_memory)
+        over_budget = benchmark_imports(timer, args.import_budget)
+        for vendor, folder in dicom_folders.items():
+            benchmark_vendor(timer, vendor, folder, os.path.join(work_dir, 'bids'))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('size') != size:
+            print(f'Warning: the baseline was run with size {baseline.get("size")}')
+        comparison = compare_with_baseline(timer.results, baseline['results'], args.tolerance)
+
+    print_report(timer.results, comparison)
+    for module in over_budget:
+        print(f'Import of {module} exceeds the budget of {args.import_budget} s')
+
+    report = {'size': size,
+              'repeat': args.repeat,
+              'environment': {'python': platform.python_version(),
+                              'numpy': np.__version__,
+                              'pydicom': pydicom.__version__,
+                              'platform': platform.platform(),
+                              'cpu_count': os.cpu_count()},
+              'import_budget': args.import_budget,
+              'results': timer.results}
+    if comparison is not None:
+        report['comparison'] = comparison
+    for file_name in (args.output, args.save_baseline):
+        if file_name:
+            with open(file_name, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.fail_on_regression and (over_budget or
+                                    (comparison and any(c['regression'] for c in comparison.values()))):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Generators of synthetic DICOM series with the structure of the vendor datasets handled by the converters:
+
+- Siemens multi-echo spin echo: one classic MR file per slice and echo
+- GE multi-echo gradient echo: one file per slice, echo and image type (magnitude, phase, real, imaginary),
+  the image type being stored in the private tag 0043102F
+- Philips multi-echo spin echo: a single enhanced MR file with magnitude, phase and T2 map frames
+
+The pixel data follows a mono-exponential T2 decay with noise, so that the converted and fitted outputs are
+plausible. The size of the series is configurable.
+"""
+import os
+
+import numpy as np
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4'
+ENHANCED_MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4.1'
+
+# dataset sizes: rows, columns, slices and echoes
+SIZES = {
+    'small': dict(rows=64, cols=64, n_slices=8, n_echoes=4),
+    'medium': dict(rows=256, cols=256, n_slices=20, n_echoes=8),
+    'large': dict(rows=512, cols=512, n_slices=40, n_echoes=16),
+}
+
+VENDORS = ('siemens', 'ge', 'philips')
+
+SLICE_SPACING = 5.0
+T2_MS = 35.0
+
+
+def _base_dataset(path, sop_class, series_uid, rows, cols, manufacturer):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = series_uid
+    ds.StudyInstanceUID = '1.2.3'
+    ds.PatientName = 'synthetic'
+    ds.PatientID = '0001'
+    ds.Manufacturer = manufacturer
+    ds.Rows = rows
+    ds.Columns = cols
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.InPlanePhaseEncodingDirection = 'ROW'
+    ds.MagneticFieldStrength = 3
+    ds.ImagingFrequency = 127.7
+    ds.PixelBandwidth = 400
+    ds.SliceThickness = SLICE_SPACING
+    return ds
+
+
+def _set_geometry(ds, slice_index):
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.ImagePositionPatient = [-100, -100, SLICE_SPACING * slice_index]
+    ds.PixelSpacing = [1.5, 1.5]
+
+
+def _decay(echo_time, rows, cols, rng):
+    return 1000 * np.exp(-echo_time / T2_MS) + rng.random((rows, cols)) * 10
+
+
+def siemens_mese(folder, rows=64, cols=64, n_slices=8, n_echoes=4, seed=0):
+    """
+    Writes a Siemens multi-echo spin echo series.
+
+    Parameters:
+        folder (str): output folder
+        rows (int): number of rows
+        cols (int): number of columns
+        n_slices (int): number of slices
+        n_echoes (int): number of echoes
+        seed (int): seed of the noise
+
+    Returns:
+        str: the folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    series_uid = generate_uid()
+    rng = np.random.default_rng(seed)
+    instance = 0
+    for echo in range(n_echoes):
+        for slice_index in range(n_slices):
+            instance += 1
+            path = os.path.join(folder, f'IM{instance:05d}.dcm')
+            ds = _base_dataset(path, MR_IMAGE_STORAGE, series_uid, rows, cols, 'SIEMENS')
+            ds.ImageType = ['ORIGINAL', 'PRIMARY', 'M', 'ND']
+            ds.ScanningSequence = 'SE'
+            ds.EchoTrainLength = n_echoes
+            ds.EchoTime = 10.0 * (echo + 1)
+            ds.EchoNumbers = echo + 1
+            ds.FlipAngle = 180
+            ds.InstanceNumber = instance
+            ds.PixelRepresentation = 0
+            _set_geometry(ds, slice_index)
+            ds.PixelData = _decay(ds.EchoTime, rows, cols, rng).astype(np.uint16).tobytes()
+            ds.save_as(path, write_like_original=False)
+    return folder
+
+
+def ge_megre(folder, rows=64, cols=64, n_slices=8, n_echoes=4, seed=1):
+    """
+    Writes a GE multi-echo gradient echo series, with magnitude, phase, real and imaginary images.
+
+    Parameters:
+        folder (str): output folder
+        rows (int): number of rows
+        cols (int): number of columns
+        n_slices (int): number of slices
+        n_echoes (int): number of echoes
+        seed (int): seed of the noise
+
+    Returns:
+        str: the folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    series_uid = generate_uid()
+    rng = np.random.default_rng(seed)
+    instance = 0
+    for slice_index in range(n_slices):
+        for echo in range(n_echoes):
+            echo_time = 1.2 + 1.0 * echo
+            signal = _decay(echo_time, rows, cols, rng) * np.exp(2j * np.pi * 30 * echo_time / 1000)
+            # magnitude, phase (milliradians), real and imaginary parts
+            images = [np.abs(signal), np.angle(signal) * 1000, signal.real, signal.imag]
+            for image_type, image in enumerate(images):
+                instance += 1
+                path = os.path.join(folder, f'IM{instance:05d}.dcm')
+                ds = _base_dataset(path, MR_IMAGE_STORAGE, series_uid, rows, cols, 'GE MEDICAL SYSTEMS')
+                ds.ImageType = ['ORIGINAL', 'PRIMARY', 'OTHER']
+                ds.ScanningSequence = 'GR'
+                ds.EchoTime = echo_time
+                ds.EchoNumbers = echo + 1
+                ds.FlipAngle = 5
+                ds.InstanceNumber = instance
+                ds.PixelRepresentation = 1
+                ds.add_new(0x0043102F, 'SS', image_type)
+                _set_geometry(ds, slice_index)
+                ds.PixelData = np.round(image).astype(np.int16).tobytes()
+                ds.save_as(path, write_like_original=False)
+    return folder
+
+
+def philips_mese(folder, rows=64, cols=64, n_slices=8, n_echoes=4, seed=2):
+    """
+    Writes a Philips enhanced multi-echo spin echo series, with magnitude, phase and T2 map frames.
+
+    Parameters:
+        folder (str): output folder
+        rows (int): number of rows
+        cols (int): number of columns
+        n_slices (int): number of slices
+        n_echoes (int): number of echoes
+        seed (int): seed of the noise
+
+    Returns:
+        str: the folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'mese.dcm')
+    ds = _base_dataset(path, ENHANCED_MR_IMAGE_STORAGE, generate_uid(), rows, cols, 'Philips Medical Systems')
+    ds.ImageType = ['ORIGINAL', 'PRIMARY', 'M_SE', 'M', 'SE']
+    ds.PixelRepresentation = 0
+    rng = np.random.default_rng(seed)
+    frames = []
+    pixel_data = []
+    for kind in ('MAGNITUDE', 'PHASE', 'T2'):
+        for echo in (range(n_echoes) if kind != 'T2' else [0]):
+            echo_time = 10.0 * (echo + 1)
+            for slice_index in range(n_slices):
+                position = Dataset()
+                position.ImagePositionPatient = [-100, -100, SLICE_SPACING * slice_index]
+                orientation = Dataset()
+                orientation.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+                measures = Dataset()
+                measures.PixelSpacing = [1.5, 1.5]
+                measures.SliceThickness = SLICE_SPACING
+                frame_type = Dataset()
+                frame_type.ComplexImageComponent = kind if kind != 'T2' else 'MAGNITUDE'
+                echo_item = Dataset()
+                echo_item.EchoTime = echo_time
+                echo_item.ScanningSequence = 'SE' if kind != 'T2' else 'RM'
+                echo_item.FlipAngle = 90
+
+                frame = Dataset()
+                frame.PlanePositionSequence = Sequence([position])
+                frame.PlaneOrientationSequence = Sequence([orientation])
+                frame.PixelMeasuresSequence = Sequence([measures])
+                frame.MRImageFrameTypeSequence = Sequence([frame_type])
+                frame.MREchoSequence = Sequence([echo_item])
+                frames.append(frame)
+
+                if kind == 'MAGNITUDE':
+                    image = _decay(echo_time, rows, cols, rng)
+                elif kind == 'PHASE':
+                    image = 2048 + rng.random((rows, cols)) * 100
+                else:
+                    image = np.full((rows, cols), T2_MS)
+                pixel_data.append(image.astype(np.uint16))
+    ds.PerFrameFunctionalGroupsSequence = Sequence(frames)
+    ds.NumberOfFrames = len(frames)
+    ds.PixelData = np.stack(pixel_data).tobytes()
+    ds.save_as(path, write_like_original=False)
+    return folder
+
+
+GENERATORS = {
+    'siemens': siemens_mese,
+    'ge': ge_megre,
+    'philips': philips_mese,
+}
+
+
+def generate_datasets(root, vendors=VENDORS, **size):
+    """
+    Writes one synthetic series per vendor in subfolders of root.
+
+    Parameters:
+        root (str): output folder
+        vendors (iterable): vendors to generate, among VENDORS
+        **size: rows, cols, n_slices and n_echoes
+
+    Returns:
+        dict: the folder of every vendor's series
+    """
+    return {vendor: GENERATORS[vendor](os.path.join(root, vendor), **size) for vendor in vendors}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate synthetic DICOM series')
+    parser.add_argument('output', help='output folder')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small', help='dataset size')
+    parser.add_argument('--vendors', nargs='+', choices=VENDORS, default=list(VENDORS), help='vendors to generate')
+    args = parser.parse_args()
+    print(generate_datasets(args.output, args.vendors, **SIZES[args.size]))
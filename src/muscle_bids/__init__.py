@@ -1,2 +1,23 @@
-from .dosma_io import MedicalVolume
-from .utils.io import load_dicom, save_bids, load_dicom_with_subfolders, save_dicom
\ No newline at end of file
+import importlib
+
+# the public names are imported on first access (PEP 562), so that importing the package or one of its
+# submodules does not load the whole I/O stack
+_LAZY_ATTRIBUTES = {
+    'MedicalVolume': 'dosma_io',
+    'load_dicom': 'utils.io',
+    'save_bids': 'utils.io',
+    'load_dicom_with_subfolders': 'utils.io',
+    'save_dicom': 'utils.io',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f'{__name__}.{_LAZY_ATTRIBUTES[name]}'), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -1,7 +1,5 @@
 from collections.abc import Iterable
 
-from bidict import bidict
-
 
 def list_to_item(x):
     return x[0]
@@ -1,6 +1,8 @@
 import os
 from abc import ABC, abstractmethod
 from ..dosma_io import MedicalVolume
+from ..utils.bids_index import get_index
+from .dispatch import SeriesFingerprint, compute_fingerprint
 
 
 class Converter(ABC):
@@ -23,30 +25,59 @@ class Converter(ABC):
         pass
 
     @classmethod
-    @abstractmethod
+    def get_manufacturers(cls):
+        """ Uppercase manufacturer names (matched as substrings) the converter applies to, None for any """
+        return None
+
+    @classmethod
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        """ Tests a series from its fingerprint (see dispatch.compute_fingerprint). None if not implemented """
+        return None
+
+    @classmethod
     def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        pass
+        return bool(cls.is_fingerprint_compatible(compute_fingerprint(med_volume)))
 
     @classmethod
     @abstractmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         pass
 
+    @classmethod
+    def get_dtype_policy(cls):
+        """ On-disk data type of the converted volume ('native', 'float32' or 'int16'), see NiftiWriter """
+        return 'native'
+
+    @classmethod
+    def get_multi_output_converter(cls):
+        """ MultiOutputConverter producing this output together with others in a single pass, None if there is none """
+        return None
+
+    @classmethod
+    def get_version(cls):
+        """ Version of the conversion. Increase it when the output changes, so that incremental runs redo it """
+        return '1'
+
     @classmethod
     def get_file_path(cls, subject_id):
         return os.path.join(subject_id, cls.get_directory(), cls.get_file_name(subject_id))
 
     @classmethod
     def find(cls, path):
-        
-        file_pattern = (cls.get_file_name('') + '.nii.gz').lower()
+        return get_index(path).find_converter(cls, extension='.nii.gz')
 
-        found_files = []
 
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                if f.lower().endswith(file_pattern):
-                    found_files.append(os.path.join(root, f))
+class MultiOutputConverter(ABC):
+    """ Converts a series into the outputs of several converters in a single pass over the source volume """
 
-        return found_files
-            
\ No newline at end of file
+    @classmethod
+    @abstractmethod
+    def get_output_converters(cls):
+        """ The single-output converters whose outputs are produced """
+        pass
+
+    @classmethod
+    @abstractmethod
+    def convert_outputs(cls, med_volume: MedicalVolume, converters=None):
+        """ Returns a dict {converter class: converted volume} for the given converters (default: all of them) """
+        pass
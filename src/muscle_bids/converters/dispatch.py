@@ -0,0 +1,154 @@
+from collections import namedtuple
+
+from ..dosma_io import MedicalVolume, instrumentation
+from ..utils.headers import get_raw_tag_value
+
+SeriesFingerprint = namedtuple('SeriesFingerprint', [
+    'manufacturer',             # uppercase manufacturer name
+    'scanning_sequences',       # set of all the ScanningSequence values of the series
+    'first_scanning_sequence',  # ScanningSequence of the first slice
+    'echo_train_length',        # EchoTrainLength of the first slice, None if missing
+    'echo_times_is_list',       # True if EchoTime varies across the slices
+    'n_echo_times',             # number of distinct positive echo times
+    'image_type',               # set of the ImageType (0008,0008) values, when constant across the slices
+    'ge_image_types',           # set of the GE private image types (0043,102F): 0 magnitude, 1 phase, 2 real, 3 imaginary
+    'frame_image_types',        # set of the ComplexImageComponent (0008,9208) values of enhanced dicoms
+    'ndim'
+])
+
+
+def _flatten(values):
+    """ Returns the set of the leaves of a (possibly nested) list of tag values """
+    if not isinstance(values, list):
+        return {values}
+    flat = set()
+    for value in values:
+        flat.update(_flatten(value))
+    return flat
+
+
+def _get_tag_or_none(med_volume, tag):
+    try:
+        return get_raw_tag_value(med_volume, tag)
+    except KeyError:
+        return None
+
+
+def compute_fingerprint(med_volume: MedicalVolume):
+    """
+    Summarizes the header properties used by the converters to recognize a series.
+    Every per-slice tag list is scanned once, so testing many converters on the fingerprint does not depend on the
+    number of slices.
+
+    Parameters:
+        med_volume (MedicalVolume): the volume with the BIDS headers
+
+    Returns:
+        SeriesFingerprint: the fingerprint of the series
+    """
+    bids_header = med_volume.bids_header
+
+    manufacturer = _get_tag_or_none(med_volume, '00080070')
+    manufacturer = manufacturer[0].upper() if manufacturer else ''
+
+    scanning_sequence = bids_header.get('ScanningSequence')
+    first_scanning_sequence = _get_tag_or_none(med_volume, '00180020')
+    echo_train_length = _get_tag_or_none(med_volume, '00180091')
+
+    echo_times = bids_header.get('EchoTime')
+    if isinstance(echo_times, list):
+        n_echo_times = sum(te > 0. for te in set(echo_times))
+    else:
+        n_echo_times = int(echo_times is not None and echo_times > 0.)
+
+    image_type = _get_tag_or_none(med_volume, '00080008') or []
+    ge_image_types = _get_tag_or_none(med_volume, '0043102F')
+    frame_image_types = _get_tag_or_none(med_volume, '00089208')
+
+    return SeriesFingerprint(
+        manufacturer=manufacturer,
+        scanning_sequences=frozenset(_flatten(scanning_sequence)) if scanning_sequence is not None else frozenset(),
+        first_scanning_sequence=first_scanning_sequence[0] if first_scanning_sequence else None,
+        echo_train_length=echo_train_length[0] if echo_train_length else None,
+        echo_times_is_list=isinstance(echo_times, list),
+        n_echo_times=n_echo_times,
+        image_type=frozenset(x for x in image_type if not isinstance(x, list)),
+        ge_image_types=frozenset(_flatten(ge_image_types)) if ge_image_types is not None else frozenset(),
+        frame_image_types=frozenset(_flatten(frame_image_types)) if frame_image_types is not None else frozenset(),
+        ndim=med_volume.ndim
+    )
+
+
+_converter_index_cache = {}
+
+
+def _get_converter_index(converters):
+    """ Groups the converters by manufacturer. Converters without a manufacturer are tested on every series """
+    index = _converter_index_cache.get(converters)
+    if index is None:
+        index = {}
+        for position, converter_class in enumerate(converters):
+            for manufacturer in converter_class.get_manufacturers() or [None]:
+                index.setdefault(manufacturer, []).append((position, converter_class))
+        _converter_index_cache[converters] = index
+    return index
+
+
+def find_compatible_converters(med_volume: MedicalVolume, converters=None):
+    """
+    Finds all the converters compatible with a volume.
+    The fingerprint of the volume is computed once, and only the converters of the matching manufacturer are tested
+    on it. Converters without a fingerprint predicate fall back to ``is_dataset_compatible``.
+
+    Parameters:
+        med_volume (MedicalVolume): the volume with the BIDS headers
+        converters (list): the converters to test. Defaults to ``converter_list``
+
+    Returns:
+        list: the compatible converters, in the order of ``converters``
+    """
+    if converters is None:
+        from . import converter_list
+        converters = converter_list
+
+    fingerprint = compute_fingerprint(med_volume)
+    candidates = {}
+    for manufacturer, manufacturer_converters in _get_converter_index(tuple(converters)).items():
+        if manufacturer is None or manufacturer in fingerprint.manufacturer:
+            candidates.update(manufacturer_converters)
+
+    compatible = []
+    for position, converter_class in sorted(candidates.items()):
+        is_compatible = converter_class.is_fingerprint_compatible(fingerprint)
+        if is_compatible is None:
+            is_compatible = converter_class.is_dataset_compatible(med_volume)
+        if is_compatible:
+            compatible.append(converter_class)
+    return compatible
+
+
+def iter_conversions(med_volume: MedicalVolume, converters):
+    """
+    Converts a volume with each of the given converters.
+    Converters that belong to the same MultiOutputConverter are converted together in a single pass.
+
+    Parameters:
+        med_volume (MedicalVolume): the volume with the BIDS headers
+        converters (list): the compatible converters, e.g. from ``find_compatible_converters``
+
+    Returns:
+        generator: (converter class, converted volume) pairs, in the order of ``converters``
+    """
+    pending_outputs = {}
+    for converter_class in converters:
+        multi_output_converter = converter_class.get_multi_output_converter()
+        if multi_output_converter is None:
+            with instrumentation.span('convert/' + converter_class.__name__, slices=med_volume.shape[2]):
+                converted_volume = converter_class.convert_dataset(med_volume)
+            yield converter_class, converted_volume
+            continue
+        if converter_class not in pending_outputs:
+            siblings = [c for c in converters if c.get_multi_output_converter() is multi_output_converter]
+            with instrumentation.span('convert/' + multi_output_converter.__name__, slices=med_volume.shape[2]):
+                pending_outputs.update(multi_output_converter.convert_outputs(med_volume, siblings))
+        yield converter_class, pending_outputs.pop(converter_class)
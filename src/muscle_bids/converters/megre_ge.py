@@ -1,46 +1,24 @@
 import os
 
-from .abstract_converter import Converter
+from .abstract_converter import Converter, MultiOutputConverter
 from ..dosma_io import MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, slice_volume_3d, get_manufacturer
+from .dispatch import SeriesFingerprint
+from ..utils.headers import get_raw_tag_value, group, slice_volume_3d, split_volume_3d
 
 
-def _is_megre_ge(med_volume: MedicalVolume):
+def _is_megre_ge(fingerprint: SeriesFingerprint):
     """
-    Check if the given MedicalVolume is a MEGRE GE dataset.
+    Check if the given series is a MEGRE GE dataset.
     Args:
-        med_volume: The MedicalVolume to test.
+        fingerprint: The SeriesFingerprint of the series to test.
 
     Returns:
-        bool: True if the MedicalVolume is a MEGRE GE dataset, False otherwise.
+        bool: True if the series is a MEGRE GE dataset, False otherwise.
     """
-    if 'GE' not in get_manufacturer(med_volume):
+    if 'GE' not in fingerprint.manufacturer:
         return False
 
-    scanning_sequence_list = med_volume.bids_header['ScanningSequence']
-    echo_times_list = med_volume.bids_header['EchoTime']
-    echo_times_unique = set(echo_times_list)
-    n_echo_times = sum(TE > 0. for TE in echo_times_unique)
-
-    if n_echo_times > 1 and 'GR' in scanning_sequence_list:
-        return True
-    return False
-
-
-def _test_ima_type(med_volume: MedicalVolume, ima_type: int):
-    """
-    Test if the given MedicalVolume is of the given type.
-    Args:
-        med_volume (MedicalVolume): The MedicalVolume to test.
-        ima_type (str): The type to test, e.g. "MAGNITUDE", "PHASE"
-
-    Returns:
-        bool: True if the MedicalVolume is of the given type, False otherwise.
-    """
-    ima_type_list = get_raw_tag_value(med_volume, '0043102F')
-    flat_ima_type = [x for xs in ima_type_list for x in xs]
-
-    if ima_type in flat_ima_type:
+    if fingerprint.n_echo_times > 1 and 'GR' in fingerprint.scanning_sequences:
         return True
     return False
 
@@ -115,29 +93,23 @@ class MeGreConverterGEMagnitude(Converter):
         return os.path.join(f'{subject_id}_megre')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if not _is_megre_ge(med_volume):
-            return False
-
-        return _test_ima_type(med_volume, 0)
+    def get_manufacturers(cls):
+        return ['GE']
 
     @classmethod
-    def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['magnitude'])
-        med_volume_out.bids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
-        med_volume_out.bids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if not _is_megre_ge(fingerprint):
+            return False
 
-        # TO DO - incorporate code below into function
-        echo_times_list = med_volume.bids_header['EchoTime']
-        echo_times_nu = [echo_times_list[i] for i in indices['magnitude']]
-        med_volume_out.bids_header['EchoTime'] = echo_times_nu
-        med_volume_out = group(med_volume_out, 'EchoTime')
+        return 0 in fingerprint.ge_image_types
 
-        med_volume_out.bids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
-        med_volume_out.bids_header['WaterFatShift'] = _water_fat_shift_calc(med_volume)
+    @classmethod
+    def get_multi_output_converter(cls):
+        return MeGreConverterGE
 
-        return med_volume_out
+    @classmethod
+    def convert_dataset(cls, med_volume: MedicalVolume):
+        return MeGreConverterGE.convert_outputs(med_volume, [cls])[cls]
 
 
 class MeGreConverterGEPhase(Converter):
@@ -155,28 +127,23 @@ class MeGreConverterGEPhase(Converter):
         return os.path.join(f'{subject_id}_megre_ph')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if not _is_megre_ge(med_volume):
-            return False
-
-        return _test_ima_type(med_volume, 1)
+    def get_manufacturers(cls):
+        return ['GE']
 
     @classmethod
-    def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['phase'])
-        med_volume_out.bids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if not _is_megre_ge(fingerprint):
+            return False
 
-        # TO DO - incorporate code below into function
-        echo_times_list = med_volume.bids_header['EchoTime']
-        echo_times_nu = [echo_times_list[i] for i in indices['phase']]
-        med_volume_out.bids_header['EchoTime'] = echo_times_nu
-        med_volume_out = group(med_volume_out, 'EchoTime')
+        return 1 in fingerprint.ge_image_types
 
-        med_volume_out.bids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
-        med_volume_out.bids_header['WaterFatShift'] = _water_fat_shift_calc(med_volume)
+    @classmethod
+    def get_multi_output_converter(cls):
+        return MeGreConverterGE
 
-        return med_volume_out
+    @classmethod
+    def convert_dataset(cls, med_volume: MedicalVolume):
+        return MeGreConverterGE.convert_outputs(med_volume, [cls])[cls]
 
 
 class MeGreConverterGEReal(Converter):
@@ -194,28 +161,23 @@ class MeGreConverterGEReal(Converter):
         return os.path.join(f'{subject_id}_megre_real')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if not _is_megre_ge(med_volume):
-            return False
-
-        return _test_ima_type(med_volume, 2)
+    def get_manufacturers(cls):
+        return ['GE']
 
     @classmethod
-    def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['real'])
-        med_volume_out.bids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if not _is_megre_ge(fingerprint):
+            return False
 
-        # TO DO - incorporate code below into function
-        echo_times_list = med_volume.bids_header['EchoTime']
-        echo_times_nu = [echo_times_list[i] for i in indices['real']]
-        med_volume_out.bids_header['EchoTime'] = echo_times_nu
-        med_volume_out = group(med_volume_out, 'EchoTime')
+        return 2 in fingerprint.ge_image_types
 
-        med_volume_out.bids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
-        med_volume_out.bids_header['WaterFatShift'] = _water_fat_shift_calc(med_volume)
+    @classmethod
+    def get_multi_output_converter(cls):
+        return MeGreConverterGE
 
-        return med_volume_out
+    @classmethod
+    def convert_dataset(cls, med_volume: MedicalVolume):
+        return MeGreConverterGE.convert_outputs(med_volume, [cls])[cls]
 
 
 class MeGreConverterGEImaginary(Converter):
@@ -233,28 +195,23 @@ class MeGreConverterGEImaginary(Converter):
         return os.path.join(f'{subject_id}_megre_imag')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if not _is_megre_ge(med_volume):
-            return False
-
-        return _test_ima_type(med_volume, 3)
+    def get_manufacturers(cls):
+        return ['GE']
 
     @classmethod
-    def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['imaginary'])
-        med_volume_out.bids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if not _is_megre_ge(fingerprint):
+            return False
 
-        # TO DO - incorporate code below into function
-        echo_times_list = med_volume.bids_header['EchoTime']
-        echo_times_nu = [echo_times_list[i] for i in indices['magnitude']]
-        med_volume_out.bids_header['EchoTime'] = echo_times_nu
-        med_volume_out = group(med_volume_out, 'EchoTime')
+        return 3 in fingerprint.ge_image_types
 
-        med_volume_out.bids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
-        med_volume_out.bids_header['WaterFatShift'] = _water_fat_shift_calc(med_volume)
+    @classmethod
+    def get_multi_output_converter(cls):
+        return MeGreConverterGE
 
-        return med_volume_out
+    @classmethod
+    def convert_dataset(cls, med_volume: MedicalVolume):
+        return MeGreConverterGE.convert_outputs(med_volume, [cls])[cls]
 
 
 class MeGreConverterGEReconstructedMap(Converter):
@@ -273,12 +230,15 @@ class MeGreConverterGEReconstructedMap(Converter):
         return os.path.join(f'{subject_id}_megre_reco')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if 'GE' not in get_manufacturer(med_volume):
+    def get_manufacturers(cls):
+        return ['GE']
+
+    @classmethod
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if 'GE' not in fingerprint.manufacturer:
             return False
-        scanning_sequence_list = med_volume.bids_header['ScanningSequence']
 
-        if 'RM' in scanning_sequence_list:
+        if 'RM' in fingerprint.scanning_sequences:
             return True
         return False
 
@@ -288,3 +248,44 @@ class MeGreConverterGEReconstructedMap(Converter):
         med_volume_out = slice_volume_3d(med_volume, indices['reco'])
         med_volume_out.bids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
         return med_volume_out
+
+
+class MeGreConverterGE(MultiOutputConverter):
+    """ Splits a GE MEGRE series into magnitude, phase, real and imaginary volumes in a single pass """
+
+    @classmethod
+    def get_output_converters(cls):
+        return [MeGreConverterGEMagnitude, MeGreConverterGEPhase, MeGreConverterGEReal, MeGreConverterGEImaginary]
+
+    @classmethod
+    def _get_index_key(cls, converter_class):
+        return {MeGreConverterGEMagnitude: 'magnitude',
+                MeGreConverterGEPhase: 'phase',
+                MeGreConverterGEReal: 'real',
+                MeGreConverterGEImaginary: 'imaginary'}[converter_class]
+
+    @classmethod
+    def convert_outputs(cls, med_volume: MedicalVolume, converters=None):
+        if converters is None:
+            converters = cls.get_output_converters()
+
+        # the index computation, the header remerge and the shared tags are done once for all the outputs
+        indices = _get_image_indices(med_volume)
+        index_lists = [indices[cls._get_index_key(converter_class)] for converter_class in converters]
+        split_volumes = split_volume_3d(med_volume, index_lists)
+
+        echo_times_list = med_volume.bids_header['EchoTime']
+        magnetic_field_strength = get_raw_tag_value(med_volume, '00180087')[0]
+        water_fat_shift = _water_fat_shift_calc(med_volume)
+
+        outputs = {}
+        for converter_class, index_list, med_volume_out in zip(converters, index_lists, split_volumes):
+            med_volume_out.bids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
+            med_volume_out.bids_header['EchoTime'] = [echo_times_list[i] for i in index_list]
+            med_volume_out = group(med_volume_out, 'EchoTime')
+
+            med_volume_out.bids_header['MagneticFieldStrength'] = magnetic_field_strength
+            med_volume_out.bids_header['WaterFatShift'] = water_fat_shift
+            outputs[converter_class] = med_volume_out
+
+        return outputs
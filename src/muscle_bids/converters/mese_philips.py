@@ -3,42 +3,23 @@ import os
 
 from .abstract_converter import Converter
 from ..dosma_io import MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, slice_volume_3d, get_manufacturer
+from .dispatch import SeriesFingerprint
+from ..utils.headers import get_raw_tag_value, group, slice_volume_3d
 
 
-def _is_mese_philips(med_volume: MedicalVolume):
+def _is_mese_philips(fingerprint: SeriesFingerprint):
     """
-    Check if the given MedicalVolume is a MESE Philips dataset.
+    Check if the given series is a MESE Philips dataset.
     Args:
-        med_volume: The MedicalVolume to test.
+        fingerprint: The SeriesFingerprint of the series to test.
 
     Returns:
-        bool: True if the MedicalVolume is a MESE Philips dataset, False otherwise.
+        bool: True if the series is a MESE Philips dataset, False otherwise.
     """
-    if 'PHILIPS' not in get_manufacturer(med_volume):
+    if 'PHILIPS' not in fingerprint.manufacturer:
         return False
-    scanning_sequence_list = med_volume.bids_header['ScanningSequence']
-    echo_times_list = med_volume.bids_header['EchoTime']
-
-    if isinstance(echo_times_list, list) and 'SE' in scanning_sequence_list:
-        return True
-    return False
-
-
-def _test_ima_type(med_volume: MedicalVolume, ima_type: str):
-    """
-    Test if the given MedicalVolume is of the given type.
-    Args:
-        med_volume (MedicalVolume): The MedicalVolume to test.
-        ima_type (str): The type to test, e.g. "MAGNITUDE", "PHASE"
-
-    Returns:
-        bool: True if the MedicalVolume is of the given type, False otherwise.
-    """
-    ima_type_list = get_raw_tag_value(med_volume, '00089208')
-    flat_ima_type = [x for xs in ima_type_list for x in xs]
 
-    if ima_type in flat_ima_type:
+    if fingerprint.echo_times_is_list and 'SE' in fingerprint.scanning_sequences:
         return True
     return False
 
@@ -88,11 +69,15 @@ class MeSeConverterPhilipsMagnitude(Converter):
         return os.path.join(f'{subject_id}_mese')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if not _is_mese_philips(med_volume):
+    def get_manufacturers(cls):
+        return ['PHILIPS']
+
+    @classmethod
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if not _is_mese_philips(fingerprint):
             return False
 
-        return _test_ima_type(med_volume, 'MAGNITUDE')
+        return 'MAGNITUDE' in fingerprint.frame_image_types
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
@@ -119,11 +104,19 @@ class MeSeConverterPhilipsPhase(Converter):
         return os.path.join(f'{subject_id}_mese_ph')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if not _is_mese_philips(med_volume):
+    def get_dtype_policy(cls):
+        return 'float32' # phase in radians does not need double precision
+
+    @classmethod
+    def get_manufacturers(cls):
+        return ['PHILIPS']
+
+    @classmethod
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if not _is_mese_philips(fingerprint):
             return False
 
-        return _test_ima_type(med_volume, 'PHASE')
+        return 'PHASE' in fingerprint.frame_image_types
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
@@ -151,12 +144,15 @@ class MeSeConverterPhilipsReconstructedMap(Converter):
         return os.path.join(f'{subject_id}_t2')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if 'PHILIPS' not in get_manufacturer(med_volume):
+    def get_manufacturers(cls):
+        return ['PHILIPS']
+
+    @classmethod
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if 'PHILIPS' not in fingerprint.manufacturer:
             return False
-        scanning_sequence_list = med_volume.bids_header['ScanningSequence']
 
-        if 'RM' in scanning_sequence_list:
+        if 'RM' in fingerprint.scanning_sequences:
             return True
         return False
 
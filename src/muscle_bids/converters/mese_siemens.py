@@ -2,7 +2,8 @@ import os
 
 from .abstract_converter import Converter
 from ..dosma_io import MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, get_manufacturer
+from .dispatch import SeriesFingerprint
+from ..utils.headers import group
 
 
 class MeSeConverterSiemensMagnitude(Converter):
@@ -20,20 +21,22 @@ class MeSeConverterSiemensMagnitude(Converter):
         return os.path.join(f'{subject_id}_mese')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if 'SIEMENS' not in get_manufacturer(med_volume):
+    def get_manufacturers(cls):
+        return ['SIEMENS']
+
+    @classmethod
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if 'SIEMENS' not in fingerprint.manufacturer:
             return False
 
         # check if magnitude
-        if 'M' not in get_raw_tag_value(med_volume, '00080008'):
+        if 'M' not in fingerprint.image_type:
             return False
 
+        scanning_sequence = fingerprint.first_scanning_sequence
+        echo_train_length = fingerprint.echo_train_length
 
-        scanning_sequence = get_raw_tag_value(med_volume, '00180020')[0]
-        echo_train_length = get_raw_tag_value(med_volume, '00180091')[0]
-        # echo_times = get_raw_tag_value(med_volume, 'EchoTime')
-
-        if scanning_sequence == 'SE' and echo_train_length > 1: #maybe scanning_sequence is Siemens-specific?
+        if scanning_sequence == 'SE' and echo_train_length is not None and echo_train_length > 1: #maybe scanning_sequence is Siemens-specific?
             return True
 
         return False
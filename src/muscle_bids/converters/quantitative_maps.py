@@ -2,6 +2,7 @@ import os
 from abc import abstractmethod
 
 from .abstract_converter import Converter
+from .dispatch import SeriesFingerprint
 from ..dosma_io import MedicalVolume
 from ..utils.headers import get_raw_tag_value, group, reduce, copy_volume_with_bids_headers
 
@@ -26,8 +27,8 @@ class AbstractQuantitativeConverter(Converter):
         return os.path.join(f'{subject_id}_{cls._get_tag()}')
 
     @classmethod
-    def is_dataset_compatible(cls, med_volume: MedicalVolume):
-        if med_volume.ndim == 3:
+    def is_fingerprint_compatible(cls, fingerprint: SeriesFingerprint):
+        if fingerprint.ndim == 3:
             return True
         else:
             return False
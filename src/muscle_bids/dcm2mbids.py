@@ -1,18 +1,191 @@
 #!/usr/bin/env python3
 
 import sys
-from .utils.io import load_dicom, save_bids, load_dicom_with_subfolders
+from .utils.io import load_dicom, save_bids, find_dicom_series, iter_dicom_series, move_bids, remove_bids
+from .utils.headers import get_default_extraction_plan
+from .utils.manifest import ConversionManifest
 from .converters import converter_list
+from .dosma_io import instrumentation
+from .converters.dispatch import find_compatible_converters, iter_conversions
+from .fitting import fit_stages
+import functools
+import multiprocessing as mp
+import os
 import pathlib
+import traceback
 
 import argparse
 
+
+def convert_volume(med_volume, output_dir, anon_name=None, dtype_policy=None, log=print, staging_tag=None,
+                   fit=None, fit_workers=0):
+    """
+    Converts a volume with all the compatible converters and saves the results.
+
+    Parameters:
+        med_volume (MedicalVolume): the volume with the BIDS headers
+        output_dir (str): root of the BIDS output
+        anon_name (str): pseudo name used as patient name, None to keep the original name
+        dtype_policy (str): on-disk data type, None for the default of each converter
+        log (callable): called with the progress messages
+        staging_tag (str): if given, the outputs are saved to temporary names containing the tag and must
+            be moved to their final name by the caller
+        fit (list): names of the fitting stages (see fitting.fit_stages) applied to the converted volumes
+        fit_workers (int): number of processes used by the fitting stages
+
+    Returns:
+        list: (converter class, saved path, final path) tuples
+    """
+    if anon_name:
+        patient_name = anon_name
+    else:
+        patient_name = med_volume.patient_header['PatientName']
+
+    def _save(converter_class, converted_volume):
+        output_path = pathlib.Path(output_dir) / converter_class.get_directory()
+        output_path.mkdir(parents=True, exist_ok=True)
+        output_base_name = str(output_path / converter_class.get_file_name(patient_name))
+        final_file = output_base_name + '.nii.gz'
+        saved_file = final_file if staging_tag is None else f'{output_base_name}.{staging_tag}.nii.gz'
+        save_bids(saved_file, converted_volume, dtype_policy or converter_class.get_dtype_policy())
+        outputs.append((converter_class, saved_file, final_file))
+
+    outputs = []
+    compatible_converters = find_compatible_converters(med_volume, converter_list)
+    compatible_paths = {(c.get_directory(), c.get_file_name(patient_name)) for c in compatible_converters}
+    stages = [fit_stages[name] for name in fit or []]
+    # converted volumes are kept for the end of the series only if a fitting stage needs them
+    fit_inputs = {c for stage in stages for input_set in stage.input_sets for c in input_set}
+    converted_volumes = {}
+    for converter_class, converted_volume in iter_conversions(med_volume, compatible_converters):
+        log('Volume compatible with', converter_class.get_name())
+        _save(converter_class, converted_volume)
+        log('Volume saved')
+        if converter_class in fit_inputs:
+            converted_volumes[converter_class] = converted_volume
+
+    for stage in stages:
+        for input_set in stage.input_sets:
+            if not all(c in converted_volumes for c in input_set):
+                continue
+            if (stage.output_converter.get_directory(), stage.output_converter.get_file_name(patient_name)) in compatible_paths:
+                log('Skipping', stage.name, 'fit: the map is provided by the scanner')
+                break
+            with instrumentation.span('fit/' + stage.name):
+                fitted_volume = stage.fit_function(*[converted_volumes[c] for c in input_set], workers=fit_workers)
+            _save(stage.output_converter, fitted_volume)
+            log('Fitted', stage.name, 'map saved')
+            break
+    return outputs
+
+
+def _remove_staged_outputs(output_dir, staging_tag):
+    """ Removes the outputs saved with a staging tag, e.g. by a conversion that failed before returning them """
+    for nii_file in pathlib.Path(output_dir).rglob(f'*.{staging_tag}.nii.gz'):
+        remove_bids(str(nii_file))
+
+
+def _convert_series(work_item, output_dir, anon_name, dtype_policy, fit, staging_prefix, profile=False,
+                    bids_only=False):
+    """
+    Worker of the process pool: loads and converts one series, collecting the log messages and, if profile is
+    True, the profiling spans. If bids_only is True, only the tags of the default extraction plan are read.
+    The outputs are staged with the tag f'{staging_prefix}s{series_index}'. A failed conversion removes the
+    outputs it staged and returns its traceback instead of raising, so that the other series are still collected
+    """
+    series_index, file_list = work_item
+    messages = []
+    profiler = instrumentation.enable_profiling() if profile else None
+    staging_tag = f'{staging_prefix}s{series_index}'
+    try:
+        with instrumentation.series(file_list[0]):
+            med_volume = load_dicom(file_list, extraction_plan=get_default_extraction_plan() if bids_only else None)
+            outputs = convert_volume(med_volume, output_dir, anon_name, dtype_policy,
+                                     log=lambda *args: messages.append(' '.join(map(str, args))),
+                                     staging_tag=staging_tag, fit=fit)
+        error = None
+    except Exception:
+        _remove_staged_outputs(output_dir, staging_tag)
+        outputs = []
+        error = traceback.format_exc()
+    return messages, outputs, profiler.records if profiler is not None else None, error
+
+
+def convert_parallel(series_list, output_dir, anon_name=None, dtype_policy=None, jobs=None, manifest=None, fit=None,
+                     bids_only=False):
+    """
+    Converts dicom series in a process pool, one series per task.
+
+    Every worker saves its outputs under temporary names, so that two series mapping to the same output
+    file never write it concurrently. The results are collected in series order: the log is printed and the
+    outputs are moved to their final names in the same order as in the serial conversion, so a file
+    produced by several series ends up with the same content.
+
+    Parameters:
+        series_list (list): file lists, one per series, as returned by find_dicom_series
+        output_dir (str): root of the BIDS output
+        anon_name (str): pseudo name used as patient name, None to keep the original name
+        dtype_policy (str): on-disk data type, None for the default of each converter
+        jobs (int): number of processes, None for all the cores
+        manifest (ConversionManifest): if given, every converted series is recorded in it
+        fit (list): names of the fitting stages applied to the converted volumes
+        bids_only (bool): only read the tags of the BIDS and patient headers (see utils.headers.TagExtractionPlan)
+
+    If profiling is enabled (see dosma_io.instrumentation), the spans recorded by the workers are added to the
+    profiler of the calling process.
+
+    A series that fails is reported and its staged outputs are removed, while the other series are still moved and
+    recorded in the manifest, so that a new run only converts the failed series again. RuntimeError is raised
+    at the end if any series failed.
+    """
+    profiler = instrumentation.get_profiler()
+    staging_prefix = f'tmp{os.getpid()}'
+    worker = functools.partial(_convert_series, output_dir=output_dir, anon_name=anon_name,
+                               dtype_policy=dtype_policy, fit=fit, staging_prefix=staging_prefix,
+                               profile=profiler is not None, bids_only=bids_only)
+    failed_series = []
+    n_collected = 0
+    try:
+        with mp.Pool(jobs) as pool:
+            for file_list, (messages, outputs, records, error) in zip(series_list,
+                                                                      pool.imap(worker, enumerate(series_list))):
+                for message in messages:
+                    print(message)
+                if records:
+                    profiler.extend(records)
+                if error is not None:
+                    print('Conversion of series in', os.path.dirname(file_list[0]), 'failed:', error, file=sys.stderr)
+                    failed_series.append(file_list[0])
+                else:
+                    for converter_class, saved_file, final_file in outputs:
+                        if saved_file != final_file:
+                            move_bids(saved_file, final_file)
+                    if manifest is not None:
+                        manifest.record(file_list, [(c, final_file) for c, _, final_file in outputs])
+                n_collected += 1
+    finally:
+        # if the run is interrupted, the series that were not collected leave no files under temporary names
+        for series_index in range(n_collected, len(series_list)):
+            _remove_staged_outputs(output_dir, f'{staging_prefix}s{series_index}')
+
+    if failed_series:
+        raise RuntimeError(f'{len(failed_series)} series failed to convert: ' + ', '.join(failed_series))
+
+
 def main():
     parser = argparse.ArgumentParser(description='Convert DICOM to BIDS format')
     parser.add_argument('input_folder', type=str, help='Input folder')
     parser.add_argument('output_folder', type=str, help='Output folder')
     parser.add_argument('--anonymize', '-a', const='anon', metavar='pseudo_name', dest='anonymize', type=str, nargs = '?', help='Use the pseudo_name (default: anon) as patient name')
     parser.add_argument('--recursive', '-r', action='store_true', help='Recurse into subfolders')
+    parser.add_argument('--dtype', choices=['native', 'float32', 'int16'], default=None, help='On-disk data type of the converted volumes (default: chosen by each converter)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N', help='Convert N series in parallel processes (default: 1, 0: all cores)')
+    parser.add_argument('--max-in-flight', type=int, default=1, metavar='N', help='Number of series read ahead while converting (default: 1, 0: no read-ahead)')
+    parser.add_argument('--fit', action='append', choices=sorted(fit_stages), default=None, help='Compute a quantitative map from the converted data (can be repeated)')
+    parser.add_argument('--fit-workers', type=int, default=0, metavar='N', help='Number of processes used for fitting (default: 0, fit in the converting process)')
+    parser.add_argument('--force', '-f', action='store_true', help='Convert all series, even if the manifest of the output folder shows they are up to date')
+    parser.add_argument('--bids-only', action='store_true', help='Only read the DICOM tags of the BIDS and patient headers. Faster, but the extra headers are partial and the outputs cannot be converted back to DICOM')
+    parser.add_argument('--profile', type=str, default=None, metavar='report.json', help='Write the time, CPU, I/O and memory of every conversion stage, per series, to a json report')
 
     args = parser.parse_args()
 
@@ -20,24 +193,47 @@ def main():
     outputDir = args.output_folder
     ANON_NAME = args.anonymize
     RECURSIVE = args.recursive
+    DTYPE_POLICY = args.dtype
+    JOBS = args.jobs
+    MAX_IN_FLIGHT = args.max_in_flight
+    FORCE = args.force
+    FIT = args.fit
+    FIT_WORKERS = args.fit_workers
+    PROFILE = args.profile
+    BIDS_ONLY = args.bids_only
 
-    if RECURSIVE:
-        med_volume_list = load_dicom_with_subfolders(inputDir)
-    else:
-        med_volume_list = [load_dicom(inputDir)]
-
-    for med_volume in med_volume_list:
-        for converter_class in converter_list:
-            if converter_class.is_dataset_compatible(med_volume):
-                print('Volume compatible with', converter_class.get_name())
-                output_path = pathlib.Path(outputDir) / converter_class.get_directory()
-                output_path.mkdir(parents=True, exist_ok=True)
-                converted_volume = converter_class.convert_dataset(med_volume)
-                if ANON_NAME:
-                    patient_name = ANON_NAME
-                else:
-                    patient_name = med_volume.patient_header['PatientName']
-                save_bids(str(output_path / converter_class.get_file_name(patient_name)) + '.nii.gz', converted_volume)
-                print('Volume saved')
+    # the spans are recorded only if a report is requested
+    profiler = instrumentation.enable_profiling() if PROFILE else None
+
+    # series converted with the same inputs and settings in a previous run are skipped
+    settings = {'anonymize': ANON_NAME,
+                'dtype': DTYPE_POLICY,
+                'fit': sorted(FIT or []),
+                'converters': {c.get_name(): c.get_version() for c in converter_list}}
+    if BIDS_ONLY:
+        # the extra headers differ: switching the option converts the series again
+        settings['bids_only'] = True
+    manifest = ConversionManifest(outputDir, settings)
+    series_list = []
+    for file_list in find_dicom_series(inputDir, RECURSIVE):
+        if not FORCE and manifest.is_up_to_date(file_list):
+            print('Series in', os.path.dirname(file_list[0]), 'is up to date, skipping')
+            continue
+        series_list.append(file_list)
 
+    if JOBS != 1:
+        # each process converts a whole series: the fits run serially inside it
+        convert_parallel(series_list, outputDir, ANON_NAME, DTYPE_POLICY, JOBS or None, manifest, FIT, BIDS_ONLY)
+    else:
+        # one series at a time: each one is released after it is written
+        extraction_plan = get_default_extraction_plan() if BIDS_ONLY else None
+        for file_list, med_volume in zip(series_list, iter_dicom_series(series_list, MAX_IN_FLIGHT, extraction_plan)):
+            with instrumentation.series(file_list[0]):
+                outputs = convert_volume(med_volume, outputDir, ANON_NAME, DTYPE_POLICY, fit=FIT,
+                                         fit_workers=FIT_WORKERS)
+            manifest.record(file_list, [(c, final_file) for c, _, final_file in outputs])
 
+    if profiler is not None:
+        instrumentation.disable_profiling()
+        profiler.save_report(PROFILE)
+        print('Profiling report written to', PROFILE)
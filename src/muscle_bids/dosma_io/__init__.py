@@ -1,19 +1,61 @@
-from . import io
+import importlib
 
-from . import (
-    device,
-    med_volume,
-    numpy_routines,
-    orientation
-)
+# The submodules are imported on first access (PEP 562), so that importing the package does not
+# load nibabel, pydicom, h5py and the optional array libraries until they are needed.
+_SUBMODULES = [
+    "chunked",
+    "device",
+    "instrumentation",
+    "io",
+    "med_volume",
+    "numpy_routines",
+    "orientation",
+    "shared",
+]
 
-from .device import *  # noqa
-from .io import *  # noqa
-from .med_volume import *  # noqa
-from .orientation import *  # noqa
+# public name -> submodule defining it
+_LAZY_ATTRIBUTES = {
+    "ChunkedArray": "chunked",
+    "Device": "device",
+    "get_device": "device",
+    "to_device": "device",
+    "DicomReader": "io",
+    "DicomWriter": "io",
+    "ImageDataFormat": "io",
+    "get_reader": "io",
+    "get_writer": "io",
+    "get_filepath_variations": "io",
+    "convert_image_data_format": "io",
+    "generic_load": "io",
+    "NiftiReader": "io",
+    "NiftiWriter": "io",
+    "DTYPE_POLICIES": "io",
+    "MedicalVolume": "med_volume",
+    "to_affine": "orientation",
+    "get_transpose_inds": "orientation",
+    "get_flip_inds": "orientation",
+    "orientation_nib_to_standard": "orientation",
+    "orientation_standard_to_nib": "orientation",
+    "SAGITTAL": "orientation",
+    "CORONAL": "orientation",
+    "AXIAL": "orientation",
+    "SharedVolumeHandle": "shared",
+    "share_volume": "shared",
+}
 
-__all__ = ["numpy_routines"]
-__all__.extend(device.__all__)
-__all__.extend(io.__all__)
-__all__.extend(med_volume.__all__)
-__all__.extend(orientation.__all__)
+__all__ = ["instrumentation", "numpy_routines"]
+__all__.extend(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f"{__name__}.{_LAZY_ATTRIBUTES[name]}"), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES) | set(_LAZY_ATTRIBUTES))
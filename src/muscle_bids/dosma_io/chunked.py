@@ -0,0 +1,494 @@
+"""Out-of-core arrays backed by HDF5 datasets.
+
+A :class:`ChunkedArray` refers to an array stored on disk and is processed in blocks along the
+first axis, so that only one block per worker is in memory at a time. It can be used as the
+volume of a :class:`MedicalVolume`:
+
+    >>> data = ChunkedArray.from_array(np.random.rand(300, 300, 40, 8), "volume.h5")
+    >>> mv = MedicalVolume(data, np.eye(4))
+    >>> mean_echo = np.mean(mv, axis=-1)  # computed block by block
+    >>> scaled = mv * 2  # written block by block to a temporary file
+
+Reductions (``sum``, ``mean``, ``std``, ``min``, ``max``, their ``nan`` variants, ``all``,
+``any`` and the ``arg`` variants) and element-wise ufuncs are computed block by block.
+Slicing returns an in-memory array of the requested region. Other numpy functions load the
+whole array.
+"""
+import os
+import tempfile
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from numbers import Number
+
+import numpy as np
+
+from . import env
+
+# h5py is imported by the functions that need it, so that importing this module is cheap
+
+__all__ = ["ChunkedArray"]
+
+# default number of bytes of a block processed at once
+DEFAULT_BLOCK_BYTES = 16 << 20
+
+# default number of bytes of an HDF5 storage chunk
+_STORAGE_CHUNK_BYTES = 1 << 20
+
+# reductions that can be combined across blocks by applying a reduction to the block results
+_COMBINABLE_REDUCTIONS = {
+    np.sum: np.sum,
+    np.amin: np.amin,
+    np.amax: np.amax,
+    np.min: np.amin,
+    np.max: np.amax,
+    np.nansum: np.sum,
+    np.nanmin: np.nanmin,
+    np.nanmax: np.nanmax,
+    np.all: np.all,
+    np.any: np.any,
+}
+
+# ufunc.reduce methods equivalent to the reductions above
+_UFUNC_REDUCTIONS = {
+    np.add: np.sum,
+    np.minimum: np.amin,
+    np.maximum: np.amax,
+    np.logical_and: np.all,
+    np.logical_or: np.any,
+}
+
+# reductions based on the first two moments: (ignore nans, return the standard deviation or the variance)
+_MOMENT_REDUCTIONS = {
+    np.mean: (False, None),
+    np.std: (False, True),
+    np.var: (False, False),
+    np.nanmean: (True, None),
+    np.nanstd: (True, True),
+    np.nanvar: (True, False),
+}
+
+# reductions returning indices
+_ARG_REDUCTIONS = (np.argmin, np.argmax, np.nanargmin, np.nanargmax)
+
+# element-wise functions that are not ufuncs
+_ELEMENTWISE_FUNCTIONS = (np.around, np.round, np.round_, np.clip, np.nan_to_num)
+
+
+def _remove_file(file_path):
+    if os.path.isfile(file_path):
+        os.remove(file_path)
+
+
+class ChunkedArray(np.lib.mixins.NDArrayOperatorsMixin):
+    """An array stored in an HDF5 dataset, processed in blocks along the first axis.
+
+    The dataset is opened lazily in every process, so that chunked arrays can be pickled and
+    sent to process pools.
+
+    Args:
+        file_path (str): Path to the HDF5 file.
+        dataset (str, optional): Name of the dataset in the file.
+        block_size (int, optional): Number of entries along the first axis processed at once.
+            Defaults to blocks of about 16 MB.
+        workers (int, optional): Number of threads processing the blocks. ``0`` processes them
+            in the calling thread.
+        temp_dir (str, optional): Directory of the files storing the results of element-wise
+            operations. Defaults to the system temporary directory.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        dataset: str = "volume",
+        block_size: int = None,
+        workers: int = 0,
+        temp_dir: str = None,
+    ):
+        if not env.package_available("h5py"):
+            raise ImportError("h5py is required for chunked arrays")
+        import h5py
+
+        self.file_path = file_path
+        self.dataset = dataset
+        self.workers = workers
+        self.temp_dir = temp_dir
+        self._file = None
+        self._finalizer = None
+
+        with h5py.File(file_path, "r") as f:
+            data = f[dataset]
+            self.shape = tuple(data.shape)
+            self.dtype = data.dtype
+
+        if block_size is None:
+            row_bytes = max(1, int(np.prod(self.shape[1:], dtype=np.int64)) * self.dtype.itemsize)
+            block_size = max(1, DEFAULT_BLOCK_BYTES // row_bytes)
+        self.block_size = block_size
+
+    @classmethod
+    def from_array(cls, array, file_path: str, dataset: str = "volume", **kwargs) -> "ChunkedArray":
+        """Writes an array (or a chunked array) to an HDF5 file, block by block.
+
+        Args:
+            array (array-like): The data.
+            file_path (str): Path to the HDF5 file. It is overwritten.
+            dataset (str, optional): Name of the dataset in the file.
+            **kwargs: Keyword arguments of :class:`ChunkedArray`.
+
+        Returns:
+            ChunkedArray: The chunked array.
+        """
+        if not isinstance(array, ChunkedArray):
+            array = np.asarray(array)
+        import h5py
+
+        _create_dataset(file_path, dataset, array.shape, array.dtype)
+        with h5py.File(file_path, "r+") as f:
+            data = f[dataset]
+            if isinstance(array, ChunkedArray):
+                for block_slice, block in array.iter_blocks():
+                    data[block_slice] = block
+            elif array.ndim:
+                data[...] = array
+        return cls(file_path, dataset, **kwargs)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_finalizer"] = None
+        return state
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(file_path={self.file_path!r}, dataset={self.dataset!r}, "
+            f"shape={self.shape}, dtype={self.dtype})"
+        )
+
+    def _data(self):
+        if self._file is None:
+            import h5py
+
+            self._file = h5py.File(self.file_path, "r")
+        return self._file[self.dataset]
+
+    def close(self):
+        """Closes the HDF5 file. It is reopened when needed."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _block_slices(self):
+        if self.ndim == 0:
+            return [()]
+        return [
+            slice(start, min(start + self.block_size, self.shape[0]))
+            for start in range(0, self.shape[0], self.block_size)
+        ]
+
+    def iter_blocks(self):
+        """Yields ``(block_slice, block)`` pairs, with the blocks along the first axis in memory."""
+        for block_slice in self._block_slices():
+            yield block_slice, self._data()[block_slice]
+
+    def _iter_map_blocks(self, block_function, block_slices=None):
+        """Yields ``block_function(block_slice, block)`` for every block, in order.
+
+        With workers, a bounded number of blocks is processed ahead, so that the memory stays
+        proportional to the number of workers.
+        """
+
+        def _process(block_slice):
+            return block_function(block_slice, self._data()[block_slice])
+
+        if block_slices is None:
+            block_slices = self._block_slices()
+        if not self.workers or len(block_slices) < 2:
+            for block_slice in block_slices:
+                yield _process(block_slice)
+            return
+
+        # reads are serialized by h5py, the computations run in parallel
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(block_slices))) as executor:
+            pending = deque()
+            for block_slice in block_slices:
+                pending.append(executor.submit(_process, block_slice))
+                if len(pending) > 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _map_blocks(self, block_function):
+        """Calls ``block_function(block_slice, block)`` for every block and returns the results in order."""
+        return list(self._iter_map_blocks(block_function))
+
+    def _new_like(self, shape, dtype) -> "ChunkedArray":
+        """Creates a chunked array in a temporary file, removed when the array is garbage collected."""
+        handle, file_path = tempfile.mkstemp(suffix=".h5", dir=self.temp_dir)
+        os.close(handle)
+        _create_dataset(file_path, "volume", shape, dtype)
+        out = ChunkedArray(file_path, "volume", self.block_size, self.workers, self.temp_dir)
+        out._finalizer = weakref.finalize(out, _remove_file, file_path)
+        return out
+
+    def map_elementwise(self, function, *args, **kwargs) -> "ChunkedArray":
+        """Applies an element-wise function block by block, writing the result to a new chunked array.
+
+        Args:
+            function (callable): Called as ``function(block, *args, **kwargs)``. Arrays of the shape of
+                ``self`` and chunked arrays in ``args`` are sliced like the block.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            ChunkedArray: The result, stored in a temporary file.
+        """
+        def _slice_arg(arg, block_slice):
+            if isinstance(arg, ChunkedArray):
+                return arg._data()[block_slice]
+            if isinstance(arg, np.ndarray) and arg.ndim == self.ndim and arg.shape[0] == self.shape[0]:
+                return arg[block_slice]
+            return arg
+
+        def _process(block_slice, block):
+            block_args = [_slice_arg(arg, block_slice) for arg in args]
+            return function(block, *block_args, **kwargs)
+
+        # the first block gives the dtype of the result, the others are written as they are computed
+        block_slices = self._block_slices()
+        first = np.asarray(_process(block_slices[0], self._data()[block_slices[0]]))
+        out = self._new_like(self.shape[:1] + first.shape[1:], first.dtype)
+        import h5py
+
+        with h5py.File(out.file_path, "r+") as f:
+            data = f[out.dataset]
+            data[block_slices[0]] = first
+            for block_slice, block in zip(block_slices[1:], self._iter_map_blocks(_process, block_slices[1:])):
+                data[block_slice] = block
+        return out
+
+    def copy(self) -> "ChunkedArray":
+        """Copies the array to a new temporary file."""
+        return self.map_elementwise(np.array)
+
+    def astype(self, dtype, **kwargs) -> "ChunkedArray":
+        return self.map_elementwise(lambda block: block.astype(dtype, **kwargs))
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self._data()[key]
+
+    def __setitem__(self, key, value):
+        raise TypeError(f"{self.__class__.__name__} is read-only")
+
+    def __array__(self, dtype=None):
+        data = self._data()[()]
+        return data if dtype is None else data.astype(dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if "out" in kwargs:
+            return _materialize_call(getattr(ufunc, method), inputs, kwargs)
+        if method == "__call__" and ufunc.nout == 1 and self._is_blockwise(inputs):
+            index = next(i for i, x in enumerate(inputs) if x is self)
+
+            def _apply(block, *others):
+                args = list(others)
+                args.insert(index, block)
+                return ufunc(*args, **kwargs)
+
+            return self.map_elementwise(_apply, *(x for i, x in enumerate(inputs) if i != index))
+        if method == "reduce" and ufunc in _UFUNC_REDUCTIONS and inputs[0] is self:
+            kwargs.setdefault("axis", 0)
+            return self._reduce(_UFUNC_REDUCTIONS[ufunc], **kwargs)
+        return _materialize_call(getattr(ufunc, method), inputs, kwargs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if args and args[0] is self:
+            if func in _ELEMENTWISE_FUNCTIONS and self._is_blockwise(args):
+                return self.map_elementwise(func, *args[1:], **kwargs)
+            if func in _COMBINABLE_REDUCTIONS or func in _MOMENT_REDUCTIONS or func in _ARG_REDUCTIONS:
+                if len(args) > 1:
+                    kwargs = dict(kwargs, axis=args[1])
+                return self._reduce(func, **kwargs)
+        return _materialize_call(func, args, kwargs)
+
+    def _is_blockwise(self, inputs):
+        """Whether all the inputs are scalars or have the same first dimension as ``self``."""
+        if self.ndim == 0:
+            return False
+        for x in inputs:
+            if isinstance(x, (Number, np.generic)):
+                continue
+            if isinstance(x, (ChunkedArray, np.ndarray)) and x.shape == self.shape:
+                continue
+            return False
+        return True
+
+    def _reduce(self, func, axis=None, keepdims=False, dtype=None, ddof=0, **kwargs):
+        """Computes a reduction block by block."""
+        if kwargs or self.ndim == 0:
+            # `where`, `initial`... are not supported block by block
+            return _materialize_call(
+                func, (self,), dict(kwargs, axis=axis, **_optional(keepdims=keepdims, dtype=dtype, ddof=ddof))
+            )
+        if axis is not None:
+            axes = tuple(a % self.ndim for a in (axis if isinstance(axis, tuple) else (axis,)))
+        else:
+            axes = None
+
+        if func in _ARG_REDUCTIONS:
+            return self._arg_reduce(func, axis if axis is None else axes[0], keepdims)
+
+        if axes is not None and 0 not in axes:
+            # the first axis is kept: the block results are concatenated
+            def _block_reduce(block_slice, block):
+                return func(block, axis=axis, keepdims=keepdims, **_optional(dtype=dtype, ddof=ddof))
+
+            return np.concatenate(self._map_blocks(_block_reduce), axis=0)
+
+        if func in _COMBINABLE_REDUCTIONS:
+            combine = _COMBINABLE_REDUCTIONS[func]
+
+            def _block_reduce(block_slice, block):
+                return func(block, axis=axes, keepdims=True, **_optional(dtype=dtype))
+
+            result = combine(np.concatenate(self._map_blocks(_block_reduce), axis=0), axis=0, keepdims=True)
+            return _squeeze_result(result, axes, keepdims, self.ndim)
+
+        if axes is None or axes == (0,) or set(axes) == set(range(self.ndim)):
+            return self._moment_reduce(func, axes, keepdims, dtype, ddof)
+        return _materialize_call(func, (self,), dict(axis=axis, **_optional(keepdims=keepdims, dtype=dtype, ddof=ddof)))
+
+    def _moment_reduce(self, func, axes, keepdims, dtype, ddof):
+        """Mean, variance and standard deviation by pairwise combination of the block moments."""
+        ignore_nan, return_std = _MOMENT_REDUCTIONS[func]
+        reduce_axes = axes if axes is not None else tuple(range(self.ndim))
+
+        def _block_moments(block_slice, block):
+            # float64 temporaries are computed in place, to stay within a few times the block size
+            block = np.array(block, dtype=np.float64)
+            if ignore_nan:
+                invalid = np.isnan(block)
+                count = np.sum(~invalid, axis=reduce_axes, keepdims=True)
+                block[invalid] = 0
+            else:
+                invalid = None
+                count = np.full(
+                    [1 if a in reduce_axes else n for a, n in enumerate(block.shape)],
+                    int(np.prod([block.shape[a] for a in reduce_axes])),
+                )
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.sum(block, axis=reduce_axes, keepdims=True) / count
+            block -= mean
+            if invalid is not None:
+                block[invalid] = 0
+            np.square(block, out=block)
+            m2 = np.sum(block, axis=reduce_axes, keepdims=True)
+            return count, mean, m2
+
+        count, mean, m2 = None, None, None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for block_count, block_mean, block_m2 in self._map_blocks(_block_moments):
+                if count is None:
+                    count, mean, m2 = block_count, block_mean, block_m2
+                    continue
+                total_count = count + block_count
+                delta = np.where(block_count > 0, block_mean, 0) - np.where(count > 0, mean, 0)
+                weight = np.where(total_count > 0, block_count / np.maximum(total_count, 1), 0)
+                mean = np.where(count > 0, mean, 0) + delta * weight
+                m2 = m2 + block_m2 + delta * delta * count * weight
+                count = total_count
+            mean = np.where(count > 0, mean, np.nan)
+            if return_std is None:
+                result = mean
+            else:
+                result = m2 / (count - ddof)
+                result = np.where(count - ddof > 0, result, np.nan)
+                if return_std:
+                    result = np.sqrt(result)
+
+        if dtype is not None:
+            result = result.astype(dtype)
+        elif np.issubdtype(self.dtype, np.floating):
+            result = result.astype(self.dtype)
+        return _squeeze_result(result, axes, keepdims, self.ndim)
+
+    def _arg_reduce(self, func, axis, keepdims):
+        if axis is None:
+            # flat index of the best value of every block, offset by the start of the block. The best
+            # values of the blocks are then compared with the same function
+            row_size = int(np.prod(self.shape[1:], dtype=np.int64))
+
+            def _block_best(block_slice, block):
+                index = func(block)
+                return block_slice.start * row_size + index, block.flat[index]
+
+            results = self._map_blocks(_block_best)
+            values = np.array([value for _, value in results])
+            return results[int(func(values))][0]
+        if axis == 0:
+            return _materialize_call(func, (self,), dict(axis=axis))
+
+        def _block_arg(block_slice, block):
+            return func(block, axis=axis, **_optional(keepdims=keepdims))
+
+        return np.concatenate(self._map_blocks(_block_arg), axis=0)
+
+
+def _optional(**kwargs):
+    """Keeps the keyword arguments that differ from their numpy default."""
+    defaults = {"keepdims": False, "dtype": None, "ddof": 0}
+    return {k: v for k, v in kwargs.items() if v != defaults.get(k)}
+
+
+def _squeeze_result(result, axes, keepdims, ndim):
+    if keepdims:
+        return result
+    if axes is None:
+        return result.reshape(())[()]
+    return np.squeeze(result, axis=axes)
+
+
+def _materialize_call(func, args, kwargs):
+    """Loads the chunked arrays in memory and calls the function."""
+
+    def _load(x):
+        if isinstance(x, ChunkedArray):
+            return np.asarray(x)
+        if isinstance(x, (list, tuple)):
+            return type(x)(_load(y) for y in x)
+        return x
+
+    return func(*_load(args), **{k: _load(v) for k, v in kwargs.items()})
+
+
+def _create_dataset(file_path, dataset, shape, dtype):
+    """Creates an empty dataset with storage chunks of whole rows (of about 1 MB) along the first axis."""
+    import h5py
+
+    chunks = None
+    if len(shape) and int(np.prod(shape, dtype=np.int64)):
+        row_bytes = max(1, int(np.prod(shape[1:], dtype=np.int64)) * np.dtype(dtype).itemsize)
+        rows = int(max(1, min(shape[0], _STORAGE_CHUNK_BYTES // row_bytes)))
+        chunks = (rows,) + tuple(shape[1:])
+        if row_bytes > _STORAGE_CHUNK_BYTES:
+            chunks = True
+    dirname = os.path.dirname(file_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with h5py.File(file_path, "w") as f:
+        f.create_dataset(dataset, shape=shape, dtype=dtype, chunks=chunks)
@@ -5,13 +5,6 @@ import numpy as np
 
 from . import env
 
-if env.cupy_available():
-    import cupy as cp
-if env.sigpy_available():
-    import sigpy as sp
-if env.torch_available():
-    import torch
-
 __all__ = ["Device", "get_device", "to_device"]
 
 
@@ -56,15 +49,15 @@ class Device(object):
             _type, id = id_or_device, -1
         elif isinstance(id_or_device, Device):
             _type, id = id_or_device.type, id_or_device.id
-        elif env.cupy_available() and isinstance(id_or_device, cp.cuda.Device):
+        elif _is_instance(id_or_device, "cupy", "cuda.Device"):
             _type, id = "cuda", id_or_device.id
-        elif env.sigpy_available() and isinstance(id_or_device, sp.Device):
+        elif _is_instance(id_or_device, "sigpy", "Device"):
             id = id_or_device.id
-        elif env.torch_available() and isinstance(id_or_device, torch.device):
+        elif _is_instance(id_or_device, "torch", "device"):
             _type, id = id_or_device.type, id_or_device.index
             if id is None:
                 if _type == "cuda":
-                    id = torch.cuda.current_device()
+                    id = env.imported_module("torch").cuda.current_device()
                 elif _type == "cpu":
                     id = -1
                 else:
@@ -81,6 +74,8 @@ class Device(object):
         cpdevice = None
         if id != -1:
             if env.cupy_available():
+                import cupy as cp
+
                 cpdevice = cp.cuda.Device(id)
             else:
                 raise ValueError("cupy not installed, but set device {}.".format(id))
@@ -114,6 +109,7 @@ class Device(object):
         """torch.device: The equivalent ```torch.device```."""
         if not env.torch_available():
             raise RuntimeError("`torch` not installed.")
+        import torch
 
         if self.id == -1:
             return torch.device("cpu")
@@ -127,6 +123,8 @@ class Device(object):
             raise RuntimeError("`sigpy` not installed.")
         if self.id >= 0 and self.type != "cuda":
             raise RuntimeError(f"sigpy.Device does not support type {self.type}")
+        import sigpy as sp
+
         return sp.Device(self.id)
 
     @property
@@ -134,6 +132,8 @@ class Device(object):
         """module: numpy or cupy module for the device."""
         if self.id == -1:
             return np
+        import cupy as cp
+
         return cp
 
     def use(self):
@@ -153,14 +153,14 @@ class Device(object):
             return self.id == other
         elif isinstance(other, Device):
             return self.type == other.type and self.id == other.id
-        elif env.cupy_available() and isinstance(other, cp.cuda.Device):
+        elif _is_instance(other, "cupy", "cuda.Device"):
             return self.type == "cuda" and self.id == other.id
-        elif env.sigpy_available() and isinstance(other, sp.Device):
+        elif _is_instance(other, "sigpy", "Device"):
             try:
                 return self.spdevice == other
             except RuntimeError:
                 return False
-        elif env.torch_available() and isinstance(other, torch.device):
+        elif _is_instance(other, "torch", "device"):
             return self.ptdevice == other
         else:
             return False
@@ -187,6 +187,17 @@ class Device(object):
         return f"Device(type='{self.type}', index={self.id})"
 
 
+def _is_instance(obj, module_name, type_path):
+    """Checks the type of ``obj`` against a type of an optional package, without importing it."""
+    module = env.imported_module(module_name)
+    if module is None:
+        return False
+    type_ = module
+    for attr in type_path.split("."):
+        type_ = getattr(type_, attr)
+    return isinstance(obj, type_)
+
+
 cpu_device = Device(-1)
 
 
@@ -204,7 +215,9 @@ def get_array_module(array):
     Returns:
         module: :mod:`cupy` or :mod:`numpy` is returned based on input.
     """
-    if env.cupy_available():
+    # arrays can only be cupy arrays if cupy was imported
+    cp = env.imported_module("cupy")
+    if cp is not None:
         return cp.get_array_module(array)
     else:
         return np
@@ -250,4 +263,4 @@ def to_device(input, device=cpu_device):
             return input.get()
     else:
         with odevice:
-            return cp.asarray(input)
+            return odevice.xp.asarray(input)
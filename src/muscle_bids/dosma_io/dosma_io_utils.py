@@ -5,11 +5,6 @@ import warnings
 from typing import Sequence
 from . import env
 
-import h5py
-
-if env.package_available("pandas"):
-    import pandas as pd
-
 __all__ = ["mkdirs", "save_pik", "load_pik", "save_h5", "load_h5", "save_tables"]
 
 
@@ -65,17 +60,23 @@ def load_pik(file_path: str):
         return pickle.load(f)
 
 
-def save_h5(file_path: str, data_dict: dict):
+def save_h5(file_path: str, data_dict: dict, **dataset_kwargs):
     """Save data in H5DF format.
 
     Args:
         file_path (str): File path to save to.
         data_dict (dict): Dictionary of data to store. Dictionary can only have depth of 1.
+        **dataset_kwargs: Keyword arguments of ``h5py.Group.create_dataset`` used for array
+            values (e.g. ``chunks=True``, ``compression="gzip"``).
     """
+    import h5py
+
     mkdirs(os.path.dirname(file_path))
     with h5py.File(file_path, "w") as f:
         for key in data_dict.keys():
-            f.create_dataset(key, data=data_dict[key])
+            value = data_dict[key]
+            kwargs = dataset_kwargs if getattr(value, "ndim", 0) else {}
+            f.create_dataset(key, data=value, **kwargs)
 
 
 def load_h5(file_path):
@@ -93,10 +94,12 @@ def load_h5(file_path):
     if not os.path.isfile(file_path):
         raise FileNotFoundError("{} does not exist".format(file_path))
 
+    import h5py
+
     data = {}
     with h5py.File(file_path, "r") as f:
         for key in f.keys():
-            data[key] = f.get(key).value
+            data[key] = f.get(key)[()]
 
     return data
 
@@ -105,7 +108,7 @@ save_tables = None
 
 if env.package_available("pandas"):
     def save_tables(
-        file_path: str, data_frames: Sequence[pd.DataFrame], sheet_names: Sequence[str] = None
+        file_path: str, data_frames: Sequence["pd.DataFrame"], sheet_names: Sequence[str] = None
     ):
         """Save data in excel tables.
 
@@ -116,6 +119,8 @@ if env.package_available("pandas"):
             sheet_names (:obj:`Sequence[str]`, optional): Sheet names for each data frame.
         """
 
+        import pandas as pd
+
         mkdirs(os.path.dirname(file_path))
         writer = pd.ExcelWriter(file_path)
 
@@ -1,12 +1,13 @@
 import logging
 import os
+import sys
 from importlib import util
 
 _SUPPORTED_PACKAGES = {}
 
 _FILE_DIRECTORY = os.path.abspath(os.path.dirname(__file__))
 
-__all__ = ["debug", "get_version", "package_available"]
+__all__ = ["debug", "get_version", "package_available", "imported_module"]
 
 
 def package_available(name: str):
@@ -24,6 +25,22 @@ def package_available(name: str):
     return _SUPPORTED_PACKAGES[name]
 
 
+def imported_module(name: str):
+    """Returns a module if it was already imported, without importing it.
+
+    An object can only be an instance of a type defined by a package (e.g. ``cupy.ndarray``)
+    if the package was imported, so type checks against optional packages can use this
+    instead of importing them.
+
+    Args:
+        name (str): Name of the module.
+
+    Returns:
+        module: The module, or ``None`` if it is not imported.
+    """
+    return sys.modules.get(name)
+
+
 def get_version(package_or_name) -> str:
     """Returns package version.
 
@@ -0,0 +1,350 @@
+"""Lightweight timing and memory instrumentation of the conversion stages.
+
+Stages are measured with context-managed spans, or with the :func:`profiled` decorator.
+Instrumentation is disabled by default. While it is disabled, :func:`span` and :func:`series`
+return a shared no-op context and :func:`profiled` functions call through directly, so the
+overhead is a global lookup per call:
+
+    >>> profiler = enable_profiling()
+    >>> with series("/data/mese/IM0001"):
+    >>>     with span("save", bytes_written=1024) as s:
+    >>>         ...
+    >>>         s.add(slices=20)
+    >>> profiler.save_report("report.json")
+    >>> disable_profiling()
+
+Every span records its wall time, the CPU time of its thread, the bytes read and written,
+the slices processed and the peak resident memory of the process when it ends. Nested spans
+are reported under the path of their parents (e.g. ``dicom_volume_to_bids/headers_to_dicts``),
+and spans are grouped by the series set with :func:`series` in their thread.
+"""
+import functools
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+__all__ = [
+    "Profiler",
+    "enable_profiling",
+    "disable_profiling",
+    "get_profiler",
+    "span",
+    "series",
+    "profiled",
+    "add_counters",
+]
+
+# series of the spans recorded outside of any `series` context
+UNASSIGNED_SERIES = "unassigned"
+
+_profiler = None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class _NullContext(object):
+    """No-op span returned while instrumentation is disabled."""
+
+    def add(self, bytes_read=0, bytes_written=0, slices=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class Span(object):
+    """A measured stage. Created by :meth:`Profiler.span`.
+
+    Args:
+        profiler (Profiler): The profiler recording the span.
+        name (str): Name of the stage.
+        bytes_read (int, optional): Bytes read by the stage.
+        bytes_written (int, optional): Bytes written by the stage.
+        slices (int, optional): Number of slices processed by the stage.
+    """
+
+    __slots__ = ("profiler", "name", "bytes_read", "bytes_written", "slices", "_start", "_cpu_start", "_path")
+
+    def __init__(self, profiler, name, bytes_read=0, bytes_written=0, slices=0):
+        self.profiler = profiler
+        self.name = name
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.slices = slices
+
+    def add(self, bytes_read=0, bytes_written=0, slices=0):
+        """Adds to the counters of the span."""
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        self.slices += slices
+
+    def __enter__(self):
+        state = self.profiler._thread_state()
+        state.stack.append(self)
+        self._path = "/".join(s.name for s in state.stack)
+        self._cpu_start = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        wall = time.perf_counter() - self._start
+        cpu = time.thread_time() - self._cpu_start
+        state = self.profiler._thread_state()
+        state.stack.pop()
+        self.profiler.record(
+            {
+                "series": state.series or UNASSIGNED_SERIES,
+                "stage": self._path,
+                "depth": len(state.stack),
+                "wall_s": wall,
+                "cpu_s": cpu,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "slices": self.slices,
+                "peak_rss_mb": _peak_rss_mb(),
+            }
+        )
+        return False
+
+
+class Profiler(object):
+    """Collects the spans of a run and summarizes them in a report.
+
+    Spans can be recorded from several threads. Spans recorded in other processes are added
+    with :meth:`extend`, e.g. with the records returned by pool workers.
+
+    Attributes:
+        records (list[dict]): The recorded spans, in the order in which they ended.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = time.perf_counter()
+
+    def _thread_state(self):
+        state = self._local
+        if not hasattr(state, "stack"):
+            state.stack = []
+            state.series = None
+        return state
+
+    def span(self, name, bytes_read=0, bytes_written=0, slices=0) -> Span:
+        """Returns a context measuring a stage. See :func:`span`."""
+        return Span(self, name, bytes_read, bytes_written, slices)
+
+    def series(self, name):
+        """Returns a context attributing the spans of this thread to a series. See :func:`series`."""
+        return _SeriesContext(self, name)
+
+    def record(self, record: dict):
+        """Adds a span record."""
+        with self._lock:
+            self.records.append(record)
+
+    def extend(self, records):
+        """Adds span records, e.g. from another process."""
+        with self._lock:
+            self.records.extend(records)
+
+    def report(self) -> dict:
+        """Summarizes the records by series and stage.
+
+        For every series, the spans are summed by stage path. The totals of a series only
+        count the outermost spans, so that nested stages are not counted twice.
+
+        Returns:
+            dict: The report, with the elapsed time of the run, the totals and the per-series
+            breakdown.
+        """
+        with self._lock:
+            records = list(self.records)
+
+        def _empty():
+            return {
+                "calls": 0,
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "bytes_read": 0,
+                "bytes_written": 0,
+                "slices": 0,
+                "peak_rss_mb": None,
+            }
+
+        def _accumulate(summary, record):
+            summary["calls"] += 1
+            for key in ("wall_s", "cpu_s", "bytes_read", "bytes_written", "slices"):
+                summary[key] += record[key]
+            if record["peak_rss_mb"] is not None:
+                summary["peak_rss_mb"] = max(summary["peak_rss_mb"] or 0, record["peak_rss_mb"])
+
+        series = {}
+        totals = _empty()
+        for record in records:
+            entry = series.setdefault(record["series"], {"total": _empty(), "stages": {}})
+            _accumulate(entry["stages"].setdefault(record["stage"], _empty()), record)
+            if record["depth"] == 0:
+                _accumulate(entry["total"], record)
+                _accumulate(totals, record)
+
+        for entry in series.values():
+            entry["stages"] = dict(sorted(entry["stages"].items()))
+
+        return {
+            "elapsed_s": time.perf_counter() - self._start,
+            "total": totals,
+            "series": series,
+        }
+
+    def save_report(self, file_path: str):
+        """Writes the report as a json file."""
+        with open(file_path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class _SeriesContext(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        state = self.profiler._thread_state()
+        self._previous = state.series
+        state.series = self.name
+        return self
+
+    def __exit__(self, *args):
+        self.profiler._thread_state().series = self._previous
+        return False
+
+
+def enable_profiling() -> Profiler:
+    """Starts recording the spans in a new profiler.
+
+    Returns:
+        Profiler: The profiler collecting the spans.
+    """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling():
+    """Stops recording the spans.
+
+    Returns:
+        Profiler: The profiler that was active, or ``None``.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler():
+    """Returns the active profiler, or ``None`` if instrumentation is disabled."""
+    return _profiler
+
+
+def span(name: str, bytes_read: int = 0, bytes_written: int = 0, slices: int = 0):
+    """Returns a context measuring a stage.
+
+    The context value has an ``add(bytes_read=0, bytes_written=0, slices=0)`` method to update
+    the counters while the stage runs. Computing the counters can be skipped when
+    :func:`get_profiler` is ``None``.
+
+    Args:
+        name (str): Name of the stage.
+        bytes_read (int, optional): Bytes read by the stage.
+        bytes_written (int, optional): Bytes written by the stage.
+        slices (int, optional): Number of slices processed by the stage.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_CONTEXT
+    return Span(profiler, name, bytes_read, bytes_written, slices)
+
+
+def series(name: str):
+    """Returns a context attributing the spans recorded in this thread to a series.
+
+    Args:
+        name (str): Name of the series in the report.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _SeriesContext(profiler, name)
+
+
+def add_counters(bytes_read: int = 0, bytes_written: int = 0, slices: int = 0):
+    """Adds to the counters of the innermost span of this thread, e.g. from a :func:`profiled` function.
+
+    Args:
+        bytes_read (int, optional): Bytes read.
+        bytes_written (int, optional): Bytes written.
+        slices (int, optional): Number of slices processed.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return
+    stack = profiler._thread_state().stack
+    if stack:
+        stack[-1].add(bytes_read, bytes_written, slices)
+
+
+def _count_slices(value):
+    shape = getattr(value, "shape", None)
+    if shape is not None:
+        return int(shape[2]) if len(shape) >= 3 else 1
+    if isinstance(value, (list, tuple)):
+        # a list of volumes, or of per-slice headers
+        if value and getattr(value[0], "shape", None) is not None:
+            return sum(_count_slices(v) for v in value)
+        return len(value)
+    return 0
+
+
+def profiled(name: str = None):
+    """Decorator measuring every call of a function in a span.
+
+    The number of slices is taken from the first argument: the third dimension of a volume, or
+    of a list of volumes, or the length of a list of headers. The function can add to the counters of its span
+    with :func:`add_counters`.
+
+    Args:
+        name (str, optional): Name of the stage. Defaults to the name of the function.
+    """
+
+    def _decorator(func):
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            with Span(profiler, stage, slices=_count_slices(args[0]) if args else 0):
+                return func(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
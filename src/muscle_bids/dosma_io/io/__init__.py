@@ -1,12 +1,36 @@
-from . import dicom_io, format_io_utils, nifti_io  # noqa: F401
-
-from .dicom_io import *  # noqa
-from .format_io import ImageDataFormat  # noqa
-from .format_io_utils import *  # noqa
-from .nifti_io import *  # noqa
-
-__all__ = []
-__all__.extend(dicom_io.__all__)
-__all__.extend(["ImageDataFormat"])
-__all__.extend(format_io_utils.__all__)
-__all__.extend(nifti_io.__all__)
+import importlib
+
+# The readers and writers are imported on first access (PEP 562): writing NIfTI files does not
+# load the DICOM stack, and vice versa.
+_SUBMODULES = ["dicom_io", "format_io", "format_io_utils", "nifti_io"]
+
+# public name -> submodule defining it
+_LAZY_ATTRIBUTES = {
+    "DicomReader": "dicom_io",
+    "DicomWriter": "dicom_io",
+    "ImageDataFormat": "format_io",
+    "get_reader": "format_io_utils",
+    "get_writer": "format_io_utils",
+    "get_filepath_variations": "format_io_utils",
+    "convert_image_data_format": "format_io_utils",
+    "generic_load": "format_io_utils",
+    "NiftiReader": "nifti_io",
+    "NiftiWriter": "nifti_io",
+    "DTYPE_POLICIES": "nifti_io",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f"{__name__}.{_LAZY_ATTRIBUTES[name]}"), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES) | set(_LAZY_ATTRIBUTES))
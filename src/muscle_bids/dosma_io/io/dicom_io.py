@@ -27,18 +27,56 @@ import nibabel as nib
 import numpy as np
 import pydicom
 from natsort import index_natsorted, natsorted
-from tqdm.auto import tqdm
-from tqdm.contrib.concurrent import process_map
 
+from .. import instrumentation
 from .. import orientation as stdo
 from .format_io import DataReader, DataWriter, ImageDataFormat
 from ..med_volume import MedicalVolume
+from ..shared import SharedVolumeHandle
 from ..dosma_defaults import AFFINE_DECIMAL_PRECISION, SCANNER_ORIGIN_DECIMAL_PRECISION
 
 __all__ = ["DicomReader", "DicomWriter"]
 
 TOTAL_NUM_ECHOS_KEY = (0x19, 0x107E)
 
+# elements needed to build the volumes and their affine when only some tags are read
+_VOLUME_TAGS = (
+    "SOPClassUID",
+    "SamplesPerPixel",
+    "PhotometricInterpretation",
+    "PlanarConfiguration",
+    "NumberOfFrames",
+    "Rows",
+    "Columns",
+    "BitsAllocated",
+    "BitsStored",
+    "HighBit",
+    "PixelRepresentation",
+    "ImagePositionPatient",
+    "ImageOrientationPatient",
+    "PixelSpacing",
+    "ImagerPixelSpacing",
+    "SliceThickness",
+    "SpacingBetweenSlices",
+    "PatientOrientation",
+    "SharedFunctionalGroupsSequence",
+    "PerFrameFunctionalGroupsSequence",
+    "ExtendedOffsetTable",
+    "ExtendedOffsetTableLengths",
+    "FloatPixelData",
+    "DoubleFloatPixelData",
+    "PixelData",
+)
+
+
+def _progress(iterable, verbose: bool):
+    """Wraps an iterable in a progress bar if verbose. tqdm is only imported in that case."""
+    if not verbose:
+        return iterable
+    from tqdm.auto import tqdm
+
+    return tqdm(iterable)
+
 
 def flatten_data(d, new_dataset=None):
     if new_dataset is None:
@@ -54,6 +92,7 @@ def flatten_data(d, new_dataset=None):
     return new_dataset
 
 
+@instrumentation.profiled()
 def separate_enhanced_slices(data_in):
     d = copy.copy(data_in)
     slice_data = d[(0x5200, 0x9230)]
@@ -81,6 +120,7 @@ def separate_enhanced_slices(data_in):
         new_slice_header.PixelData = pixel_data[:,:,current_slice].tostring()
         header_list.append(new_slice_header)
         current_slice += 1
+    instrumentation.add_counters(slices=len(header_list))
     return header_list
 
 
@@ -101,6 +141,8 @@ class DicomReader(DataReader):
         default_ornt (Tuple[str, str], optional): Default in-plane orientation to use if
             orientation cannot be determined from DICOM header. If not specified
             and orientation cannot be determined, error will be raised.
+        specific_tags (:obj:`str(s)` or :obj:`int(s)`, optional): If specified, only these
+            DICOM attributes, and the ones needed to build the volumes, are read.
         data_format_code (ImageDataFormat): The supported image data format.
 
     Examples:
@@ -127,6 +169,7 @@ class DicomReader(DataReader):
         sort_by: Union[str, int, Sequence[Union[str, int]]] = None,
         ignore_ext: bool = False,
         default_ornt: Tuple[str, str] = None,
+        specific_tags: Sequence[Union[str, int]] = None,
     ):
         """
         Args:
@@ -143,6 +186,10 @@ class DicomReader(DataReader):
             default_ornt (Tuple[str, str], optional): Default in-plane orientation to use if
                 orientation cannot be determined from DICOM header. If not specified
                 and orientation cannot be determined, error will be raised.
+            specific_tags (:obj:`str(s)` or :obj:`int(s)`, optional): If specified, only these
+                DICOM attributes, and the ones needed to build the volumes, are read. The other
+                elements are skipped without being parsed, which speeds up loading when only a
+                few attributes of the headers are used.
         """
         self.num_workers = num_workers
         self.verbose = verbose
@@ -150,6 +197,7 @@ class DicomReader(DataReader):
         self.sort_by = sort_by
         self.ignore_ext = ignore_ext
         self.default_ornt = default_ornt
+        self.specific_tags = specific_tags
 
     def get_files(
         self,
@@ -209,6 +257,7 @@ class DicomReader(DataReader):
         lstFilesDCM = natsorted(lstFilesDCM)
         return lstFilesDCM
 
+    @instrumentation.profiled("DicomReader.load")
     def load(
         self,
         path: Union[str, Sequence[str]],
@@ -216,6 +265,7 @@ class DicomReader(DataReader):
         sort_by: Union[str, int, Sequence[Union[str, int]]] = np._NoValue,
         ignore_ext: bool = np._NoValue,
         default_ornt: Tuple[str, str] = np._NoValue,
+        specific_tags: Sequence[Union[str, int]] = np._NoValue,
     ):
         """Load dicoms into ``MedicalVolume``s grouped by ``group_by`` tag(s).
 
@@ -238,6 +288,10 @@ class DicomReader(DataReader):
                 orientation cannot be determined from DICOM header. If not specified
                 and orientation cannot be determined, error will be raised.
                 Defaults to ``self.default_ornt``.
+            specific_tags (:obj:`str(s)` or :obj:`int(s)`, optional): If specified, only these
+                DICOM attributes are read, in addition to ``group_by``, ``sort_by`` and the
+                attributes needed to build the volumes. The headers of the volumes then only
+                contain these elements. Defaults to ``self.specific_tags``.
 
         Returns:
             list[MedicalVolume]: Different volumes grouped by the `group_by` DICOM tag.
@@ -256,9 +310,13 @@ class DicomReader(DataReader):
         sort_by = sort_by if sort_by != np._NoValue else self.sort_by
         ignore_ext = ignore_ext if ignore_ext != np._NoValue else self.ignore_ext
         default_ornt = default_ornt if default_ornt != np._NoValue else self.default_ornt
+        specific_tags = specific_tags if specific_tags != np._NoValue else self.specific_tags
 
         group_by = _wrap_as_tuple(group_by, default=())
         sort_by = _wrap_as_tuple(sort_by, default=())
+        if specific_tags is not None:
+            specific_tags = _wrap_as_tuple(specific_tags) + _VOLUME_TAGS + group_by + sort_by
+            specific_tags = list({pydicom.tag.Tag(t): None for t in specific_tags})
 
         if isinstance(path, str) or not isinstance(path, Sequence):
             if os.path.isdir(path):
@@ -278,10 +336,12 @@ class DicomReader(DataReader):
         lstFilesDCM = natsorted(lstFilesDCM)
         if len(lstFilesDCM) == 0:
             raise FileNotFoundError("No valid dicom files found in {}".format(path))
+        if instrumentation.get_profiler() is not None:
+            instrumentation.add_counters(bytes_read=sum(os.path.getsize(fp) for fp in lstFilesDCM))
 
         def _safe_dicom_read(file_path):
             try:
-                return pydicom.read_file(file_path)
+                return pydicom.read_file(file_path, specific_tags=specific_tags)
             except pydicom.errors.InvalidDicomError:
                 return None
 
@@ -299,6 +359,8 @@ class DicomReader(DataReader):
 
         if self.num_workers:
             if self.verbose:
+                from tqdm.contrib.concurrent import process_map
+
                 dicom_slices = process_map(_safe_dicom_read, lstFilesDCM, max_workers=self.num_workers)
             else:
                 with mp.Pool(self.num_workers) as p:
@@ -306,7 +368,7 @@ class DicomReader(DataReader):
         else:
             dicom_slices = [
                 _safe_dicom_read(fp)
-                for fp in tqdm(lstFilesDCM, disable=not self.verbose)
+                for fp in _progress(lstFilesDCM, self.verbose)
             ]
 
         # remove the failed files from the list
@@ -325,6 +387,7 @@ class DicomReader(DataReader):
                 new_dicom_slices.append(dataset)
         
         dicom_slices = new_dicom_slices
+        instrumentation.add_counters(slices=len(dicom_slices))
 
         if sort_by:
             try:
@@ -484,19 +547,18 @@ class DicomWriter(DataWriter):
             for dims in itertools.product(*[list(range(0, x)) for x in multi_volumes.shape]):
                 multi_volumes[dims] = _format_volume_to_header(volume[(Ellipsis,) + dims])
             multi_volumes = multi_volumes.flatten()
-            volume_arr = np.concatenate([v.volume for v in multi_volumes], axis=-1)
+            # The reformatted volumes are views: slices are only made contiguous when written.
+            slices = [v.volume[..., s] for v in multi_volumes for s in range(v.shape[2])]
             headers = np.concatenate([v.headers(flatten=True) for v in multi_volumes], axis=-1)
         else:
             volume = _format_volume_to_header(volume)
-            volume_arr = volume.volume
+            slices = [volume.volume[..., s] for s in range(volume.shape[2])]
             headers = volume.headers(flatten=True)
 
         assert headers.ndim == 1
-        assert volume_arr.shape[2] == len(
+        assert len(slices) == len(
             headers
-        ), "Dimension mismatch - {:d} slices but {:d} headers".format(
-            volume_arr.shape[-1], len(headers)
-        )
+        ), "Dimension mismatch - {:d} slices but {:d} headers".format(len(slices), len(headers))
 
         if sort_by:
             idxs = np.asarray(
@@ -506,7 +568,7 @@ class DicomWriter(DataWriter):
                 )
             )
             headers = headers[idxs]
-            volume_arr = volume_arr[..., idxs]
+            slices = [slices[i] for i in idxs]
 
         # Check if dir_path exists.
         os.makedirs(dir_path, exist_ok=True)
@@ -519,16 +581,29 @@ class DicomWriter(DataWriter):
 
         filepaths = [os.path.join(dir_path, filename_format % (s + 1)) for s in range(num_slices)]
         if self.num_workers:
-            slices = [volume_arr[..., s] for s in range(num_slices)]
-            if self.verbose:
-                process_map(_write_dicom_file, slices, headers, filepaths)
-            else:
-                with mp.Pool(self.num_workers) as p:
-                    out = p.starmap_async(_write_dicom_file, zip(slices, headers, filepaths))
-                    out.wait()
+            # The slices are copied once to shared memory: workers only receive its handle.
+            shared_slices = SharedVolumeHandle.create(
+                slices[0].shape + (num_slices,), np.result_type(*slices)
+            )
+            try:
+                shared_array = shared_slices.array()
+                for s, np_slice in enumerate(slices):
+                    shared_array[..., s] = np_slice
+                del shared_array
+                tasks = ([shared_slices] * num_slices, range(num_slices), headers, filepaths)
+                if self.verbose:
+                    from tqdm.contrib.concurrent import process_map
+
+                    process_map(_write_shared_dicom_file, *tasks)
+                else:
+                    with mp.Pool(self.num_workers) as p:
+                        out = p.starmap_async(_write_shared_dicom_file, zip(*tasks))
+                        out.wait()
+            finally:
+                shared_slices.unlink()
         else:
-            for s in tqdm(range(num_slices), disable=not self.verbose):
-                _write_dicom_file(volume_arr[..., s], headers[s], filepaths[s])
+            for s in _progress(range(num_slices), self.verbose):
+                _write_dicom_file(slices[s], headers[s], filepaths[s])
 
     def __serializable_variables__(self) -> Collection[str]:
         return self.__dict__.keys()
@@ -702,22 +777,28 @@ def _write_dicom_file(np_slice: np.ndarray, header: pydicom.FileDataset, file_pa
         str(expected_dimensions), str(np_slice.shape)
     )
 
-    np_slice_bytes = np_slice.tobytes()
-    bit_depth = int(len(np_slice_bytes) / (np_slice.shape[0] * np_slice.shape[1]) * 8)
+    bit_depth = np_slice.dtype.itemsize * 8
     if bit_depth != header.BitsAllocated:
         np_slice = _update_np_dtype(np_slice, header.BitsAllocated)
-        np_slice_bytes = np_slice.tobytes()
-        bit_depth = int(len(np_slice_bytes) / (np_slice.shape[0] * np_slice.shape[1]) * 8)
+        bit_depth = np_slice.dtype.itemsize * 8
 
     assert bit_depth == header.BitsAllocated, "Bit depth mismatch: Expected {:d} got {:d}".format(
         header.BitsAllocated, bit_depth
     )
 
-    header.PixelData = np_slice_bytes
+    # The slice may be a strided view of the reformatted volume: it is materialized only here, once.
+    header.PixelData = np_slice.tobytes()
 
     header.save_as(file_path)
 
 
+def _write_shared_dicom_file(
+    shared_slices: SharedVolumeHandle, index: int, header: pydicom.FileDataset, file_path: str
+):
+    """Writes slice ``index`` of the slices stored in shared memory with :func:`_write_dicom_file`."""
+    _write_dicom_file(shared_slices.array()[..., index], header, file_path)
+
+
 def _update_np_dtype(arr: np.ndarray, bit_depth: int):
     """Create copy of np_array with bit-depth and type specified here.
 
@@ -9,31 +9,58 @@ import os
 from typing import Collection
 
 import nibabel as nib
+import numpy as np
 
+from .. import instrumentation
 from .format_io import DataReader, DataWriter, ImageDataFormat
 from ..med_volume import MedicalVolume
 from ..dosma_defaults import AFFINE_DECIMAL_PRECISION, SCANNER_ORIGIN_DECIMAL_PRECISION
 from .. import dosma_io_utils as io_utils
 
-__all__ = ["NiftiReader", "NiftiWriter"]
+__all__ = ["NiftiReader", "NiftiWriter", "DTYPE_POLICIES"]
+
+DTYPE_POLICIES = ("native", "float32", "int16")
+
+_INT16_MAX = np.iinfo(np.int16).max
 
 
 class NiftiReader(DataReader):
     """A class for reading NIfTI files.
 
     Attributes:
+        mmap (bool): If ``True``, uncompressed (``.nii``) files are memory-mapped read-only
+            instead of being read into memory. See :meth:`load`.
         data_format_code (ImageDataFormat): The supported image data format.
+
+    Examples:
+        >>> nr = NiftiReader(mmap=True)
+        >>> mv = nr.load("/path/to/volume.nii")
+        >>> type(mv.volume)
+        <class 'numpy.memmap'>
     """
 
     data_format_code = ImageDataFormat.nifti
 
-    def load(self, file_path) -> MedicalVolume:
+    def __init__(self, mmap: bool = False):
+        """
+        Args:
+            mmap (bool, optional): If ``True``, memory-map uncompressed files.
+        """
+        self.mmap = mmap
+
+    def load(self, file_path, mmap: bool = np._NoValue) -> MedicalVolume:
         """Load volume from NIfTI file path.
 
         A NIfTI file should only correspond to one volume.
 
+        In mmap mode, the volume keeps its on-disk dtype. For uncompressed files stored
+        without intensity scaling (``scl_slope``/``scl_inter``), ``volume`` is a read-only
+        ``np.memmap`` and slicing only reads the requested data. Compressed or scaled
+        files cannot be mapped and are read into memory.
+
         Args:
             file_path (str): File path to NIfTI file.
+            mmap (bool, optional): If ``True``, memory-map the file. Defaults to ``self.mmap``.
 
         Returns:
             MedicalVolume: Loaded volume.
@@ -42,6 +69,8 @@ class NiftiReader(DataReader):
             FileNotFoundError: If `file_path` not found.
             ValueError: If `file_path` does not end in a supported NIfTI extension.
         """
+        mmap = mmap if mmap != np._NoValue else self.mmap
+
         if not os.path.isfile(file_path):
             raise FileNotFoundError("{} not found".format(file_path))
 
@@ -50,11 +79,12 @@ class NiftiReader(DataReader):
                 "{} must be a file with extension '.nii' or '.nii.gz'".format(file_path)
             )
 
-        nib_img = nib.load(file_path)
+        nib_img = nib.load(file_path, mmap="r") if mmap else nib.load(file_path)
         return MedicalVolume.from_nib(
             nib_img,
             affine_precision=AFFINE_DECIMAL_PRECISION,
             origin_precision=SCANNER_ORIGIN_DECIMAL_PRECISION,
+            mmap=mmap,
         )
 
     def __serializable_variables__(self) -> Collection[str]:
@@ -64,22 +94,52 @@ class NiftiReader(DataReader):
 class NiftiWriter(DataWriter):
     """A class for writing volumes in NIfTI format.
 
+    The on-disk data type is controlled by a dtype policy:
+
+    - ``"native"``: the array is written with its own dtype.
+    - ``"float32"``: the array is cast to ``float32``.
+    - ``"int16"``: the array is quantized to ``int16`` and the NIfTI ``scl_slope``/``scl_inter``
+      fields are set so that readers recover the original value range. Integer arrays that
+      already fit in ``int16`` are written unscaled.
+
     Attributes:
+        dtype_policy (str): Default dtype policy. One of :data:`DTYPE_POLICIES`.
         data_format_code (ImageDataFormat): The supported image data format.
+
+    Examples:
+        >>> nw = NiftiWriter(dtype_policy="int16")
+        >>> nw.save(mv, "/path/to/volume.nii.gz")
     """
 
     data_format_code = ImageDataFormat.nifti
 
-    def save(self, volume: MedicalVolume, file_path: str):
+    def __init__(self, dtype_policy: str = "native"):
+        """
+        Args:
+            dtype_policy (str, optional): Default dtype policy. One of :data:`DTYPE_POLICIES`.
+        """
+        self.dtype_policy = dtype_policy
+
+    @instrumentation.profiled("NiftiWriter.save")
+    def save(self, volume: MedicalVolume, file_path: str, dtype_policy: str = np._NoValue):
         """Save volume in NIfTI format,
 
         Args:
             volume (MedicalVolume): Volume to save.
             file_path (str): File path to NIfTI file.
+            dtype_policy (str, optional): On-disk dtype policy. One of :data:`DTYPE_POLICIES`.
+                Defaults to ``self.dtype_policy``.
 
         Raises:
-            ValueError: If `file_path` does not end in a supported NIfTI extension.
+            ValueError: If `file_path` does not end in a supported NIfTI extension,
+                or if ``dtype_policy`` is not supported.
         """
+        dtype_policy = dtype_policy if dtype_policy != np._NoValue else self.dtype_policy
+        if dtype_policy not in DTYPE_POLICIES:
+            raise ValueError(
+                "Unknown dtype policy '{}'. Expected one of {}".format(dtype_policy, DTYPE_POLICIES)
+            )
+
         if not self.data_format_code.is_filetype(file_path):
             raise ValueError(
                 "{} must be a file with extension '.nii' or '.nii.gz'".format(file_path)
@@ -89,7 +149,70 @@ class NiftiWriter(DataWriter):
         io_utils.mkdirs(os.path.dirname(file_path))
 
         nib_img = volume.to_nib()
+        if dtype_policy != "native":
+            arr, slope, inter = _apply_dtype_policy(np.asanyarray(nib_img.dataobj), dtype_policy)
+            nib_img = nib.Nifti1Image(arr, nib_img.affine)
+            if slope is not None:
+                nib_img.header.set_slope_inter(slope, inter)
         nib.save(nib_img, file_path)
+        if instrumentation.get_profiler() is not None:
+            instrumentation.add_counters(
+                bytes_written=os.path.getsize(file_path),
+                slices=volume.shape[2] if volume.ndim >= 3 else 1,
+            )
 
     def __serializable_variables__(self) -> Collection[str]:
         return self.__dict__.keys()
+
+
+def _apply_dtype_policy(arr: np.ndarray, dtype_policy: str):
+    """Convert an array to the on-disk representation given by ``dtype_policy``.
+
+    Args:
+        arr (np.ndarray): The array to convert.
+        dtype_policy (str): One of :data:`DTYPE_POLICIES`.
+
+    Returns:
+        Tuple[np.ndarray, Optional[float], Optional[float]]: The converted array and the
+            NIfTI slope and intercept (``None`` if no scaling is required).
+    """
+    if dtype_policy == "native":
+        return arr, None, None
+    if dtype_policy == "float32":
+        return arr.astype(np.float32, copy=False), None, None
+    return _scale_to_int16(arr)
+
+
+def _scale_to_int16(arr: np.ndarray):
+    """Quantize an array to ``int16`` with a linear slope/intercept.
+
+    The value range is computed once and the array is scaled and rounded in place in a
+    single ``float32`` scratch buffer, so no full-size temporaries are created.
+
+    Raises:
+        ValueError: If ``arr`` is complex or contains non-finite values.
+    """
+    if np.iscomplexobj(arr):
+        raise ValueError("Complex volumes cannot be written with the 'int16' dtype policy")
+    if arr.dtype == np.int16:
+        return arr, None, None
+
+    arr_min, arr_max = np.min(arr), np.max(arr)
+    if np.issubdtype(arr.dtype, np.integer) or arr.dtype == np.bool_:
+        if arr_min >= -_INT16_MAX - 1 and arr_max <= _INT16_MAX:
+            return arr.astype(np.int16), None, None
+    arr_min, arr_max = float(arr_min), float(arr_max)
+    if not (np.isfinite(arr_min) and np.isfinite(arr_max)):
+        raise ValueError("The 'int16' dtype policy requires finite values")
+
+    inter = (arr_max + arr_min) / 2
+    slope = (arr_max - arr_min) / (2 * _INT16_MAX)
+    if slope == 0:
+        slope = 1.0
+
+    scaled = np.empty(arr.shape, dtype=np.float32)
+    np.subtract(arr, inter, out=scaled, casting="unsafe")
+    np.multiply(scaled, 1 / slope, out=scaled)
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, -_INT16_MAX, _INT16_MAX, out=scaled)
+    return scaled.astype(np.int16), slope, inter
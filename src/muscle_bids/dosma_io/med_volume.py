@@ -16,18 +16,12 @@ from packaging import version
 
 from . import orientation as stdo
 from .device import Device, cpu_device, get_array_module, get_device, to_device
+from .chunked import ChunkedArray
 from .io.format_io import ImageDataFormat
 from . import env
 
 from .dosma_defaults import SCANNER_ORIGIN_DECIMAL_PRECISION
 
-if env.sitk_available():
-    import SimpleITK as sitk
-if env.cupy_available():
-    import cupy as cp
-if env.package_available("h5py"):
-    import h5py
-
 __all__ = ["MedicalVolume"]
 
 
@@ -136,7 +130,8 @@ class MedicalVolume(NDArrayOperatorsMixin):
 
     def __init__(self, volume, affine, headers=None):
         xp = get_array_module(volume)
-        self._volume = xp.asarray(volume)
+        # Memory-mapped and chunked arrays are kept as-is so that slicing only reads the requested data.
+        self._volume = volume if isinstance(volume, (np.memmap, ChunkedArray)) else xp.asarray(volume)
         self._affine = np.array(affine)
         self._headers = self._validate_and_format_headers(headers) if headers is not None else None
 
@@ -157,10 +152,30 @@ class MedicalVolume(NDArrayOperatorsMixin):
         writer = format_io_utils.get_writer(data_format)
         writer.save(self, file_path)
 
+    def to_shared(self, include_headers: bool = False):
+        """Copies the volume to shared memory, to pass it cheaply to other processes.
+
+        Args:
+            include_headers (bool, optional): If ``True``, the DICOM headers are carried by
+                the handle. By default, only the affine and the BIDS headers are.
+
+        Returns:
+            SharedVolumeHandle: The handle, owning the shared memory block. Workers call
+            ``handle.attach()`` to get a volume backed by the same memory.
+        """
+        from .shared import share_volume
+
+        if self.device != cpu_device:
+            raise RuntimeError(f"MedicalVolume must be on cpu, got {self.device}")
+        return share_volume(self, include_headers=include_headers)
+
     def reformat(self, new_orientation: Sequence, inplace: bool = False) -> "MedicalVolume":
         """Reorients volume to a specified orientation.
 
         Flipping and transposing the volume array (``self.volume``) returns a view if possible.
+        No data is copied: the transpose and the flips are expressed as strides of the view, so
+        chained reformats compose into a single strided view, and the data is only materialized
+        when a contiguous buffer is required (e.g. when writing).
 
         Reorientation method:
         ---------------------
@@ -187,7 +202,6 @@ class MedicalVolume(NDArrayOperatorsMixin):
         Returns:
             MedicalVolume: The reformatted volume. If ``inplace=True``, returns ``self``.
         """
-        print('Reformat')
         xp = self.device.xp
         device = self.device
         headers = self._headers
@@ -245,8 +259,6 @@ class MedicalVolume(NDArrayOperatorsMixin):
         temp_affine[:3, 3] = b_origin
         temp_affine[temp_affine == 0] = 0  # get rid of negative 0s
 
-        print('temp affine', temp_affine)
-
         if inplace:
             self._affine = temp_affine
             self._volume = volume
@@ -450,8 +462,9 @@ class MedicalVolume(NDArrayOperatorsMixin):
         Returns:
             self
         """
+        h5py = env.imported_module("h5py")
         if (
-            env.package_available("h5py")
+            h5py is not None
             and isinstance(self._volume, h5py.Dataset)
             and version.parse(env.get_version(h5py)) < version.parse("3.0.0")
         ):
@@ -507,6 +520,8 @@ class MedicalVolume(NDArrayOperatorsMixin):
         """
         if not env.sitk_available():
             raise ImportError("SimpleITK is not installed. Install it with `pip install simpleitk`")
+        import SimpleITK as sitk
+
         device = self.device
         if device != cpu_device:
             raise RuntimeError(f"MedicalVolume must be on cpu, got {self.device}")
@@ -830,8 +845,14 @@ class MedicalVolume(NDArrayOperatorsMixin):
 
         See orientation.py for more information on conventions.
         """
-        nib_orientation = nib.aff2axcodes(self._affine)
-        return stdo.orientation_nib_to_standard(nib_orientation)
+        # the orientation is recomputed only when the affine changed
+        affine_key = self._affine.tobytes()
+        cached = getattr(self, "_orientation_cache", None)
+        if cached is None or cached[0] != affine_key:
+            nib_orientation = nib.aff2axcodes(self._affine)
+            cached = (affine_key, stdo.orientation_nib_to_standard(nib_orientation))
+            self._orientation_cache = cached
+        return cached[1]
 
     @property
     def scanner_origin(self):
@@ -865,7 +886,7 @@ class MedicalVolume(NDArrayOperatorsMixin):
 
     @classmethod
     def from_nib(
-        cls, image, affine_precision: int = None, origin_precision: int = None
+        cls, image, affine_precision: int = None, origin_precision: int = None, mmap: bool = False
     ) -> "MedicalVolume":
         """Constructs MedicalVolume from nibabel images.
 
@@ -875,6 +896,11 @@ class MedicalVolume(NDArrayOperatorsMixin):
                 vectors in the affine matrix to this decimal precision.
             origin_precision (int, optional): If specified, rounds the scanner origin
                 in the affine matrix to this decimal precision.
+            mmap (bool, optional): If ``True``, use the image data in its on-disk dtype
+                instead of ``image.get_fdata()``. If the image was loaded with
+                ``nib.load(..., mmap="r")`` from an uncompressed file without intensity
+                scaling, the volume is a read-only ``np.memmap`` and no data is read until
+                it is accessed.
 
         Returns:
             MedicalVolume: The medical image.
@@ -897,7 +923,8 @@ class MedicalVolume(NDArrayOperatorsMixin):
         if origin_precision:
             affine[:3, 3] = np.round(affine[:3, 3], origin_precision)
 
-        return cls(image.get_fdata(), affine)
+        volume = np.asanyarray(image.dataobj) if mmap else image.get_fdata()
+        return cls(volume, affine)
 
     @classmethod
     def from_sitk(cls, image, copy=False) -> "MedicalVolume":
@@ -915,6 +942,7 @@ class MedicalVolume(NDArrayOperatorsMixin):
         """
         if not env.sitk_available():
             raise ImportError("SimpleITK is not installed. Install it with `pip install simpleitk`")
+        import SimpleITK as sitk
 
         if len(image.GetSize()) < 3:
             raise ValueError("`image` must be 3D.")
@@ -1038,6 +1066,8 @@ class MedicalVolume(NDArrayOperatorsMixin):
             array = tensor.detach().numpy()
         else:
             if env.cupy_available():
+                import cupy as cp
+
                 array = cp.fromDlpack(to_dlpack(tensor))
             else:
                 raise ImportError(  # pragma: no cover
@@ -1107,7 +1137,10 @@ class MedicalVolume(NDArrayOperatorsMixin):
             if device != cpu_device:
                 raise RuntimeError(device_err.format(cpu_device))
             return input
-        elif env.cupy_available() and isinstance(input, cp.ndarray):
+        elif (
+            env.imported_module("cupy") is not None
+            and isinstance(input, env.imported_module("cupy").ndarray)
+        ):
             if device != input.device:
                 raise RuntimeError(device_err.format(Device(input.device)))
             return input
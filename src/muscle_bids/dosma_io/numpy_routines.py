@@ -1,10 +1,13 @@
 """List of numpy functions supported for MedicalVolumes.
 """
+import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import Sequence, Union
 
 import numpy as np
 
+from .device import get_array_module
 from .med_volume import MedicalVolume
 
 __all__ = [
@@ -42,6 +45,9 @@ __all__ = [
 
 _HANDLED_NUMPY_FUNCTIONS = {}
 
+# outputs of stack/concatenate from this size on are filled by several threads
+_THREADED_COPY_BYTES = 64 << 20
+
 
 def implements(*np_functions):
     "Register an __array_function__ implementation for DiagonalArray objects."
@@ -248,17 +254,21 @@ def stack(xs, axis: int = -1):
     if not isinstance(axis, int):
         raise TypeError(f"'{type(axis)}' cannot be interpreted as int")
 
-    xs = [x.reformat(xs[0].orientation) for x in xs]
+    xs = _reformat_all(xs)
     affine = xs[0].affine
-    for x in xs[1:]:
-        assert x.is_same_dimensions(xs[0], err=True)
+    # geometry is validated for all inputs at once, the pairwise check only builds the error
+    mismatch = _first_affine_mismatch(xs)
+    if mismatch is None:
+        mismatch = next((i for i, x in enumerate(xs) if x.shape != xs[0].shape), None)
+    if mismatch is not None:
+        assert xs[mismatch].is_same_dimensions(xs[0], err=True)
     try:
         axis = _to_positive_axis(axis, len(xs[0].shape), grow=True, invalid_axis="spatial")
     except ValueError:
         raise ValueError(f"Cannot stack across spatial dimension (axis={axis})")
     assert axis >= 0
 
-    vol = np.stack([x.volume for x in xs], axis=axis)
+    vol = _stack_volumes([x.volume for x in xs], axis)
     headers = [x.headers() for x in xs]
     if any(x is None for x in headers):
         headers = None
@@ -322,45 +332,50 @@ def concatenate(xs, axis: int = -1):
     if not isinstance(axis, int):
         raise TypeError(f"'{type(axis)}' cannot be interpreted as int")
 
-    xs = [x.reformat(xs[0].orientation) for x in xs]
+    xs = _reformat_all(xs)
     axis = _to_positive_axis(axis, len(xs[0].shape), grow=False, invalid_axis=None)
     assert axis >= 0
 
     if axis in range(3):
         # Concatenate along spatial dimension
-        for i, x in enumerate(xs[1:]):
-            if not x._allclose_spacing(xs[0], precision=precision, ignore_origin=True):
-                raise ValueError(
-                    "All the inputs must have the same direction and pixel spacing "
-                    "when concatenating spatial dimensions, but input at index 0 "
-                    "has affine {} and the input at index {} "
-                    "has affine {}".format(xs[0].affine[:3, :3], i, x.affine[:3, :3])
-                )
-        for i, (x1, x2) in enumerate(zip(xs[:-1], xs[1:])):
-            ijk1 = np.array([0, 0, 0, 1])
-            ijk1[axis] = x1.shape[axis]
-            xyz = x1.affine.dot(ijk1)[:3]
-            if not (
-                (precision is not None and np.allclose(x2.scanner_origin, xyz, rtol=tol))
-                or (np.asarray(x2.scanner_origin) == xyz).all()
-            ):
-                raise ValueError(
-                    "All the inputs must be sequentially increasing in space "
-                    "when concatenating spatial dimensions, but input at index {} "
-                    "ends at xyz location {} and the input at index {} "
-                    "starts at xyz location {}".format(i, xyz, i + 1, x2.scanner_origin)
-                )
+        i = _first_affine_mismatch(xs, precision=precision, ignore_origin=True)
+        if i is not None:
+            raise ValueError(
+                "All the inputs must have the same direction and pixel spacing "
+                "when concatenating spatial dimensions, but input at index 0 "
+                "has affine {} and the input at index {} "
+                "has affine {}".format(xs[0].affine[:3, :3], i, xs[i].affine[:3, :3])
+            )
+        # end of every input along the axis, compared at once with the origin of the next one
+        affines = np.stack([x.affine for x in xs])
+        ijk = np.zeros((len(xs) - 1, 4))
+        ijk[:, 3] = 1
+        ijk[:, axis] = [x.shape[axis] for x in xs[:-1]]
+        ends = np.einsum("nij,nj->ni", affines[:-1], ijk)[:, :3]
+        origins = affines[1:, :3, 3]
+        if precision is not None:
+            consecutive = np.all(np.isclose(origins, ends, rtol=tol), axis=1)
+        else:
+            consecutive = np.all(origins == ends, axis=1)
+        if not consecutive.all():
+            i = int(np.argmin(consecutive))
+            raise ValueError(
+                "All the inputs must be sequentially increasing in space "
+                "when concatenating spatial dimensions, but input at index {} "
+                "ends at xyz location {} and the input at index {} "
+                "starts at xyz location {}".format(i, ends[i], i + 1, xs[i + 1].scanner_origin)
+            )
     else:
-        for i, x in enumerate(xs[1:]):
-            if not x._allclose_spacing(xs[0], precision=precision):
-                raise ValueError(
-                    "All the inputs must have the same affine matrix "
-                    "when concatenating non-spatial dimensions, but input at index 0 "
-                    "has affine {} and the input at index {} "
-                    "has affine {}".format(xs[0].affine, i, x.affine)
-                )
-
-    volume = np.concatenate([x.volume for x in xs], axis=axis)
+        i = _first_affine_mismatch(xs, precision=precision)
+        if i is not None:
+            raise ValueError(
+                "All the inputs must have the same affine matrix "
+                "when concatenating non-spatial dimensions, but input at index 0 "
+                "has affine {} and the input at index {} "
+                "has affine {}".format(xs[0].affine, i, xs[i].affine)
+            )
+
+    volume = _concatenate_volumes([x.volume for x in xs], axis=axis)
     headers = [x.headers() for x in xs]
     if any(x is None for x in headers):
         headers = None
@@ -620,6 +635,78 @@ def may_share_memory(a, b, max_work=None):  # pragma: no cover
     return vol and headers
 
 
+def _reformat_all(xs):
+    """Reformats the volumes to the orientation of the first one, skipping those already in it."""
+    # volumes with the same direction matrix as the first one have its orientation: only the others are checked
+    affines = np.stack([x.affine[:3, :3] for x in xs])
+    same_direction = np.all(affines == affines[0], axis=(1, 2))
+    orientation = xs[0].orientation
+    return [
+        x if same or x.orientation == orientation else x.reformat(orientation)
+        for x, same in zip(xs, same_direction)
+    ]
+
+
+def _first_affine_mismatch(xs, precision: int = None, ignore_origin: bool = False):
+    """Compares the affines of all volumes with the first one at once.
+
+    Equivalent to ``x._allclose_spacing(xs[0], precision, ignore_origin)`` for every ``x``.
+
+    Returns:
+        Optional[int]: The index of the first volume whose affine differs, ``None`` if all match.
+    """
+    affines = np.stack([x.affine for x in xs])
+    if precision is not None:
+        tol = 10 ** (-precision)
+        same = np.all(np.isclose(affines[0, :3, :3], affines[:, :3, :3], atol=tol), axis=(1, 2))
+        if not ignore_origin:
+            same &= np.all(np.isclose(affines[0, :3, 3], affines[:, :3, 3], rtol=tol), axis=1)
+    else:
+        columns = slice(0, 3) if ignore_origin else slice(None)
+        same = np.all(affines[:, :, columns] == affines[0, :, columns], axis=(1, 2))
+    if same.all():
+        return None
+    return int(np.argmin(same))
+
+
+def _copy_parts(out, parts, axis, offsets):
+    """Copies the parts into ``out`` along ``axis`` at the given offsets, in threads for large outputs."""
+
+    def _copy(i):
+        index = [slice(None)] * out.ndim
+        index[axis] = slice(offsets[i], offsets[i] + parts[i].shape[axis])
+        out[tuple(index)] = parts[i]
+
+    workers = min(len(parts), os.cpu_count() or 1)
+    if workers > 1 and out.nbytes >= _THREADED_COPY_BYTES:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_copy, range(len(parts))))
+    else:
+        for i in range(len(parts)):
+            _copy(i)
+
+
+def _concatenate_volumes(volumes, axis):
+    """Concatenates arrays into a single preallocated output."""
+    if not all(isinstance(v, np.ndarray) for v in volumes):
+        xp = get_array_module(volumes[0])
+        return xp.concatenate(volumes, axis=axis)
+    shape = list(volumes[0].shape)
+    sizes = [v.shape[axis] for v in volumes]
+    shape[axis] = sum(sizes)
+    out = np.empty(shape, dtype=np.result_type(*{v.dtype for v in volumes}))
+    _copy_parts(out, volumes, axis, np.cumsum([0] + sizes[:-1]))
+    return out
+
+
+def _stack_volumes(volumes, axis):
+    """Stacks arrays of the same shape into a single preallocated output."""
+    if not all(isinstance(v, np.ndarray) for v in volumes):
+        xp = get_array_module(volumes[0])
+        return xp.stack(volumes, axis=axis)
+    return _concatenate_volumes([np.expand_dims(v, axis) for v in volumes], axis)
+
+
 def _to_positive_axis(
     axis: Union[int, Sequence[int]],
     ndim: int,
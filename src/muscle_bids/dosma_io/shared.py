@@ -0,0 +1,167 @@
+"""Shared-memory transport of volumes between processes.
+
+A :class:`SharedVolumeHandle` refers to an array stored in a ``multiprocessing.shared_memory``
+block. Pickling the handle only sends the name of the block, the shape, the dtype, the affine
+and the compact (BIDS) headers, so that it can be passed to pool workers at a negligible cost.
+Workers attach to the block and get a volume backed by the same memory, without copy:
+
+    >>> handle = share_volume(mv)
+    >>> with mp.Pool(4) as pool:
+    >>>     pool.map(process, [handle] * 4)  # process calls handle.attach()
+    >>> handle.unlink()
+"""
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .med_volume import MedicalVolume
+
+__all__ = ["SharedVolumeHandle", "share_volume"]
+
+# BIDS headers set on MedicalVolume by muscle_bids, carried by the handles
+_HEADER_ATTRIBUTES = ("bids_header", "meta_header", "patient_header", "extra_header")
+
+# shared memory blocks opened by this process, by name. The blocks stay mapped until the handle is closed,
+# so that the arrays backed by them remain valid.
+_open_blocks = {}
+
+
+def _open_block(name):
+    block = _open_blocks.get(name)
+    if block is None:
+        try:
+            # Python >= 3.13: only the creator tracks the block
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            block = shared_memory.SharedMemory(name=name)
+            # the resource tracker would otherwise unlink the block when this process exits
+            resource_tracker.unregister(block._name, "shared_memory")
+        _open_blocks[name] = block
+    return block
+
+
+class SharedVolumeHandle(object):
+    """Picklable reference to an array in shared memory, with optional volume metadata.
+
+    Handles are created with :meth:`create` or :func:`share_volume`. The process that created
+    the block owns it and must call :meth:`unlink` (or use the handle as a context manager)
+    once all the processes are done with it.
+
+    Args:
+        name (str): Name of the shared memory block.
+        shape (tuple[int]): Shape of the array.
+        dtype (str): Data type of the array.
+        affine (np.ndarray, optional): 4x4 affine matrix of the volume.
+        headers (np.ndarray, optional): DICOM headers of the volume.
+        attributes (dict, optional): Header attributes (e.g. ``bids_header``) set on attached volumes.
+    """
+
+    def __init__(self, name, shape, dtype, affine=None, headers=None, attributes=None):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.affine = None if affine is None else np.array(affine)
+        self.headers = headers
+        self.attributes = attributes or {}
+        self._owner = False
+
+    @classmethod
+    def create(cls, shape, dtype, affine=None, headers=None, attributes=None):
+        """Allocates a new shared memory block. The returned handle owns the block.
+
+        Args:
+            shape (tuple[int]): Shape of the array.
+            dtype (np.dtype): Data type of the array.
+            affine (np.ndarray, optional): 4x4 affine matrix of the volume.
+            headers (np.ndarray, optional): DICOM headers of the volume.
+            attributes (dict, optional): Header attributes set on attached volumes.
+
+        Returns:
+            SharedVolumeHandle: The handle. The array is not initialized.
+        """
+        nbytes = max(1, int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        _open_blocks[block.name] = block
+        handle = cls(block.name, shape, dtype, affine, headers, attributes)
+        handle._owner = True
+        return handle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_owner"] = False
+        return state
+
+    def array(self) -> np.ndarray:
+        """Returns the array backed by the shared memory block, attaching to it if needed."""
+        block = _open_block(self.name)
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=block.buf)
+
+    def attach(self) -> MedicalVolume:
+        """Returns a volume backed by the shared memory block, without copying the data.
+
+        Returns:
+            MedicalVolume: The volume, with the headers and attributes of the handle.
+
+        Raises:
+            ValueError: If the handle has no affine matrix.
+        """
+        if self.affine is None:
+            raise ValueError("The shared array has no affine matrix, use `array()` instead")
+        mv = MedicalVolume(self.array(), self.affine, headers=self.headers)
+        for attribute, value in self.attributes.items():
+            setattr(mv, attribute, value)
+        return mv
+
+    def close(self):
+        """Unmaps the block in this process. Arrays backed by it must not be used afterwards."""
+        block = _open_blocks.pop(self.name, None)
+        if block is not None:
+            block.close()
+
+    def unlink(self):
+        """Closes the block and, if this handle owns it, frees it."""
+        if not self._owner:
+            self.close()
+            return
+        block = _open_blocks.get(self.name) or shared_memory.SharedMemory(name=self.name)
+        self.close()
+        block.unlink()
+        self._owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unlink()
+
+    def __repr__(self):
+        return f"SharedVolumeHandle(name={self.name!r}, shape={self.shape}, dtype={self.dtype!r})"
+
+
+def share_volume(volume, include_headers: bool = False) -> SharedVolumeHandle:
+    """Copies a volume (or an array) to a new shared memory block.
+
+    Args:
+        volume (MedicalVolume or np.ndarray): The data to share. Must be on the cpu.
+        include_headers (bool, optional): If ``True``, the DICOM headers are carried by the
+            handle and pickled with it. By default, only the affine and the BIDS headers are.
+
+    Returns:
+        SharedVolumeHandle: The handle owning the block.
+    """
+    if isinstance(volume, MedicalVolume):
+        data = np.asarray(volume.volume)
+        affine = volume.affine
+        headers = volume.headers() if include_headers else None
+        attributes = {
+            attribute: getattr(volume, attribute)
+            for attribute in _HEADER_ATTRIBUTES
+            if getattr(volume, attribute, None) is not None
+        }
+    else:
+        data = np.asarray(volume)
+        affine, headers, attributes = None, None, None
+
+    handle = SharedVolumeHandle.create(data.shape, data.dtype, affine, headers, attributes)
+    handle.array()[...] = data
+    return handle
@@ -0,0 +1,20 @@
+from collections import namedtuple
+
+from ..converters import MeSeConverterSiemensMagnitude, MeSeConverterPhilipsMagnitude, MeSeConverterPhilipsPhase, \
+    MeGreConverterGEPhase, MeGreConverterGEReal, MeGreConverterGEImaginary
+from ..converters.quantitative_maps import T2Converter, FFConverter, B0Converter
+from .t2 import fit_t2_map, fit_t2, fit_t2_loglinear, fit_t2_monoexp
+from .dixon import fit_fat_fraction_map, fit_fat_fraction, fat_signal_model
+from .b0 import fit_b0_map, estimate_b0, unwrap_phase_laplacian
+
+# A fitting stage computes a quantitative map from converted volumes. It runs when all the converters of one of its
+# input sets were applied to a series: fit_function(*volumes, workers=...) receives their outputs in the order of the
+# set and returns the map, which is saved with the naming of output_converter
+FitStage = namedtuple('FitStage', ['name', 'input_sets', 'output_converter', 'fit_function'])
+
+fit_stages = {
+    't2': FitStage('t2', [(MeSeConverterSiemensMagnitude,), (MeSeConverterPhilipsMagnitude,)], T2Converter,
+                   fit_t2_map),
+    'ff': FitStage('ff', [(MeGreConverterGEReal, MeGreConverterGEImaginary)], FFConverter, fit_fat_fraction_map),
+    'b0': FitStage('b0', [(MeGreConverterGEPhase,), (MeSeConverterPhilipsPhase,)], B0Converter, fit_b0_map),
+}
@@ -0,0 +1,113 @@
+import numpy as np
+
+from ..converters.quantitative_maps import B0Converter
+from ..utils.headers import reduce, replace_volume
+
+
+def _wrap(phase):
+    return np.angle(np.exp(1j * phase))
+
+
+def _laplacian_eigenvalues(shape):
+    """ Eigenvalues of the discrete Laplacian with Neumann boundaries in the DCT-II basis """
+    eigenvalues = np.zeros(shape)
+    for axis, n in enumerate(shape):
+        axis_shape = [1] * len(shape)
+        axis_shape[axis] = n
+        eigenvalues = eigenvalues + (2 * np.cos(np.pi * np.arange(n) / n) - 2).reshape(axis_shape)
+    return eigenvalues
+
+
+def unwrap_phase_laplacian(wrapped_phase, workers=None):
+    """
+    Unwraps a 3D phase volume at once with the Laplacian method: the Laplacian of the true phase is obtained from
+    the wrapped one as cos(p) * lap(sin(p)) - sin(p) * lap(cos(p)), and the Poisson equation is solved with a
+    discrete cosine transform. The result is then snapped to the wrapped phase plus a multiple of 2 pi.
+
+    Parameters:
+        wrapped_phase (np.ndarray): phase in radians, wrapped to (-pi, pi]
+        workers (int): number of threads used by the transforms
+
+    Returns:
+        np.ndarray: the unwrapped phase
+    """
+    # scipy is only loaded when a b0 map is fitted
+    from scipy import fft
+
+    eigenvalues = _laplacian_eigenvalues(wrapped_phase.shape)
+
+    def _laplacian(x):
+        return fft.idctn(fft.dctn(x, norm='ortho', workers=workers) * eigenvalues, norm='ortho', workers=workers)
+
+    sin_phase = np.sin(wrapped_phase)
+    cos_phase = np.cos(wrapped_phase)
+    laplacian = cos_phase * _laplacian(sin_phase) - sin_phase * _laplacian(cos_phase)
+
+    # inverse Laplacian, the constant mode is undetermined and set to zero
+    eigenvalues[(0,) * eigenvalues.ndim] = 1
+    spectrum = fft.dctn(laplacian, norm='ortho', workers=workers) / eigenvalues
+    spectrum[(0,) * spectrum.ndim] = 0
+    smooth_phase = fft.idctn(spectrum, norm='ortho', workers=workers)
+
+    return wrapped_phase + 2 * np.pi * np.round((smooth_phase - wrapped_phase) / (2 * np.pi))
+
+
+def estimate_b0(phase, echo_times, unwrap=True, workers=None):
+    """
+    Estimates the B0 field from multi-echo phase data.
+    The phase differences of consecutive echoes are combined on the unit circle for all voxels at once, giving a
+    field wrapped to +/- 1 / (2 delta TE), which is then unwrapped spatially over the whole volume.
+
+    Parameters:
+        phase (np.ndarray): phase in radians, of shape (x, y, z, n_echoes)
+        echo_times (np.ndarray): echo times in seconds, with a constant spacing
+        unwrap (bool): unwrap the field spatially
+        workers (int): number of threads used by the transforms
+
+    Returns:
+        np.ndarray: the B0 field offset in Hz, of shape (x, y, z)
+
+    Raises:
+        ValueError: if there are less than two echoes
+    """
+    echo_times = np.asarray(echo_times, dtype=np.float64)
+    if len(echo_times) < 2:
+        raise ValueError('At least two echoes are needed to estimate B0')
+    order = np.argsort(echo_times)
+    echo_times = echo_times[order]
+    phase = np.asarray(phase)[..., order]
+    echo_spacing = np.mean(np.diff(echo_times))
+
+    # sum of exp(i * (phase[e+1] - phase[e])) over the echo pairs
+    phasors = np.exp(1j * phase)
+    phase_difference = np.angle(np.sum(phasors[..., 1:] * phasors[..., :-1].conj(), axis=-1))
+
+    if unwrap:
+        phase_difference = unwrap_phase_laplacian(phase_difference, workers)
+    return phase_difference / (2 * np.pi * echo_spacing)
+
+
+def fit_b0_map(phase_volume, phase_scale=None, unwrap=True, workers=0):
+    """
+    Computes a B0 map from the 4D phase output of MeGreConverterGEPhase or MeSeConverterPhilipsPhase.
+
+    Parameters:
+        phase_volume (MedicalVolume): 4D phase, grouped by EchoTime (in ms)
+        phase_scale (float): factor converting the stored phase to radians. By default, phases with values outside
+            [-2 pi, 2 pi] are assumed to be in milliradians (GE), otherwise in radians
+        unwrap (bool): unwrap the field spatially
+        workers (int): number of threads used by the transforms. 0 uses one thread
+
+    Returns:
+        MedicalVolume: the 3D B0 map in Hz, as produced by B0Converter
+    """
+    assert phase_volume.ndim == 4, 'B0 estimation needs a 4D phase volume grouped by echo time'
+    echo_times = np.asarray(phase_volume.bids_header['EchoTime'], dtype=np.float64)
+
+    phase = np.asarray(phase_volume.volume, dtype=np.float64)
+    if phase_scale is None:
+        phase_scale = 1e-3 if np.abs(phase).max() > 2 * np.pi else 1.0
+    b0_map = estimate_b0(phase * phase_scale, echo_times / 1000, unwrap, workers or None)
+
+    b0_volume = replace_volume(reduce(phase_volume, 0), b0_map.astype(np.float32))
+    return B0Converter.convert_dataset(b0_volume)
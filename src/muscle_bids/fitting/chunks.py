@@ -0,0 +1,39 @@
+import multiprocessing as mp
+
+import numpy as np
+
+
+def map_chunks(chunk_function, data, args=(), chunk_size=65536, workers=0, dtype=np.float32):
+    """
+    Applies a function to the rows of a 2D array in chunks, optionally in a process pool.
+
+    Parameters:
+        chunk_function (callable): top-level function called as chunk_function(chunk, *args). Must return an array
+            with one value per row of the chunk
+        data (np.ndarray): array of shape (n_voxels, n_samples)
+        args (tuple): additional arguments of the function
+        chunk_size (int): number of rows per chunk
+        workers (int): number of processes. 0 runs in the calling process
+        dtype (np.dtype): data type of the output
+
+    Returns:
+        np.ndarray: the concatenated results, of shape (n_voxels,)
+    """
+    output = np.zeros(data.shape[0], dtype=dtype)
+    chunks = [(start, min(start + chunk_size, data.shape[0])) for start in range(0, data.shape[0], chunk_size)]
+    tasks = ((chunk_function, data[start:stop], args) for start, stop in chunks)
+
+    if workers:
+        with mp.Pool(workers) as pool:
+            for (start, stop), result in zip(chunks, pool.imap(_run_task, tasks)):
+                output[start:stop] = result
+    else:
+        for (start, stop), task in zip(chunks, tasks):
+            output[start:stop] = _run_task(task)
+
+    return output
+
+
+def _run_task(task):
+    chunk_function, chunk, args = task
+    return chunk_function(chunk, *args)
@@ -0,0 +1,154 @@
+import numpy as np
+
+from .chunks import map_chunks
+from ..converters.quantitative_maps import FFConverter
+from ..utils.headers import reduce, replace_volume
+
+GYROMAGNETIC_RATIO_HZ_T = 42.577478e6
+
+# six-peak fat spectrum: chemical shift relative to water (ppm) and relative amplitudes
+FAT_PEAKS_PPM = np.array([-3.80, -3.40, -2.60, -1.94, -0.39, 0.60])
+FAT_PEAKS_AMPLITUDES = np.array([0.087, 0.693, 0.128, 0.004, 0.039, 0.048])
+
+
+def fat_signal_model(echo_times, field_strength, peaks_ppm=FAT_PEAKS_PPM, peaks_amplitudes=FAT_PEAKS_AMPLITUDES):
+    """
+    Computes the complex signal of the multi-peak fat spectrum at the echo times.
+
+    Parameters:
+        echo_times (np.ndarray): echo times in seconds
+        field_strength (float): magnetic field strength in tesla
+        peaks_ppm (np.ndarray): chemical shift of the fat peaks relative to water, in ppm
+        peaks_amplitudes (np.ndarray): relative amplitudes of the fat peaks (summing to 1)
+
+    Returns:
+        np.ndarray: complex fat signal of shape (n_echoes,)
+    """
+    peaks_hz = np.asarray(peaks_ppm) * 1e-6 * GYROMAGNETIC_RATIO_HZ_T * field_strength
+    return np.exp(2j * np.pi * np.outer(echo_times, peaks_hz)) @ np.asarray(peaks_amplitudes)
+
+
+def _build_dictionary(echo_times, fat_signal, field_grid, r2star_grid):
+    """
+    Precomputes, for every (field, R2*) pair of the grid, an orthonormal basis of the water/fat model and the
+    pseudo-inverse giving the water and fat amplitudes.
+    """
+    field, r2star = np.meshgrid(field_grid, r2star_grid, indexing='ij')
+    field = field.ravel()
+    r2star = r2star.ravel()
+    # (n_grid, n_echoes) common phase and decay
+    decay = np.exp(np.outer(2j * np.pi * field - r2star, echo_times))
+    # (n_grid, n_echoes, 2) model matrices: water and fat columns
+    models = np.stack([decay, decay * fat_signal[None, :]], axis=2)
+    bases, _ = np.linalg.qr(models)
+    pseudo_inverses = np.linalg.pinv(models)
+    return bases, pseudo_inverses
+
+
+def _fit_fat_fraction_chunk(signal, bases, pseudo_inverses):
+    # the residual of the linear fit is |S|^2 - |Q^H S|^2: the best grid point maximizes the projected energy
+    n_grid, n_echoes, n_columns = bases.shape
+    # only the best energy and grid point so far are kept: the memory is bounded by chunk x block_size
+    best_energy = np.full(signal.shape[0], -np.inf)
+    best = np.zeros(signal.shape[0], dtype=np.intp)
+    # blocks of grid points are projected with a single matrix product
+    block_size = 64
+    for block_start in range(0, n_grid, block_size):
+        block = bases[block_start:block_start + block_size].conj()
+        block_matrix = block.transpose(1, 0, 2).reshape(n_echoes, -1)
+        projection = np.abs(signal @ block_matrix) ** 2
+        block_energy = projection.reshape(signal.shape[0], len(block), n_columns).sum(axis=2)
+        block_best = np.argmax(block_energy, axis=1)
+        block_best_energy = np.take_along_axis(block_energy, block_best[:, None], axis=1)[:, 0]
+        # strictly greater: ties keep the first grid point, as argmax over the whole grid
+        improved = block_best_energy > best_energy
+        best_energy[improved] = block_best_energy[improved]
+        best[improved] = block_start + block_best[improved]
+
+    amplitudes = np.einsum('nkj,nj->nk', pseudo_inverses[best], signal)
+    water = np.abs(amplitudes[:, 0])
+    fat = np.abs(amplitudes[:, 1])
+    total = water + fat
+    fat_fraction = np.zeros(signal.shape[0])
+    np.divide(fat, total, out=fat_fraction, where=total > 0)
+    return 100 * fat_fraction
+
+
+def fit_fat_fraction(signal, echo_times, field_strength, field_range=None, n_field_steps=64, r2star_max=300.0,
+                     n_r2star_steps=16, chunk_size=16384, workers=0):
+    """
+    Fits water, fat, field map and R2* on complex multi-echo gradient echo data with a multi-peak fat model, and
+    returns the fat fraction.
+
+    The nonlinear parameters (field and R2*) are found by variable projection on a grid shared by all voxels:
+    the model bases for every grid point are computed once, and each chunk of voxels is projected on all of them
+    with matrix products. Water and fat are then obtained by linear least squares at the best grid point.
+
+    Parameters:
+        signal (np.ndarray): complex signal of shape (..., n_echoes)
+        echo_times (np.ndarray): echo times in seconds
+        field_strength (float): magnetic field strength in tesla
+        field_range (tuple): range of the searched field offsets in Hz. Defaults to +/- half the echo spacing
+            bandwidth
+        n_field_steps (int): number of field values of the grid
+        r2star_max (float): maximum R2* of the grid, in 1/s
+        n_r2star_steps (int): number of R2* values of the grid
+        chunk_size (int): number of voxels per chunk
+        workers (int): number of processes. 0 fits in the calling process
+
+    Returns:
+        np.ndarray: fat fraction in percent, of shape signal.shape[:-1]
+    """
+    echo_times = np.asarray(echo_times, dtype=np.float64)
+    if signal.shape[-1] != len(echo_times):
+        raise ValueError(f'The signal has {signal.shape[-1]} echoes, but {len(echo_times)} echo times were given')
+    if len(echo_times) < 3:
+        raise ValueError('At least three echoes are needed to fit water, fat, field and R2*')
+
+    if field_range is None:
+        echo_spacing = np.min(np.diff(np.sort(echo_times)))
+        field_range = (-0.5 / echo_spacing, 0.5 / echo_spacing)
+    field_grid = np.linspace(field_range[0], field_range[1], n_field_steps, endpoint=False)
+    r2star_grid = np.linspace(0, r2star_max, n_r2star_steps)
+
+    fat_signal = fat_signal_model(echo_times, field_strength)
+    bases, pseudo_inverses = _build_dictionary(echo_times, fat_signal, field_grid, r2star_grid)
+
+    flat_signal = np.asarray(signal, dtype=np.complex128).reshape(-1, signal.shape[-1])
+    fat_fraction = map_chunks(_fit_fat_fraction_chunk, flat_signal, (bases, pseudo_inverses), chunk_size, workers)
+    return fat_fraction.reshape(signal.shape[:-1])
+
+
+def fit_fat_fraction_map(real_volume, imaginary_volume, mask_threshold=None, workers=0, **kwargs):
+    """
+    Computes a fat fraction map from the real and imaginary outputs of the GE MEGRE converters.
+
+    Parameters:
+        real_volume (MedicalVolume): 4D real part, grouped by EchoTime (in ms)
+        imaginary_volume (MedicalVolume): 4D imaginary part, grouped by EchoTime (in ms)
+        mask_threshold (float): voxels whose first echo magnitude is not above the threshold are set to 0 and not
+            fitted. Defaults to 5% of the maximum of the first echo
+        workers (int): number of processes. 0 fits in the calling process
+        **kwargs: passed to fit_fat_fraction
+
+    Returns:
+        MedicalVolume: the 3D fat fraction map in percent, as produced by FFConverter
+    """
+    assert real_volume.ndim == 4 and real_volume.shape == imaginary_volume.shape, \
+        'Fat fraction fitting needs 4D real and imaginary volumes of the same shape'
+    echo_times = np.asarray(real_volume.bids_header['EchoTime'], dtype=np.float64)
+    assert np.allclose(echo_times, imaginary_volume.bids_header['EchoTime']), \
+        'The real and imaginary volumes have different echo times'
+    field_strength = float(real_volume.bids_header['MagneticFieldStrength'])
+
+    signal = real_volume.volume + 1j * np.asarray(imaginary_volume.volume)
+    first_echo = np.abs(signal[..., np.argmin(echo_times)])
+    if mask_threshold is None:
+        mask_threshold = 0.05 * float(first_echo.max())
+    mask = first_echo > mask_threshold
+
+    ff_map = np.zeros(signal.shape[:3], dtype=np.float32)
+    ff_map[mask] = fit_fat_fraction(signal[mask], echo_times / 1000, field_strength, workers=workers, **kwargs)
+
+    ff_volume = replace_volume(reduce(real_volume, 0), ff_map)
+    return FFConverter.convert_dataset(ff_volume)
@@ -0,0 +1,160 @@
+import numpy as np
+
+from .chunks import map_chunks
+from ..converters.quantitative_maps import T2Converter
+from ..utils.headers import reduce, replace_volume
+
+T2_FIT_METHODS = ('loglinear', 'monoexp')
+
+
+def fit_t2_loglinear(signal, echo_times):
+    """
+    Fits S = S0 * exp(-TE/T2) by linear regression of log(S) on TE, for all voxels at once.
+
+    Parameters:
+        signal (np.ndarray): signal of shape (n_voxels, n_echoes)
+        echo_times (np.ndarray): echo times of shape (n_echoes,)
+
+    Returns:
+        (np.ndarray, np.ndarray): T2 (in the unit of the echo times) and S0, of shape (n_voxels,).
+            T2 is 0 where the signal does not decay
+    """
+    echo_times = np.asarray(echo_times, dtype=np.float64)
+    log_signal = np.log(np.maximum(signal, np.finfo(np.float32).tiny))
+
+    centered_te = echo_times - echo_times.mean()
+    slope = log_signal @ centered_te / np.dot(centered_te, centered_te)
+    intercept = log_signal.mean(axis=1) - slope * echo_times.mean()
+
+    t2 = np.zeros(slope.shape, dtype=np.float64)
+    decaying = slope < 0
+    t2[decaying] = -1.0 / slope[decaying]
+    return t2, np.exp(intercept)
+
+
+def fit_t2_monoexp(signal, echo_times, n_iterations=20, t2_max=1000.0):
+    """
+    Fits S = S0 * exp(-TE/T2) by nonlinear least squares, with a Levenberg-Marquardt iteration run on all voxels
+    at once. The log-linear fit is used as the starting point.
+
+    Parameters:
+        signal (np.ndarray): signal of shape (n_voxels, n_echoes)
+        echo_times (np.ndarray): echo times of shape (n_echoes,)
+        n_iterations (int): number of iterations
+        t2_max (float): T2 values are clipped to [0, t2_max]
+
+    Returns:
+        (np.ndarray, np.ndarray): T2 (in the unit of the echo times) and S0, of shape (n_voxels,)
+    """
+    echo_times = np.asarray(echo_times, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+
+    t2, s0 = fit_t2_loglinear(signal, echo_times)
+    # parametrize with R2 = 1/T2, which keeps the problem well conditioned for long T2
+    r2 = np.where(t2 > 0, 1.0 / np.maximum(t2, 1e-12), 1.0 / t2_max)
+    damping = np.full(signal.shape[0], 1e-3)
+
+    def _residuals(s0, r2):
+        return signal - s0[:, None] * np.exp(-np.outer(r2, echo_times))
+
+    cost = np.einsum('ij,ij->i', *(2 * [_residuals(s0, r2)]))
+    for _ in range(n_iterations):
+        decay = np.exp(-np.outer(r2, echo_times))
+        residuals = signal - s0[:, None] * decay
+        # Jacobian of the model with respect to (S0, R2)
+        j_s0 = decay
+        j_r2 = -echo_times[None, :] * s0[:, None] * decay
+
+        # 2x2 normal equations solved in closed form for every voxel
+        a11 = np.einsum('ij,ij->i', j_s0, j_s0) * (1 + damping)
+        a22 = np.einsum('ij,ij->i', j_r2, j_r2) * (1 + damping)
+        a12 = np.einsum('ij,ij->i', j_s0, j_r2)
+        b1 = np.einsum('ij,ij->i', j_s0, residuals)
+        b2 = np.einsum('ij,ij->i', j_r2, residuals)
+        determinant = a11 * a22 - a12 * a12
+        valid = np.abs(determinant) > 1e-30
+        determinant[~valid] = 1.0
+        delta_s0 = np.where(valid, (a22 * b1 - a12 * b2) / determinant, 0)
+        delta_r2 = np.where(valid, (a11 * b2 - a12 * b1) / determinant, 0)
+
+        new_s0 = s0 + delta_s0
+        new_r2 = np.maximum(r2 + delta_r2, 1.0 / t2_max)
+        new_cost = np.einsum('ij,ij->i', *(2 * [_residuals(new_s0, new_r2)]))
+
+        # accept the steps that reduce the cost, increase the damping elsewhere
+        improved = new_cost < cost
+        s0 = np.where(improved, new_s0, s0)
+        r2 = np.where(improved, new_r2, r2)
+        cost = np.where(improved, new_cost, cost)
+        damping = np.where(improved, damping * 0.3, damping * 10)
+
+    t2 = np.clip(1.0 / r2, 0, t2_max)
+    return t2, s0
+
+
+def _fit_chunk(signal, echo_times, method):
+    signal = np.asarray(signal, dtype=np.float64)
+    if method == 'loglinear':
+        return fit_t2_loglinear(signal, echo_times)[0]
+    return fit_t2_monoexp(signal, echo_times)[0]
+
+
+def fit_t2(signal, echo_times, method='loglinear', chunk_size=65536, workers=0):
+    """
+    Fits T2 on a signal array, processing the voxels in chunks, optionally in a process pool.
+
+    Parameters:
+        signal (np.ndarray): signal of shape (..., n_echoes)
+        echo_times (np.ndarray): echo times of shape (n_echoes,)
+        method (str): 'loglinear' or 'monoexp'
+        chunk_size (int): number of voxels per chunk
+        workers (int): number of processes. 0 fits in the calling process
+
+    Returns:
+        np.ndarray: T2 map of shape signal.shape[:-1]
+
+    Raises:
+        ValueError: if the method is unknown or the number of echo times does not match the signal
+    """
+    if method not in T2_FIT_METHODS:
+        raise ValueError(f'Unknown T2 fit method {method}, expected one of {T2_FIT_METHODS}')
+    echo_times = np.asarray(echo_times, dtype=np.float64)
+    if signal.shape[-1] != len(echo_times):
+        raise ValueError(f'The signal has {signal.shape[-1]} echoes, but {len(echo_times)} echo times were given')
+
+    flat_signal = signal.reshape(-1, signal.shape[-1])
+    t2 = map_chunks(_fit_chunk, flat_signal, (echo_times, method), chunk_size, workers)
+    return t2.reshape(signal.shape[:-1])
+
+
+def fit_t2_map(med_volume, method='loglinear', mask_threshold=None, chunk_size=65536, workers=0):
+    """
+    Computes a T2 map from a multi-echo spin echo volume, e.g. the output of MeSeConverterSiemensMagnitude.
+
+    Parameters:
+        med_volume (MedicalVolume): 4D volume grouped by EchoTime (echo times in bids_header['EchoTime'])
+        method (str): 'loglinear' (fast) or 'monoexp' (nonlinear least squares, unbiased at low SNR)
+        mask_threshold (float): voxels whose first echo is not above the threshold are set to 0 and not fitted.
+            Defaults to 5% of the maximum of the first echo
+        chunk_size (int): number of voxels per chunk
+        workers (int): number of processes. 0 fits in the calling process
+
+    Returns:
+        MedicalVolume: the 3D T2 map (in the unit of the echo times) with the headers of the first echo,
+            as produced by T2Converter
+    """
+    assert med_volume.ndim == 4, 'T2 fitting needs a 4D volume grouped by echo time'
+    assert med_volume.bids_header.get('FourthDimension') == 'EchoTime', 'The volume must be grouped by EchoTime'
+    echo_times = np.asarray(med_volume.bids_header['EchoTime'], dtype=np.float64)
+
+    signal = med_volume.volume
+    first_echo = signal[..., np.argmin(echo_times)]
+    if mask_threshold is None:
+        mask_threshold = 0.05 * float(first_echo.max())
+    mask = first_echo > mask_threshold
+
+    t2_map = np.zeros(signal.shape[:3], dtype=np.float32)
+    t2_map[mask] = fit_t2(signal[mask], echo_times, method, chunk_size, workers)
+
+    t2_volume = replace_volume(reduce(med_volume, 0), t2_map)
+    return T2Converter.convert_dataset(t2_volume)
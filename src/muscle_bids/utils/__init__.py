@@ -1 +1,20 @@
-from .headers import reduce, copy_volume_with_bids_headers, replace_volume
\ No newline at end of file
+import importlib
+
+# the public names are imported on first access (PEP 562)
+_LAZY_ATTRIBUTES = {
+    'reduce': 'headers',
+    'copy_volume_with_bids_headers': 'headers',
+    'replace_volume': 'headers',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f'{__name__}.{_LAZY_ATTRIBUTES[name]}'), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
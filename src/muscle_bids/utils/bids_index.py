@@ -0,0 +1,254 @@
+import json
+import os
+from collections import namedtuple
+
+NIFTI_EXTENSIONS = ('.nii.gz', '.nii')
+CACHE_FILE_NAME = '.mbids_index.json'
+_CACHE_VERSION = 1
+
+# path is relative to the dataset root
+BIDSEntry = namedtuple('BIDSEntry', ['path', 'subject', 'suffix', 'directory', 'extension'])
+
+
+def _default_suffixes():
+    """ Returns the file suffixes written by the known converters, e.g. 'mese', 'megre_ph', 't2' """
+    from ..converters import converter_list
+    from ..converters.quantitative_maps import T1Converter, T2Converter, FFConverter, B0Converter, B1Converter
+
+    converters = converter_list + [T1Converter, T2Converter, FFConverter, B0Converter, B1Converter]
+    return {converter_suffix(c) for c in converters}
+
+
+def converter_suffix(converter_class):
+    """ Returns the BIDS suffix of the files written by a converter (its file name without the subject) """
+    return converter_class.get_file_name('').lstrip('_').lower()
+
+
+def _split_extension(file_name):
+    lower_name = file_name.lower()
+    for extension in NIFTI_EXTENSIONS:
+        if lower_name.endswith(extension):
+            return file_name[:-len(extension)], extension
+    return None, None
+
+
+class BIDSIndex:
+    """
+    In-memory index of the NIfTI files of a BIDS dataset.
+
+    The dataset root is walked once. Every file name is parsed into subject, suffix and directory (e.g. anat, quant)
+    and stored in lookup tables, so that queries do not touch the file system. The modification times of all
+    directories are recorded: ``refresh`` only rescans when one of them changed. If ``cache_file`` is given, the
+    index is also persisted there and reused by later processes as long as the directory mtimes are unchanged.
+
+    Parameters:
+        root (str): Root folder of the dataset
+        cache_file (str): Optional path of the cache file. Use ``True`` for ``<root>/.mbids_index.json``
+        suffixes (iterable): Known suffixes, used to split names such as ``sub01_megre_ph``. Defaults to the
+            suffixes of all converters
+
+    Examples:
+        >>> index = BIDSIndex('/data/study', cache_file=True)
+        >>> index.find(suffix='mese')
+        >>> index.find(subject='sub01', directory='quant')
+        >>> index.find_converter(T2Converter)
+    """
+
+    def __init__(self, root, cache_file=None, suffixes=None):
+        self.root = root
+        self._abs_root = os.path.abspath(root)
+        if cache_file is True:
+            cache_file = os.path.join(self._abs_root, CACHE_FILE_NAME)
+        self.cache_file = cache_file
+        if suffixes is None:
+            suffixes = _default_suffixes()
+        # longest first, so that 'megre_ph' is preferred over 'ph'
+        self.suffixes = sorted({s.lower() for s in suffixes}, key=len, reverse=True)
+
+        self._entries = []
+        self._dir_mtimes = {}
+        self._tables = {}
+
+        if not self._load_cache():
+            self._scan()
+            self._save_cache()
+
+    def parse_name(self, file_name):
+        """
+        Splits a file name into subject, suffix and extension.
+
+        Parameters:
+            file_name (str): File name, e.g. sub01_megre_ph.nii.gz
+
+        Returns:
+            (str, str, str): subject, lowercase suffix and extension, or None if the file is not a NIfTI file
+        """
+        base_name, extension = _split_extension(file_name)
+        if base_name is None:
+            return None
+        lower_name = base_name.lower()
+        for suffix in self.suffixes:
+            if lower_name.endswith('_' + suffix):
+                return base_name[:-len(suffix) - 1], suffix, extension
+        if '_' in base_name:
+            subject, suffix = base_name.rsplit('_', 1)
+            return subject, suffix.lower(), extension
+        return '', lower_name, extension
+
+    def _scan(self):
+        self._entries = []
+        self._dir_mtimes = {}
+        for root, dirs, files in os.walk(self._abs_root):
+            self._dir_mtimes[root] = os.stat(root).st_mtime_ns
+            directory = os.path.basename(root)
+            relative_root = os.path.relpath(root, self._abs_root)
+            for f in files:
+                parsed = self.parse_name(f)
+                if parsed is None:
+                    continue
+                subject, suffix, extension = parsed
+                relative_path = os.path.normpath(os.path.join(relative_root, f))
+                self._entries.append(BIDSEntry(relative_path, subject, suffix, directory, extension))
+        self._build_tables()
+
+    def _build_tables(self):
+        self._tables = {field: {} for field in BIDSEntry._fields if field != 'path'}
+        for entry_index, entry in enumerate(self._entries):
+            for field, table in self._tables.items():
+                table.setdefault(getattr(entry, field), []).append(entry_index)
+
+    def is_stale(self):
+        """
+        Checks whether any directory of the dataset was modified since the index was built.
+
+        Returns:
+            bool: True if the index needs to be rebuilt
+        """
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def refresh(self):
+        """
+        Rescans the dataset if it changed since the index was built.
+
+        Returns:
+            bool: True if the dataset was rescanned
+        """
+        if not self.is_stale():
+            return False
+        self._scan()
+        self._save_cache()
+        return True
+
+    def find(self, suffix=None, subject=None, directory=None, extension=None):
+        """
+        Finds the files matching all the given entities.
+
+        Parameters:
+            suffix (str): Suffix of the dataset, e.g. mese (case insensitive)
+            subject (str): Subject name
+            directory (str): Directory, e.g. anat or quant
+            extension (str): '.nii.gz' or '.nii'
+
+        Returns:
+            list: Paths of the matching files, in file system walk order
+        """
+        query = {'suffix': suffix.lower() if suffix is not None else None,
+                 'subject': subject,
+                 'directory': directory,
+                 'extension': extension}
+        query = {field: value for field, value in query.items() if value is not None}
+        if not query:
+            return [os.path.join(self.root, entry.path) for entry in self._entries]
+
+        # start from the shortest candidate list and filter it with the remaining entities
+        candidate_lists = [self._tables[field].get(value, []) for field, value in query.items()]
+        candidates = min(candidate_lists, key=len)
+        return [os.path.join(self.root, self._entries[i].path) for i in candidates
+                if all(getattr(self._entries[i], field) == value for field, value in query.items())]
+
+    def find_converter(self, converter_class, extension=None):
+        """
+        Finds the files written by a converter.
+
+        Parameters:
+            converter_class (type): A Converter class
+            extension (str): '.nii.gz' or '.nii'
+
+        Returns:
+            list: Paths of the matching files
+        """
+        return self.find(suffix=converter_suffix(converter_class), extension=extension)
+
+    def subjects(self):
+        """ Returns the sorted list of the subjects in the dataset """
+        return sorted(self._tables['subject'])
+
+    def suffixes_found(self):
+        """ Returns the sorted list of the suffixes in the dataset """
+        return sorted(self._tables['suffix'])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load_cache(self):
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cache.get('version') != _CACHE_VERSION or cache.get('root') != self._abs_root \
+                or cache.get('suffixes') != self.suffixes:
+            return False
+        self._dir_mtimes = cache['dir_mtimes']
+        if self.is_stale():
+            return False
+        self._entries = [BIDSEntry(*entry) for entry in cache['entries']]
+        self._build_tables()
+        return True
+
+    def _save_cache(self):
+        if not self.cache_file:
+            return
+        # create the file first: this modifies the mtime of its directory, which must be recorded afterwards
+        if not os.path.isfile(self.cache_file):
+            open(self.cache_file, 'w').close()
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        if cache_dir in self._dir_mtimes:
+            self._dir_mtimes[cache_dir] = os.stat(cache_dir).st_mtime_ns
+        cache = {'version': _CACHE_VERSION,
+                 'root': self._abs_root,
+                 'suffixes': self.suffixes,
+                 'dir_mtimes': self._dir_mtimes,
+                 'entries': [list(entry) for entry in self._entries]}
+        with open(self.cache_file, 'w') as f:
+            json.dump(cache, f)
+
+
+_index_cache = {}
+
+
+def get_index(path):
+    """
+    Returns the index of a dataset, reusing the one built by a previous call if the dataset did not change.
+
+    Parameters:
+        path (str): Root folder of the dataset
+
+    Returns:
+        BIDSIndex: the index
+    """
+    index = _index_cache.get(path)
+    if index is None:
+        index = BIDSIndex(path)
+        _index_cache[path] = index
+    else:
+        index.refresh()
+    return index
@@ -0,0 +1,171 @@
+import json
+import os
+
+import numpy as np
+
+from ..dosma_io import ChunkedArray, MedicalVolume, env
+from .headers import copy_headers, reduce
+
+CONTAINER_FORMAT = 'muscle-bids-container'
+CONTAINER_VERSION = 1
+CONTAINER_EXTENSION = '.h5'
+
+_HEADER_ATTRIBUTES = ['bids_header', 'patient_header', 'extra_header', 'meta_header']
+
+
+def _import_h5py():
+    """ h5py is optional: it is imported by the functions that need it, so that importing this module is cheap """
+    if not env.package_available("h5py"):
+        raise ImportError("h5py is required for containers")
+    import h5py
+    return h5py
+
+
+def _chunk_shape(shape):
+    """ One 2D slice per chunk, so that a slice or an echo is read without decompressing the rest """
+    if len(shape) < 3:
+        return None
+    return tuple(shape[:2]) + (1,) * (len(shape) - 2)
+
+
+def save_container(container_file, volumes, compression='gzip', compression_opts=4):
+    """
+    Saves medical volumes with their BIDS headers in a single HDF5 container file.
+
+    Every volume is stored in a group named after its key, e.g. ``anat/sub01_mese``, with the data as a chunked,
+    compressed dataset (one chunk per 2D slice), the affine as an attribute and each header as a json attribute.
+    Volumes already in the container with the same key are replaced (note that HDF5 does not reclaim the space
+    of replaced datasets).
+
+    Parameters:
+        container_file (str): Path to the container file. It is created if needed
+        volumes (dict): Volumes to store, by key
+        compression (str): HDF5 compression filter, or None
+        compression_opts (int): Options of the compression filter (the gzip level)
+    """
+    h5py = _import_h5py()
+    container_dir = os.path.dirname(container_file)
+    if container_dir:
+        os.makedirs(container_dir, exist_ok=True)
+
+    with h5py.File(container_file, 'a') as f:
+        f.attrs['format'] = CONTAINER_FORMAT
+        f.attrs['version'] = CONTAINER_VERSION
+        for key, medical_volume in volumes.items():
+            if key in f:
+                del f[key]
+            group = f.create_group(key)
+            volume = medical_volume.volume
+            dataset = group.create_dataset('volume', shape=volume.shape, dtype=volume.dtype,
+                                           chunks=_chunk_shape(volume.shape),
+                                           compression=compression if volume.ndim >= 3 else None,
+                                           compression_opts=compression_opts if compression and volume.ndim >= 3
+                                           else None,
+                                           shuffle=bool(compression) and volume.ndim >= 3)
+            if isinstance(volume, ChunkedArray):
+                for block_slice, block in volume.iter_blocks():
+                    dataset[block_slice] = block
+            else:
+                dataset[...] = np.asarray(volume)
+            group.attrs['affine'] = medical_volume.affine
+            for header in _HEADER_ATTRIBUTES:
+                group.attrs[header] = json.dumps(getattr(medical_volume, header, None) or {})
+
+
+def list_container(container_file):
+    """
+    Lists the volumes stored in a container.
+
+    Parameters:
+        container_file (str): Path to the container file
+
+    Returns:
+        list: the keys of the volumes, in storage order
+    """
+    h5py = _import_h5py()
+    keys = []
+
+    def _visit(name, item):
+        if isinstance(item, h5py.Group) and 'volume' in item:
+            keys.append(name)
+
+    with h5py.File(container_file, 'r') as f:
+        f.visititems(_visit)
+    return keys
+
+
+def load_container(container_file, key, echo=None, slices=None, lazy=False):
+    """
+    Loads a volume from a container. Only the requested echo and slices are read and decompressed.
+
+    Parameters:
+        container_file (str): Path to the container file
+        key (str): Key of the volume, as listed by list_container
+        echo (int): Index along the fourth dimension to load. The result is 3D, with headers reduced as by
+            headers.reduce
+        slices (int or slice): Slices (third dimension) to load. The headers are the ones of the whole volume
+        lazy (bool): If True and no echo or slices are requested, the volume is backed by a ChunkedArray and read
+            on demand
+
+    Returns:
+        MedicalVolume: the volume with the BIDS headers
+
+    Raises:
+        KeyError: if the container has no volume with this key
+    """
+    h5py = _import_h5py()
+    with h5py.File(container_file, 'r') as f:
+        if key not in f or 'volume' not in f[key]:
+            raise KeyError(f'No volume {key} in {container_file}')
+        attributes = dict(f[key].attrs)
+
+    stored_volume = MedicalVolume(ChunkedArray(container_file, f'{key}/volume'), attributes['affine'])
+    for header in _HEADER_ATTRIBUTES:
+        setattr(stored_volume, header, json.loads(attributes.get(header, '{}')))
+
+    if echo is None and slices is None:
+        if lazy:
+            return stored_volume
+        medical_volume = MedicalVolume(np.asarray(stored_volume.volume), stored_volume.affine)
+        copy_headers(stored_volume, medical_volume)
+        return medical_volume
+
+    if isinstance(slices, int):
+        slices = slice(slices, slices + 1)
+    region = (slice(None), slice(None), slices if slices is not None else slice(None))
+    if echo is not None:
+        region += (slice(echo, echo + 1),)
+    # slicing the MedicalVolume reads the region only and updates the affine
+    medical_volume = stored_volume[region]
+    copy_headers(stored_volume, medical_volume)
+
+    if echo is not None:
+        fourth_dimension_tag = medical_volume.bids_header['FourthDimension']
+        medical_volume.bids_header[fourth_dimension_tag] = [medical_volume.bids_header[fourth_dimension_tag][echo]]
+        medical_volume = reduce(medical_volume, 0)
+    return medical_volume
+
+
+def pack_bids_container(bids_root, container_file, subject=None, workers=4, **kwargs):
+    """
+    Stores the NIfTI datasets of a BIDS folder in a container. The keys are the file paths relative to the root,
+    without extension, e.g. ``anat/sub01_mese`` or ``quant/sub01_t2``.
+
+    Parameters:
+        bids_root (str): Root folder of the BIDS dataset
+        container_file (str): Path to the container file
+        subject (str): Only pack the datasets of this subject
+        workers (int): Number of threads loading the datasets
+        **kwargs: passed to save_container
+
+    Returns:
+        list: the keys of the stored volumes
+    """
+    from .bids_index import BIDSIndex, _split_extension
+    from .io import load_bids_many
+
+    paths = BIDSIndex(bids_root).find(subject=subject)
+    keys = [_split_extension(os.path.relpath(path, bids_root))[0].replace(os.sep, '/') for path in paths]
+    for key, medical_volume in zip(keys, load_bids_many(paths, workers=workers)):
+        save_container(container_file, {key: medical_volume}, **kwargs)
+    return keys
@@ -1,13 +1,16 @@
 import copy
+import functools
 import itertools
 import operator
 from collections import OrderedDict
 
 import numpy as np
 import pydicom.dataset
+from pydicom.tag import BaseTag
 from pydicom.uid import generate_uid
 
 from ..config.tag_definitions import defined_tags, patient_tags
+from ..dosma_io import instrumentation
 from ..dosma_io.med_volume import MedicalVolume
 
 from itertools import groupby
@@ -121,6 +124,7 @@ def copy_volume_with_bids_headers(medical_volume):
     return new_volume
 
 
+@instrumentation.profiled()
 def headers_to_dicts(header_list):
     """
     this function takes a list of DICOM headers and converts them into a meta and a header dictionary
@@ -136,13 +140,29 @@ def headers_to_dicts(header_list):
     if type(header_list) != list:
         header_list = header_list.squeeze().tolist()
 
-    json_header_list = []
-    for h in header_list:
-        meta_header = h.file_meta.to_json_dict()
-        meta_header['is_little_endian'] = h.is_little_endian
-        meta_header['is_implicit_VR'] = h.is_implicit_VR
-        json_header_list.append({'meta': meta_header, 'header': h.to_json_dict()})
+    json_header_list = [{'meta': _file_meta_to_json_dict(h), 'header': h.to_json_dict()} for h in header_list]
+    return _compress_json_headers(json_header_list)
 
+
+def _file_meta_to_json_dict(header):
+    """ Converts the file meta information of a DICOM header to a json dictionary, with the transfer syntax flags """
+    meta_header = header.file_meta.to_json_dict()
+    meta_header['is_little_endian'] = header.is_little_endian
+    meta_header['is_implicit_VR'] = header.is_implicit_VR
+    return meta_header
+
+
+def _compress_json_headers(json_header_list):
+    """
+    Compresses a list of json headers, one per slice, so that the tags that are common to all slices are kept
+    only once.
+
+    Parameters:
+        json_header_list (list): list of dictionaries with the 'meta' and 'header' json dictionaries of each slice
+
+    Returns:
+        (dict, dict): the meta and the header dictionaries
+    """
     # compress json header list
     compressed_meta = {}
     compressed_header = {}
@@ -179,6 +199,7 @@ def headers_to_dicts(header_list):
     return compressed_meta, compressed_header
 
 
+@instrumentation.profiled()
 def dicts_to_headers(n_slices, compressed_header, compressed_meta = None):
     """
     Reverts the headers_to_dicts function and creates a list of DICOM headers from the compressed dictionaries.
@@ -191,6 +212,7 @@ def dicts_to_headers(n_slices, compressed_header, compressed_meta = None):
     Returns:
         (list): the list of DICOM headers
     """
+    instrumentation.add_counters(slices=n_slices)
     if not compressed_meta:
         compressed_meta = None # catch the case of an empty dictionary meta
 
@@ -298,7 +320,13 @@ def separate_headers(raw_header_dict):
     bids_dict = {}
     process_dict(bids_dict, defined_tags)
 
-    # in-plane phase encoding direction - recommended by BIDS
+    _set_phase_encoding_direction(bids_dict, raw_header_dict)
+
+    return bids_dict, patient_dict, raw_header_dict
+
+
+def _set_phase_encoding_direction(bids_dict, raw_header_dict):
+    """ Sets the in-plane phase encoding direction, recommended by BIDS, from the raw header """
     # TODO: fix correct polarity
     pe_element = raw_header_dict['00181312']
     value_tag = _get_value_tag(pe_element)
@@ -309,9 +337,6 @@ def separate_headers(raw_header_dict):
         bids_dict['PhaseEncodingDirection'] = 'i'
 
 
-    return bids_dict, patient_dict, raw_header_dict
-
-
 def remerge_headers(bids_dict, patient_dict, raw_header_dict):
     """
     Re-merge the three dictionaries into one header dictionary.
@@ -349,49 +374,188 @@ def remerge_headers(bids_dict, patient_dict, raw_header_dict):
     return raw_header_dict
 
 
-def slice_volume_3d(medical_volume, slices_list):
+# tags outside of the defined and patient tags that are used by the converters and separate_headers
+CONVERTER_TAGS = [
+    '00080008',  # ImageType
+    '00180091',  # EchoTrainLength
+    '00089208',  # ComplexImageComponent
+    '00181312',  # InPlanePhaseEncodingDirection
+]
+
+# key of the meta header marking a volume whose extra header only contains the tags of an extraction plan
+PARTIAL_HEADER_KEY = 'partial_extra_header'
+
+
+class TagExtractionPlan:
     """
-    This function extracts slices specified from the slices_list from the medical volume.
+    Extracts the BIDS, patient and extra headers of a volume from a fixed set of tags.
+
+    The tags of the tag definitions are resolved once, when the plan is created: their numeric DICOM tags,
+    json keys, names and translators. Extracting the headers of a volume then only serializes these elements,
+    instead of every element of every slice as headers_to_dicts does. The BIDS and patient headers are the
+    same as the ones of dicom_volume_to_bids; the extra header only contains the extra tags, and the meta
+    header is marked with PARTIAL_HEADER_KEY, so the volume cannot be saved as DICOM from these headers alone.
+
+    Parameters:
+        bids_tags (TagDefinitionDict): the tags of the BIDS header
+        patient_tags (TagDefinitionDict): the tags of the patient header
+        extra_tags (list): other tags kept in the extra header, as 8 digit hexadecimal strings
+    """
+
+    def __init__(self, bids_tags=defined_tags, patient_tags=patient_tags, extra_tags=CONVERTER_TAGS):
+        # (json key, tag, named key, translator) of the tags of each header, in the order of separate_headers
+        self.patient_entries = self._compile(patient_tags)
+        self.bids_entries = self._compile(bids_tags)
+        named_keys = {entry[0] for entry in self.patient_entries + self.bids_entries}
+        self.extra_entries = [(key.upper(), BaseTag(int(key, 16)), None, None)
+                              for key in extra_tags if key.upper() not in named_keys]
+        self._entries = self.patient_entries + self.bids_entries + self.extra_entries
+
+    @staticmethod
+    def _compile(tag_dict):
+        return [(numerical_key.upper(), BaseTag(int(numerical_key, 16)), named_key, tag_dict.get_translator(numerical_key))
+                for numerical_key, named_key in tag_dict.items()]
+
+    @property
+    def reading_tags(self):
+        """ list: the DICOM tags to read, e.g. as specific_tags of DicomReader """
+        return [entry[1] for entry in self._entries]
+
+    @instrumentation.profiled('TagExtractionPlan.extract')
+    def extract(self, header_list):
+        """
+        Extracts the headers from a list of DICOM headers.
+
+        Parameters:
+            header_list (list): list of DICOM headers
+
+        Returns:
+            (dict, dict, dict, dict): the meta, BIDS, patient and extra header dictionaries
+        """
+        if type(header_list) != list:
+            header_list = header_list.squeeze().tolist()
+
+        json_header_list = []
+        for h in header_list:
+            json_header = {}
+            for json_key, tag, _, _ in self._entries:
+                if tag in h:
+                    json_header[json_key] = h[tag].to_json_dict(None, 1024)
+            json_header_list.append({'meta': _file_meta_to_json_dict(h), 'header': json_header})
+        compressed_meta, raw_header_dict = _compress_json_headers(json_header_list)
+
+        def process_entries(output_dict, entries):
+            for json_key, _, named_key, translator in entries:
+                try:
+                    original_content = raw_header_dict[json_key]
+                except KeyError:
+                    continue
+                value_tag = _get_value_tag(original_content)
+                try:
+                    if 'isList' in original_content:
+                        output_dict[named_key] = list(map(translator, original_content[value_tag]))
+                    else:
+                        output_dict[named_key] = translator(original_content[value_tag])
+                    original_content[value_tag] = ''
+                except KeyError:
+                    pass # key has no value
+
+        patient_dict = {}
+        process_entries(patient_dict, self.patient_entries)
+        bids_dict = {}
+        process_entries(bids_dict, self.bids_entries)
+        _set_phase_encoding_direction(bids_dict, raw_header_dict)
+
+        compressed_meta[PARTIAL_HEADER_KEY] = True
+        return compressed_meta, bids_dict, patient_dict, raw_header_dict
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_extraction_plan():
+    """ Returns the extraction plan of the defined, patient and converter tags, created once """
+    return TagExtractionPlan()
+
+
+def _indices_to_slice(indices):
+    """ Converts a list of regularly spaced increasing indices to a slice, so that indexing returns a view """
+    if len(indices) == 0:
+        return indices
+    if len(indices) == 1:
+        return slice(indices[0], indices[0] + 1)
+    step = indices[1] - indices[0]
+    if step <= 0 or any(b - a != step for a, b in zip(indices[:-1], indices[1:])):
+        return indices
+    return slice(indices[0], indices[-1] + 1, step)
+
+
+@instrumentation.profiled()
+def split_volume_3d(medical_volume, slices_lists, copy_data=False):
+    """
+    This function extracts several volumes from the medical volume, one for each list of slices.
+    The headers are remerged only once for all the outputs. Regularly spaced slices (e.g. every fourth slice of an
+    interleaved acquisition) are extracted as views of the original data unless copy_data is True.
 
     Parameters:
         medical_volume (MedicalVolume): the medical volume
-        slices_list (list): the list of slices to extract
+        slices_lists (list): the lists of slices to extract
+        copy_data (bool): always copy the pixel data
 
     Returns:
-        MedicalVolume: the extracted volume
+        list: the extracted volumes (MedicalVolume), in the order of slices_lists
     """
 
     n_dim = medical_volume.volume.ndim
     assert n_dim == 3, "Only 3D volumes are supported"
-    new_volume = np.copy(medical_volume.volume[:,:,slices_list])
 
     headers = remerge_headers(medical_volume.bids_header, medical_volume.patient_header, medical_volume.extra_header)
-    new_headers = {}
-    for key, value in headers.items():
-        if 'isList' in value: # value is a list
-            new_value = copy.deepcopy(value)
-            value_tag = _get_value_tag(value)
-            new_value_list = []
-            for sl in slices_list:
-                new_value_list.append(value[value_tag][sl])
-            if _list_all_equal(new_value_list):
-                new_value[value_tag] = new_value_list[0]
-                del new_value['isList']
+    output_volumes = []
+    for slices_list in slices_lists:
+        new_volume = medical_volume.volume[:, :, _indices_to_slice(slices_list)]
+        if copy_data and np.shares_memory(new_volume, medical_volume.volume):
+            new_volume = np.copy(new_volume)
+
+        new_headers = {}
+        for key, value in headers.items():
+            if 'isList' in value: # value is a list
+                value_tag = _get_value_tag(value)
+                new_value_list = [value[value_tag][sl] for sl in slices_list]
+                # copy the element without its full value list, which can be long
+                new_value = {k: (None if k == value_tag else copy.deepcopy(v)) for k, v in value.items()}
+                if _list_all_equal(new_value_list):
+                    new_value[value_tag] = copy.deepcopy(new_value_list[0])
+                    del new_value['isList']
+                else:
+                    new_value[value_tag] = copy.deepcopy(new_value_list)
+
             else:
-                new_value[value_tag] = new_value_list
+                new_value = copy.deepcopy(value)
+            new_headers[key] = new_value
+        new_bids, new_patient, new_raw = separate_headers(new_headers)
+        new_volume = MedicalVolume(new_volume, medical_volume.affine)
+        setattr(new_volume, 'bids_header', new_bids)
+        setattr(new_volume, 'patient_header', new_patient)
+        setattr(new_volume, 'extra_header', new_raw)
+        setattr(new_volume, 'meta_header', getattr(medical_volume, 'meta_header'))
+        output_volumes.append(new_volume)
+    return output_volumes
+
+
+@instrumentation.profiled()
+def slice_volume_3d(medical_volume, slices_list):
+    """
+    This function extracts slices specified from the slices_list from the medical volume.
 
-        else:
-            new_value = copy.deepcopy(value)
-        new_headers[key] = new_value
-    new_bids, new_patient, new_raw = separate_headers(new_headers)
-    new_volume = MedicalVolume(new_volume, medical_volume.affine)
-    setattr(new_volume, 'bids_header', new_bids)
-    setattr(new_volume, 'patient_header', new_patient)
-    setattr(new_volume, 'extra_header', new_raw)
-    setattr(new_volume, 'meta_header', getattr(medical_volume, 'meta_header'))
-    return new_volume
+    Parameters:
+        medical_volume (MedicalVolume): the medical volume
+        slices_list (list): the list of slices to extract
+
+    Returns:
+        MedicalVolume: the extracted volume
+    """
+    return split_volume_3d(medical_volume, [slices_list], copy_data=True)[0]
 
 
+@instrumentation.profiled()
 def concatenate_volumes_3d(volumes_list):
     """ this function concatenates a list of 3d volumes into one volume
 
@@ -459,6 +623,7 @@ def concatenate_volumes_3d(volumes_list):
     return new_volume
 
 
+@instrumentation.profiled()
 def group(medical_volume, key):
     """
         Converts a 3D medical volume to a 4D one by grouping the slices according to the key.
@@ -530,6 +695,7 @@ def group(medical_volume, key):
     return medical_volume_out
 
 
+@instrumentation.profiled()
 def ungroup(medical_volume):
     """
     Converts a 4D medical volume to a 3D one by ungrouping the slices.
@@ -588,19 +754,24 @@ def ungroup(medical_volume):
     return medical_volume_out
 
 
-def dicom_volume_to_bids(medical_volume):
+@instrumentation.profiled()
+def dicom_volume_to_bids(medical_volume, extraction_plan=None):
     """
     Converts a medical volume to a BIDS medical volume by creating and attaching the appropriate BIDS headers.
     Args:
         medical_volume (MedicalVolume): the medical volume to convert
+        extraction_plan (TagExtractionPlan): if given, only the tags of the plan are extracted. The full extra
+            header is then computed from the DICOM headers when the volume is converted back to DICOM
 
     Returns:
         MedicalVolume: the BIDS medical volume
     """
 
-
-    compressed_meta_header, compressed_header = headers_to_dicts(medical_volume.headers())
-    bids_dict, patient_dict, raw_header_dict = separate_headers(compressed_header)
+    if extraction_plan is not None:
+        compressed_meta_header, bids_dict, patient_dict, raw_header_dict = extraction_plan.extract(medical_volume.headers())
+    else:
+        compressed_meta_header, compressed_header = headers_to_dicts(medical_volume.headers())
+        bids_dict, patient_dict, raw_header_dict = separate_headers(compressed_header)
     setattr(medical_volume, 'meta_header', compressed_meta_header)
     setattr(medical_volume, 'bids_header', bids_dict)
     setattr(medical_volume, 'patient_header', patient_dict)
@@ -608,6 +779,22 @@ def dicom_volume_to_bids(medical_volume):
     return medical_volume
 
 
+def _complete_extra_header(medical_volume):
+    """
+    Replaces the partial meta and extra headers of a volume converted with an extraction plan with the full ones,
+    computed from its DICOM headers. The BIDS and patient headers are kept.
+    """
+    dicom_headers = medical_volume.headers()
+    if dicom_headers is None:
+        raise ValueError('The volume only has the headers of a tag extraction plan and no DICOM headers: '
+                         'it cannot be saved as DICOM. Load it without an extraction plan.')
+    compressed_meta_header, compressed_header = headers_to_dicts(dicom_headers)
+    _, _, raw_header_dict = separate_headers(compressed_header)
+    setattr(medical_volume, 'meta_header', compressed_meta_header)
+    setattr(medical_volume, 'extra_header', raw_header_dict)
+
+
+@instrumentation.profiled()
 def bids_volume_to_dicom(medical_volume, new_series=False):
     """
     Converts a BIDS medical volume to a medical volume by creating and attaching the appropriate DICOM headers.
@@ -619,6 +806,9 @@ def bids_volume_to_dicom(medical_volume, new_series=False):
     Returns:
         MedicalVolume: the medical volume that can be saved as DICOM
     """
+    if (getattr(medical_volume, 'meta_header', None) or {}).get(PARTIAL_HEADER_KEY):
+        _complete_extra_header(medical_volume)
+
     if 'FourthDimension' in medical_volume.bids_header:
         medical_volume = ungroup(medical_volume)
 
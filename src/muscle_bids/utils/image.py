@@ -1,61 +1,368 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from ..dosma_io import MedicalVolume
+from .headers import copy_headers
 import numpy as np
-from scipy.ndimage import map_coordinates
+from scipy.ndimage import map_coordinates, spline_filter, affine_transform
 
+# number of target voxels whose source coordinates are generated at once
+DEFAULT_SLAB_VOXELS = 1 << 20
 
-def realign_medical_volume(source: MedicalVolume, destination: MedicalVolume, interpolation_order: int = 3):
-    """Realign this volume to the image space of another volume. Similar to ``reformat_as``,
-    except that it supports fine rotations, translations and shape changes, so that the affine
-    matrix and extent of the modified volume is identical to the one of the target.
+# maximum memory used by the cached resampling plans
+DEFAULT_PLAN_CACHE_BYTES = 256 << 20
+
+# maximum number of cached resampling plans, which also bounds the plans without coordinates
+DEFAULT_PLAN_CACHE_ENTRIES = 64
+
+# tolerance used to recognize zero, unit and integer entries of the transform (in voxels)
+_TRANSFORM_TOLERANCE = 1e-4
 
+TRANSFORM_PERMUTATION = 'permutation'
+TRANSFORM_AXIS_ALIGNED = 'axis_aligned'
+TRANSFORM_OBLIQUE = 'oblique'
+
+
+def classify_transform(aff_transf):
+    """
+    Classifies an affine transform mapping target voxel indices to source voxel indices.
 
     Args:
-        source (MedicalVolume): The volume to realign
-        destination (MedicalVolume): The realigned volume will have the same extent and affine matrix of ``destination``.
+        aff_transf (np.ndarray): 4x4 affine matrix
+
+    Returns:
+        tuple: (kind, source_axes, scales, offsets). ``kind`` is ``TRANSFORM_PERMUTATION`` when every target
+            axis maps to a source axis with a scale of +/-1 and an integer offset, ``TRANSFORM_AXIS_ALIGNED`` for
+            any other scale or offset along the axes, and ``TRANSFORM_OBLIQUE`` otherwise (the other values are
+            then None). ``source_axes[d]`` is the source axis of the target axis d, and the source index along it
+            is ``scales[d] * target_index + offsets[d]``.
+    """
+    matrix = aff_transf[:3, :3]
+    nonzero = np.abs(matrix) > _TRANSFORM_TOLERANCE
+    if not (np.all(nonzero.sum(axis=0) == 1) and np.all(nonzero.sum(axis=1) == 1)):
+        return TRANSFORM_OBLIQUE, None, None, None
+
+    source_axes = [int(np.argmax(nonzero[:, d])) for d in range(3)]
+    scales = np.array([matrix[source_axes[d], d] for d in range(3)])
+    offsets = np.array([aff_transf[source_axes[d], 3] for d in range(3)])
+
+    if np.allclose(np.abs(scales), 1, atol=_TRANSFORM_TOLERANCE) and \
+            np.allclose(offsets, np.round(offsets), atol=_TRANSFORM_TOLERANCE):
+        return TRANSFORM_PERMUTATION, source_axes, np.sign(scales).astype(int), np.round(offsets).astype(int)
+    return TRANSFORM_AXIS_ALIGNED, source_axes, scales, offsets
+
+
+def _realign_permutation(source_data, target_shape, source_axes, signs, offsets):
+    """
+    Realigns with a permutation, flips and an integer shift: the result is a view of the source when the
+    target grid lies inside it, and a zero-padded copy of the overlapping part otherwise. Axes after the
+    third one (frames) are kept as they are.
+    """
+    frame_shape = source_data.shape[3:]
+    data = source_data.transpose(list(source_axes) + list(range(3, source_data.ndim)))
+    output_shape = tuple(target_shape[:3]) + frame_shape
+    target_slices = []
+    source_slices = []
+    for d in range(3):
+        n_source = data.shape[d]
+        # target indices whose source index sign * i + offset lies in [0, n_source)
+        if signs[d] > 0:
+            first, last = -offsets[d], n_source - 1 - offsets[d]
+        else:
+            first, last = offsets[d] - n_source + 1, offsets[d]
+        first, last = max(first, 0), min(last, target_shape[d] - 1)
+        if last < first:
+            return np.zeros(output_shape, dtype=source_data.dtype)
+        source_first = signs[d] * first + offsets[d]
+        source_last = signs[d] * last + offsets[d]
+        if signs[d] > 0:
+            source_slices.append(slice(source_first, source_last + 1))
+        else:
+            source_slices.append(slice(source_first, source_last - 1 if source_last > 0 else None, -1))
+        target_slices.append(slice(first, last + 1))
+
+    overlap = data[tuple(source_slices)]
+    if overlap.shape == output_shape:
+        return overlap
+    output = np.zeros(output_shape, dtype=source_data.dtype)
+    output[tuple(target_slices)] = overlap
+    return output
+
+
+def _map_frames(frame_function, n_frames, workers):
+    """ Calls frame_function(frame) for every frame, in a thread pool if workers > 1 """
+    if workers > 1 and n_frames > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, n_frames)) as executor:
+            list(executor.map(frame_function, range(n_frames)))
+    else:
+        for frame in range(n_frames):
+            frame_function(frame)
+
+
+def _slab_coordinates(aff_transf, start, stop, target_shape, z_offset=0):
+    """
+    Computes the source coordinates of the target voxels [start:stop, :, :] in float32.
+
+    Returns:
+        np.ndarray: coordinates of shape [3, stop - start, y, z]
+    """
+    ranges = (np.arange(start, stop, dtype=np.float32),
+              np.arange(target_shape[1], dtype=np.float32),
+              np.arange(target_shape[2], dtype=np.float32) + np.float32(z_offset))
+    matrix = aff_transf.astype(np.float32)
+
+    coords = np.empty((3, stop - start) + tuple(target_shape[1:3]), dtype=np.float32)
+    for dim in range(3):
+        # separable evaluation of the affine: no meshgrid and no homogeneous coordinate are needed
+        coords[dim] = matrix[dim, 3]
+        coords[dim] += (matrix[dim, 0] * ranges[0])[:, None, None]
+        coords[dim] += (matrix[dim, 1] * ranges[1])[None, :, None]
+        coords[dim] += (matrix[dim, 2] * ranges[2])[None, None, :]
+    return coords
+
+
+class ResamplingPlan:
+    """
+    Geometry of a realignment from a source grid to a destination grid, computed once and applicable to any
+    data on the source grid. Depending on the transform, the plan holds the slices of a permutation, the
+    per-axis scales and offsets of an axis-aligned resampling, or the float32 source coordinates of every
+    slab of the target grid for an oblique one.
+
+    Args:
+        source_shape (tuple): shape of the source grid (only the first three dimensions are used)
+        source_affine (np.ndarray): 4x4 affine of the source
+        destination_shape (tuple): shape of the destination grid (only the first three dimensions are used)
+        destination_affine (np.ndarray): 4x4 affine of the destination
+        interpolation_order (int, optional): spline interpolation order.
+        slab_voxels (int, optional): approximate number of target voxels per slab.
+    """
+
+    def __init__(self, source_shape, source_affine, destination_shape, destination_affine,
+                 interpolation_order=3, slab_voxels=DEFAULT_SLAB_VOXELS):
+        self.source_shape = tuple(source_shape[:3])
+        self.target_shape = tuple(destination_shape[:3])
+        self.interpolation_order = interpolation_order
+
+        # disregard our own slice thickness for the moment
+        # calculate the difference from the center of each 3D "partition" and the real center of the 2D slice
+        z_offset = 0
+
+        # The following would be need to be used if the origin of the affine matrix was calculated on the middle of the
+        # slice with thickness == slice spacing. But centering the converted dataset on the real center of the slice
+        # seems to be the norm, hence the z_offset is 0
+        # z_offset = (other_thickness/other.pixel_spacing[2]/2 - 1/2) #(other_thickness - other.pixel_spacing[2])/2
+
+        # build affine which maps from target grid to source grid
+        aff_transf = np.linalg.inv(source_affine) @ destination_affine
+
+        self.kind, self.source_axes, self.scales, self.offsets = classify_transform(aff_transf)
+
+        self.slabs = []
+        self.coordinates = []
+        if self.kind == TRANSFORM_OBLIQUE:
+            slab_thickness = max(1, slab_voxels // max(1, self.target_shape[1] * self.target_shape[2]))
+            self.slabs = [(start, min(start + slab_thickness, self.target_shape[0]))
+                          for start in range(0, self.target_shape[0], slab_thickness)]
+            self.coordinates = [_slab_coordinates(aff_transf, start, stop, self.target_shape, z_offset)
+                                for start, stop in self.slabs]
+
+    @property
+    def nbytes(self):
+        """int: memory used by the precomputed coordinates"""
+        return sum(coords.nbytes for coords in self.coordinates)
+
+    def apply(self, source_data, workers=None):
+        """
+        Resamples data defined on the source grid. Dimensions after the third one are treated as frames.
+
+        Args:
+            source_data (np.ndarray): data of shape ``source_shape + frame_shape``
+            workers (int, optional): number of threads. Defaults to the number of cores.
+
+        Returns:
+            np.ndarray: the resampled data of shape ``target_shape + frame_shape``, with the dtype of the source.
+                Permutations return a view of the source when possible.
+
+        Raises:
+            ValueError: if the data does not match the source grid of the plan
+        """
+        source_data = np.asarray(source_data)
+        if source_data.shape[:3] != self.source_shape:
+            raise ValueError(f'The data of shape {source_data.shape} does not match the source grid '
+                             f'{self.source_shape} of the resampling plan')
+        frame_shape = source_data.shape[3:]
+        n_frames = int(np.prod(frame_shape, dtype=int))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        order = self.interpolation_order
+
+        # cheap cases first: only oblique transforms need the full 3D interpolation
+        if self.kind == TRANSFORM_PERMUTATION:
+            return _realign_permutation(source_data, self.target_shape, self.source_axes, self.scales, self.offsets)
+
+        # frames of a 4D (or grouped) volume are stacked along a single last axis
+        source_frames = source_data.reshape(self.source_shape + (n_frames,))
+        output = np.empty(self.target_shape + frame_shape, dtype=source_data.dtype)
+        output_frames = output.reshape(self.target_shape + (n_frames,))
+
+        if self.kind == TRANSFORM_AXIS_ALIGNED:
+            def _realign_frame(frame):
+                affine_transform(source_frames[..., frame].transpose(self.source_axes), self.scales, self.offsets,
+                                 output=output_frames[..., frame], order=order, mode='constant')
+
+            _map_frames(_realign_frame, n_frames, workers)
+            return output
+
+        if order > 1:
+            # same prefilter as map_coordinates(mode='constant'), computed once per frame instead of once per slab
+            filtered = np.empty(source_frames.shape, dtype=np.float64)
+
+            def _prefilter_frame(frame):
+                spline_filter(source_frames[..., frame], order, output=filtered[..., frame], mode='constant')
+
+            _map_frames(_prefilter_frame, n_frames, workers)
+        else:
+            filtered = source_frames
+
+        # Each coordinate contains a place in the source image from which the intensity is taken
+        # and filled into the new image. If the coordinate is not within the range of the source image then
+        # will be filled with 0. The coordinates of a slab are used for all the frames.
+        def _realign_slab(slab_index):
+            start, stop = self.slabs[slab_index]
+            coords_src = self.coordinates[slab_index]
+            for frame in range(n_frames):
+                map_coordinates(filtered[..., frame], coords_src, output=output_frames[start:stop, ..., frame],
+                                order=order, prefilter=False)
+
+        _map_frames(_realign_slab, len(self.slabs), workers)
+        return output
+
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+_plan_cache_max_bytes = DEFAULT_PLAN_CACHE_BYTES
+_plan_cache_max_entries = DEFAULT_PLAN_CACHE_ENTRIES
+
+
+def _affine_key(affine):
+    return np.round(np.asarray(affine, dtype=np.float64), 6).tobytes()
+
+
+def get_resampling_plan(source_shape, source_affine, destination_shape, destination_affine,
+                        interpolation_order=3, slab_voxels=DEFAULT_SLAB_VOXELS):
+    """
+    Returns the resampling plan between two grids, reusing a cached one if the same geometry was seen before.
+    The least recently used plans are evicted when the cached coordinates exceed the cache size.
+
+    Args:
+        source_shape (tuple): shape of the source grid
+        source_affine (np.ndarray): 4x4 affine of the source
+        destination_shape (tuple): shape of the destination grid
+        destination_affine (np.ndarray): 4x4 affine of the destination
         interpolation_order (int, optional): spline interpolation order.
+        slab_voxels (int, optional): approximate number of target voxels per slab.
 
     Returns:
-        MedicalVolume: The realigned volume.
+        ResamplingPlan: the plan
     """
+    key = (tuple(source_shape[:3]), _affine_key(source_affine), tuple(destination_shape[:3]),
+           _affine_key(destination_affine), interpolation_order, slab_voxels)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
 
-    target = destination.volume
-    print("Alignment target shape:", target.shape)
+    plan = ResamplingPlan(source_shape, source_affine, destination_shape, destination_affine,
+                          interpolation_order, slab_voxels)
+    if _plan_cache_max_bytes > 0 and _plan_cache_max_entries > 0 and plan.nbytes <= _plan_cache_max_bytes:
+        with _plan_cache_lock:
+            _plan_cache[key] = plan
+            _evict_plans()
+    return plan
 
-    # disregard our own slice thickness for the moment
-    # calculate the difference from the center of each 3D "partition" and the real center of the 2D slice
-    z_offset = 0
 
-    # The following would be need to be used if the origin of the affine matrix was calculated on the middle of the
-    # slice with thickness == slice spacing. But centering the converted dataset on the real center of the slice
-    # seems to be the norm, hence the z_offset is 0
-    # z_offset = (other_thickness/other.pixel_spacing[2]/2 - 1/2) #(other_thickness - other.pixel_spacing[2])/2
+def _evict_plans():
+    total_bytes = sum(plan.nbytes for plan in _plan_cache.values())
+    while _plan_cache and (total_bytes > _plan_cache_max_bytes or len(_plan_cache) > _plan_cache_max_entries):
+        _, plan = _plan_cache.popitem(last=False)
+        total_bytes -= plan.nbytes
 
-    shape_as_range = (np.arange(target.shape[0]),
-                      np.arange(target.shape[1]),
-                      np.arange(target.shape[2]) + z_offset)
 
-    coords = np.array(np.meshgrid(*shape_as_range, indexing='ij')).astype(float)
+def set_plan_cache_size(max_bytes, max_entries=None):
+    """
+    Sets the maximum memory used by the cached resampling plans, and optionally their maximum number.
+    0 disables the cache.
 
-    # Add additional dimension with 1 to each coordinate to make work with 4x4 affine matrix
-    addon = np.ones([1, coords.shape[1], coords.shape[2], coords.shape[3]])
-    coords = np.concatenate([coords, addon], axis=0)  # shape: [4, x, y, z]
-    coords = coords.reshape([4, -1])  # shape: [4, x*y*z]
+    Args:
+        max_bytes (int): the size in bytes
+        max_entries (int, optional): the number of plans. Unchanged if None
+    """
+    global _plan_cache_max_bytes, _plan_cache_max_entries
+    with _plan_cache_lock:
+        _plan_cache_max_bytes = max_bytes
+        if max_entries is not None:
+            _plan_cache_max_entries = max_entries
+        _evict_plans()
 
-    # build affine which maps from target grid to source grid
-    aff_transf = np.linalg.inv(source.affine) @ destination.affine
 
-    # transform the coords from target grid to the space of source image
-    coords_src = aff_transf @ coords  # shape: [4, x*y*z]
+def clear_plan_cache():
+    """ Removes all the cached resampling plans """
+    with _plan_cache_lock:
+        _plan_cache.clear()
 
-    # reshape to original spatial dimensions
-    coords_src = coords_src.reshape((4,) + target.shape)[:3, ...]  # shape: [3, x, y, z]
 
-    # Will create a image with the spatial size of coords_src (with is target.shape). Each
-    # coordinate contains a place in the source image from which the intensity is taken
-    # and filled into the new image. If the coordinate is not within the range of the source image then
-    # will be filled with 0.
-    src_transf_data = map_coordinates(source.volume, coords_src, order=interpolation_order)
+def realign_medical_volume(source: MedicalVolume, destination: MedicalVolume, interpolation_order: int = 3,
+                           slab_voxels: int = DEFAULT_SLAB_VOXELS, workers: int = None,
+                           plan: ResamplingPlan = None):
+    """Realign this volume to the image space of another volume. Similar to ``reformat_as``,
+    except that it supports fine rotations, translations and shape changes, so that the affine
+    matrix and extent of the modified volume is identical to the one of the target.
+
+    The target grid is processed in slabs along the first axis: the source coordinates of a slab are
+    generated in float32 and interpolated directly into the preallocated output, so that the memory
+    overhead is bounded by the slab size instead of several times the target volume. The spline
+    prefilter of the source is computed once and shared by all slabs, which run in a thread pool.
+
+    Transforms that are a permutation/flip of the axes with an integer shift (e.g. series of the same
+    session) are done by slicing, without interpolation and without copy when possible. Scalings and
+    shifts along the axes are resampled separably per axis.
 
-    mv = MedicalVolume(src_transf_data, destination.affine, destination.headers())
+    4D (or grouped) volumes are realigned frame by frame on the first three axes, with the source
+    coordinates computed once per slab for all the frames. When the source has BIDS headers, they are
+    copied to the result; otherwise the DICOM headers of the destination are used.
 
-    return mv
\ No newline at end of file
+    The geometry is held by a ``ResamplingPlan``, which is cached: realigning other volumes between
+    the same grids skips the computation of the coordinates.
+
+    Args:
+        source (MedicalVolume): The volume to realign. Dimensions after the third one are kept.
+        destination (MedicalVolume): The realigned volume will have the same extent and affine matrix of ``destination``.
+        interpolation_order (int, optional): spline interpolation order.
+        slab_voxels (int, optional): approximate number of target voxels per slab.
+        workers (int, optional): number of threads. Defaults to the number of cores.
+        plan (ResamplingPlan, optional): precomputed plan. By default, it is taken from the cache.
+
+    Returns:
+        MedicalVolume: The realigned volume.
+    """
+    if plan is None:
+        plan = get_resampling_plan(source.shape, source.affine, destination.shape, destination.affine,
+                                   interpolation_order, slab_voxels)
+    output = plan.apply(source.volume, workers)
+    return _realigned_volume(output, source, destination)
+
+
+def _realigned_volume(output, source, destination):
+    """
+    Wraps the realigned data with the destination affine. The BIDS headers of the source are carried over when
+    present, otherwise the DICOM headers of the destination are used if they match the realigned shape.
+    """
+    if getattr(source, 'bids_header', None) is not None:
+        mv = MedicalVolume(output, destination.affine)
+        copy_headers(source, mv)
+        return mv
+    headers = destination.headers() if destination.shape == output.shape else None
+    return MedicalVolume(output, destination.affine, headers)
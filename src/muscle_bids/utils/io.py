@@ -1,19 +1,47 @@
 import json
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from ..dosma_io import DicomReader, DicomWriter, NiftiReader, NiftiWriter
-from ..utils import headers
+import numpy as np
+import pydicom
 
+from ..dosma_io import DicomReader, DicomWriter, NiftiReader, NiftiWriter, instrumentation
+from ..utils import headers, bids_index
 
-def load_dicom(path, group_by = None):
-    dicom_reader = DicomReader(num_workers=0, group_by='SeriesInstanceUID', ignore_ext=True)
+
+def load_dicom(path, group_by = None, extraction_plan = None):
+    """
+    Loads the first dicom series of a folder, or a list of files, with the BIDS headers.
+
+    Parameters:
+        path (str or list): Path to the folder, or list of files
+        group_by (str): If given, the slices are grouped into a 4D volume by this entry of the BIDS header
+        extraction_plan (headers.TagExtractionPlan): If given, only the tags of the plan are read from the files.
+            This is faster, but the volume only has the BIDS, patient and partial extra headers, and cannot be
+            saved as DICOM
+
+    Returns:
+        MedicalVolume: the dicom volume with the BIDS headers
+    """
+    specific_tags = extraction_plan.reading_tags if extraction_plan is not None else None
+    dicom_reader = DicomReader(num_workers=0, group_by='SeriesInstanceUID', ignore_ext=True, specific_tags=specific_tags)
     medical_volume = dicom_reader.load(path)[0]
-    new_volume = headers.dicom_volume_to_bids(medical_volume)
+    new_volume = headers.dicom_volume_to_bids(medical_volume, extraction_plan)
+    if extraction_plan is not None:
+        # the DICOM headers only hold the tags of the plan: drop them, so that they are never saved as DICOM
+        new_volume = headers.copy_volume_with_bids_headers(new_volume)
     if group_by is not None:
         new_volume = headers.group(new_volume, group_by)
     return new_volume
 
 
+def _load_dicom_series(file_list, extraction_plan=None):
+    """ Loads a series, reporting its profiling spans under the name of its first file """
+    with instrumentation.series(file_list[0]):
+        return load_dicom(file_list, extraction_plan=extraction_plan)
+
+
 def load_dicom_with_subfolders(path):
     """
     Loads all dicom files in a folder and its subfolders.
@@ -39,6 +67,79 @@ def load_dicom_with_subfolders(path):
     return [ headers.dicom_volume_to_bids(volume) for volume in med_volumes ]
 
 
+def find_dicom_series(path, recursive=False):
+    """
+    Finds the dicom series in a folder without loading the pixel data.
+    The series are returned in the order in which ``load_dicom`` (non recursive: only the first series)
+    and ``load_dicom_with_subfolders`` (recursive: every series of every folder) load them, so that each
+    file list can be loaded independently, e.g. in a separate process, with ``load_dicom(file_list)``.
+
+    Parameters:
+        path (str): Path to the root folder
+        recursive (bool): Also search the subfolders
+
+    Returns:
+        list: List of file lists, one per series
+    """
+    dicom_reader = DicomReader(num_workers=0, group_by='SeriesInstanceUID', ignore_ext=True)
+
+    def _find_series_in_folder(folder):
+        series = {}
+        for file in dicom_reader.get_files(folder, ignore_hidden=True):
+            try:
+                ds = pydicom.dcmread(file, stop_before_pixels=True, specific_tags=['SeriesInstanceUID'])
+            except pydicom.errors.InvalidDicomError:
+                continue
+            series.setdefault(ds.get('SeriesInstanceUID'), []).append(file)
+        return [series[uid] for uid in sorted(series)]
+
+    def _find_series_recursive(folder):
+        output_list = _find_series_in_folder(folder)
+        for file in os.listdir(folder):
+            d = os.path.join(folder, file)
+            if os.path.isdir(d):
+                output_list.extend(_find_series_recursive(d))
+        return output_list
+
+    if recursive:
+        return _find_series_recursive(path)
+    return _find_series_in_folder(path)[:1]
+
+
+def iter_dicom_series(series_list, max_in_flight=1, extraction_plan=None):
+    """
+    Loads dicom series one at a time, in the order of ``series_list``.
+    A background thread reads ahead at most ``max_in_flight`` series while the caller processes the
+    current one, and waits when they are not consumed yet. A series is released as soon as the caller
+    drops it, so the peak memory is bounded by max_in_flight + 1 series instead of the whole folder.
+
+    Parameters:
+        series_list (list): File lists, one per series, as returned by ``find_dicom_series``
+        max_in_flight (int): Number of series read ahead. 0 reads each series only when it is requested
+        extraction_plan (headers.TagExtractionPlan): If given, only the tags of the plan are read (see load_dicom)
+
+    Returns:
+        generator: dicom volumes with the BIDS headers
+    """
+    if max_in_flight <= 0:
+        for file_list in series_list:
+            yield _load_dicom_series(file_list, extraction_plan)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        try:
+            for file_list in series_list:
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(_load_dicom_series, file_list, extraction_plan))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
 def save_dicom(path, medical_volume, new_series = True):
     new_volume = headers.bids_volume_to_dicom(medical_volume, new_series)
     #print(new_volume.headers().shape)
@@ -46,9 +147,8 @@ def save_dicom(path, medical_volume, new_series = True):
     dicom_writer.save(new_volume, path)
 
 
-def load_bids(nii_file):
-    nifti_reader = NiftiReader()
-    medical_volume = nifti_reader.load(nii_file)
+def _get_json_base_name(nii_file):
+    """ Removes the .nii/.nii.gz extension from a file name """
     json_base_name = nii_file
 
     # remove extensions
@@ -56,6 +156,12 @@ def load_bids(nii_file):
         json_base_name = json_base_name[:-3]
     if json_base_name.lower().endswith('.nii'):
         json_base_name = json_base_name[:-4]
+    return json_base_name
+
+
+def _read_sidecars(nii_file):
+    """ Reads the json sidecars of a NIfTI file. Missing sidecars give empty headers """
+    json_base_name = _get_json_base_name(nii_file)
 
     try:
         with open(json_base_name + '.json', 'r') as f:
@@ -75,24 +181,138 @@ def load_bids(nii_file):
     except FileNotFoundError:
         extra_and_meta_header = {'extra': {}, 'meta': {}}
 
+    return bids_header, patient_header, extra_and_meta_header
+
+
+def _set_bids_headers(medical_volume, bids_header, patient_header, extra_and_meta_header):
     setattr(medical_volume, 'meta_header', extra_and_meta_header['meta'])
     setattr(medical_volume, 'bids_header', bids_header)
     setattr(medical_volume, 'patient_header', patient_header)
     setattr(medical_volume, 'extra_header', extra_and_meta_header['extra'])
 
+
+def load_bids(nii_file, mmap=False):
+    """
+    Loads a BIDS NIfTI file and its json sidecars.
+
+    Parameters:
+        nii_file (str): Path to the .nii or .nii.gz file
+        mmap (bool): If True, an uncompressed .nii file is memory-mapped read-only, so that slicing
+            the volume (or reducing it to a single echo) only reads the required data from disk
+
+    Returns:
+        MedicalVolume: the volume with the BIDS headers
+    """
+    nifti_reader = NiftiReader(mmap=mmap)
+    medical_volume = nifti_reader.load(nii_file)
+    _set_bids_headers(medical_volume, *_read_sidecars(nii_file))
     return medical_volume
 
 
-def save_bids(nii_file, medical_volume):
-    nifti_writer = NiftiWriter()
-    nifti_writer.save(medical_volume, nii_file)
-    json_base_name = nii_file
+def load_bids_many(paths, workers=4, max_in_flight=None, mmap=False):
+    """
+    Loads many BIDS datasets concurrently. NIfTI decompression and json parsing run in a thread pool
+    (zlib and file reads release the GIL), and the volumes are yielded in the order of ``paths``.
+    At most ``max_in_flight`` volumes are loaded ahead of the consumer, so memory stays bounded
+    when iterating over a large cohort.
 
-    # remove extensions
-    if json_base_name.lower().endswith('.gz'):
-        json_base_name = json_base_name[:-3]
-    if json_base_name.lower().endswith('.nii'):
-        json_base_name = json_base_name[:-4]
+    Parameters:
+        paths (iterable): Paths to the .nii or .nii.gz files
+        workers (int): Number of loader threads. 0 loads sequentially in the calling thread
+        max_in_flight (int): Maximum number of volumes loaded but not yet consumed. Defaults to 2 * workers
+        mmap (bool): Memory-map uncompressed files, see ``load_bids``
+
+    Returns:
+        generator: MedicalVolume objects with the BIDS headers, in input order
+
+    Examples:
+        >>> for t2_map in load_bids_many(find_bids('/data/study', 't2'), workers=8):
+        ...     process(t2_map)
+    """
+    if workers <= 0:
+        for path in paths:
+            yield load_bids(path, mmap=mmap)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    max_in_flight = max(max_in_flight, 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for path in paths:
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(load_bids, path, mmap))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # the consumer stopped early or a load failed: drop what was not started yet
+            for future in pending:
+                future.cancel()
+
+
+def load_bids_stack(paths, workers=4, dtype=None):
+    """
+    Loads same-shape BIDS datasets into a single preallocated array of shape (n_volumes, *volume_shape).
+    Each volume is copied into its slot by the loader thread and released, so the peak memory is the
+    batch plus one decoded volume per thread.
+
+    Parameters:
+        paths (list): Paths to the .nii or .nii.gz files
+        workers (int): Number of loader threads. 0 loads sequentially
+        dtype (np.dtype): Data type of the batch. Defaults to the data type of the first volume
+
+    Returns:
+        (np.ndarray, list): the batch array and the list of MedicalVolume objects with the BIDS headers.
+            The volume data of each MedicalVolume is a view of the corresponding slot of the batch
+
+    Raises:
+        ValueError: if the volumes do not all have the same shape
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError('No volumes to load')
+
+    first_volume = load_bids(paths[0])
+    if dtype is None:
+        dtype = first_volume.volume.dtype
+    batch = np.empty((len(paths),) + first_volume.shape, dtype=dtype)
+
+    def _load_into(index, medical_volume=None):
+        if medical_volume is None:
+            medical_volume = load_bids(paths[index])
+        if medical_volume.shape != first_volume.shape:
+            raise ValueError(f'Volume {paths[index]} has shape {medical_volume.shape}, '
+                             f'expected {first_volume.shape}')
+        batch[index] = medical_volume.volume
+        medical_volume.volume = batch[index]
+        return medical_volume
+
+    volumes = [_load_into(0, first_volume)]
+    if workers <= 0:
+        volumes.extend(_load_into(i) for i in range(1, len(paths)))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            volumes.extend(executor.map(_load_into, range(1, len(paths))))
+
+    return batch, volumes
+
+
+@instrumentation.profiled()
+def save_bids(nii_file, medical_volume, dtype_policy='native'):
+    """
+    Saves a medical volume as a NIfTI file with the BIDS json sidecars.
+
+    Parameters:
+        nii_file (str): Path to the .nii or .nii.gz file
+        medical_volume (MedicalVolume): The volume to save
+        dtype_policy (str): On-disk data type: 'native', 'float32' or 'int16' (scaled with scl_slope/scl_inter)
+    """
+    nifti_writer = NiftiWriter(dtype_policy=dtype_policy)
+    nifti_writer.save(medical_volume, nii_file)
+    json_base_name = _get_json_base_name(nii_file)
 
     extra_and_meta_header = {}
 
@@ -110,10 +330,47 @@ def save_bids(nii_file, medical_volume):
     with open(json_base_name + '_extra.json', 'w') as f:
         json.dump(extra_and_meta_header, f, indent=2)
 
+    if instrumentation.get_profiler() is not None:
+        instrumentation.add_counters(
+            bytes_written=sum(os.path.getsize(file) for file in
+                              [nii_file] + [json_base_name + suffix for suffix in ['.json', '_patient.json', '_extra.json']]))
+
+
+def move_bids(src_nii_file, dest_nii_file):
+    """
+    Moves a BIDS dataset (the NIfTI file and its json sidecars), replacing the destination if it exists.
+
+    Parameters:
+        src_nii_file (str): Path to the source .nii or .nii.gz file
+        dest_nii_file (str): Path to the destination .nii or .nii.gz file
+    """
+    os.replace(src_nii_file, dest_nii_file)
+    src_base_name = _get_json_base_name(src_nii_file)
+    dest_base_name = _get_json_base_name(dest_nii_file)
+    for sidecar in ['.json', '_patient.json', '_extra.json']:
+        if os.path.isfile(src_base_name + sidecar):
+            os.replace(src_base_name + sidecar, dest_base_name + sidecar)
+
+
+def remove_bids(nii_file):
+    """
+    Removes a BIDS dataset (the NIfTI file and its json sidecars). Missing files are ignored.
+
+    Parameters:
+        nii_file (str): Path to the .nii or .nii.gz file
+    """
+    base_name = _get_json_base_name(nii_file)
+    for file in [nii_file] + [base_name + sidecar for sidecar in ['.json', '_patient.json', '_extra.json']]:
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
 
 def find_bids(path, suffix):
     """
     Finds a bids dataset with a specific suffix (e.g. mese).
+    The folder is indexed on the first call; later calls reuse the index as long as the folder does not change.
 
     Parameters:
         path (str): Path to the root folder
@@ -123,13 +380,4 @@ def find_bids(path, suffix):
         list: List of paths to the bids datasets
     """
 
-    file_pattern = (suffix + '.nii.gz').lower()
-
-    found_files = []
-
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            if f.lower().endswith(file_pattern):
-                found_files.append(os.path.join(root, f))
-
-    return found_files
\ No newline at end of file
+    return bids_index.get_index(path).find(suffix=suffix, extension='.nii.gz')
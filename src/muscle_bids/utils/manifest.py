@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+
+import pydicom
+
+MANIFEST_FILE_NAME = '.mbids_manifest.json'
+_MANIFEST_VERSION = 1
+
+
+def fingerprint_files(file_list):
+    """
+    Computes a fingerprint of a list of files from their paths, sizes and modification times.
+    The content is not read, so the fingerprint is cheap even for large series.
+
+    Parameters:
+        file_list (list): Paths of the files
+
+    Returns:
+        str: hex digest of the fingerprint
+    """
+    digest = hashlib.sha1()
+    for file in sorted(os.path.abspath(f) for f in file_list):
+        stat = os.stat(file)
+        digest.update(f'{file}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_series_key(file_list):
+    """
+    Identifies a series by its SeriesInstanceUID and its folder (a series split over several folders is
+    converted once per folder).
+
+    Parameters:
+        file_list (list): Paths of the files of the series
+
+    Returns:
+        str: the key of the series in the manifest
+    """
+    folder = os.path.dirname(os.path.abspath(file_list[0]))
+    series_uid = ''
+    for file in file_list:
+        try:
+            ds = pydicom.dcmread(file, stop_before_pixels=True, specific_tags=['SeriesInstanceUID'])
+        except pydicom.errors.InvalidDicomError:
+            continue
+        series_uid = str(ds.get('SeriesInstanceUID', ''))
+        break
+    return f'{series_uid}@{folder}'
+
+
+class ConversionManifest:
+    """
+    Record of the series converted into an output folder, used to skip unchanged series in later runs.
+
+    For every series the manifest stores its SeriesInstanceUID, a fingerprint of its input files, the
+    converters that were applied with their version and the output files. A series is up to date if its
+    fingerprint, the conversion settings (converter versions, data type policy, pseudo name) and the
+    outputs are unchanged. The manifest is rewritten atomically after every series, so an interrupted
+    run resumes after the last series that was completely written.
+
+    Parameters:
+        output_dir (str): Root of the BIDS output
+        settings (dict): Conversion settings. Series converted with different settings are redone
+
+    Examples:
+        >>> manifest = ConversionManifest('/data/bids', settings={'dtype': None, 'anonymize': 'anon'})
+        >>> if not manifest.is_up_to_date(file_list):
+        ...     outputs = convert(file_list)  # [(ConverterClass, output_file), ...]
+        ...     manifest.record(file_list, outputs)
+    """
+
+    def __init__(self, output_dir, settings=None):
+        self.output_dir = output_dir
+        self.file_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self.settings = settings if settings is not None else {}
+        self.series = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.file_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('version') != _MANIFEST_VERSION:
+            return
+        self.series = manifest.get('series', {})
+
+    def save(self):
+        """ Writes the manifest atomically: a crash never leaves a truncated manifest """
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': _MANIFEST_VERSION, 'series': self.series}, f, indent=2)
+        os.replace(temp_path, self.file_path)
+
+    def is_up_to_date(self, file_list, key=None):
+        """
+        Checks whether a series was already converted from the same inputs with the same settings.
+
+        Parameters:
+            file_list (list): Paths of the files of the series
+            key (str): Key of the series, computed if not given
+
+        Returns:
+            bool: True if the conversion can be skipped
+        """
+        entry = self.series.get(key or get_series_key(file_list))
+        if entry is None:
+            return False
+        if entry['settings'] != self.settings or entry['fingerprint'] != fingerprint_files(file_list):
+            return False
+        return all(os.path.isfile(os.path.join(self.output_dir, output['path'])) for output in entry['outputs'])
+
+    def record(self, file_list, outputs, key=None):
+        """
+        Records a converted series and saves the manifest.
+
+        Parameters:
+            file_list (list): Paths of the files of the series
+            outputs (list): (converter class, output file) pairs
+            key (str): Key of the series, computed if not given
+        """
+        key = key or get_series_key(file_list)
+        self.series[key] = {
+            'series_uid': key.rsplit('@', 1)[0],
+            'fingerprint': fingerprint_files(file_list),
+            'settings': self.settings,
+            'outputs': [{'converter': converter_class.get_name(),
+                         'version': converter_class.get_version(),
+                         'path': os.path.relpath(output_file, self.output_dir)}
+                        for converter_class, output_file in outputs]
+        }
+        self.save()